@@ -0,0 +1,8 @@
+"""
+Бенчмарки ray-serve-vllm: генератор нагрузки, mock-сервер и микробенчмарки.
+
+    python -m benchmarks run --base-url http://<serve>:8000 --model Gemma-3 --concurrency 1,4,8,16
+    python -m benchmarks mock --port 8000 --itl 0.116
+    python -m benchmarks selftest
+    python -m benchmarks tune --slo "ttft_p95<10" --concurrency 8
+"""
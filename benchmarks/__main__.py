@@ -0,0 +1,336 @@
+"""
+CLI пакета benchmarks (запускать из корня репозитория: python -m benchmarks ...).
+
+run      — прогон/свип против живого деплоя или mock-сервера, результаты в схеме llmperf;
+mock     — поднять mock OpenAI-совместимый сервер;
+selftest — mock + короткий прогон на CPU с проверкой метрик и схемы результатов;
+report   — Markdown-отчет по каталогу прогонов;
+compare  — сравнение двух прогонов/деревьев прогонов, код выхода 1 при регрессии;
+tune     — подбор параметров движка под SLO (successive halving) на симуляторе или свежих деплоях;
+features — ITL с prefix caching / спекулятивным декодированием и без них (свежий деплой на вариант).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import List
+
+from benchmarks.loadgen import LoadConfig, run_load
+from benchmarks.mock_server import MockEngineConfig, MockOpenAIServer
+from benchmarks.results import write_results
+
+REFERENCE_SUMMARY = Path(__file__).resolve().parent.parent / "llmperf_test_results" / "baseline" / "Gemma-3_550_150_summary.json"
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _sweep_points(args: argparse.Namespace):
+    """Точки свипа и имена каталогов — как в llmperf_test_results/README.md."""
+    for c in args.concurrency:
+        for length in args.input_tokens:
+            if len(args.concurrency) > 1 and len(args.input_tokens) > 1:
+                name = f"concurrency_{c}_context_{length}"
+            elif len(args.concurrency) > 1:
+                name = f"concurrency_{c}"
+            elif len(args.input_tokens) > 1:
+                name = f"context_{length}"
+            else:
+                name = ""
+            stddev = args.stddev_input_tokens if args.stddev_input_tokens is not None else (
+                length // 4 if len(args.input_tokens) > 1 else 150
+            )
+            yield name, c, length, stddev
+
+
+async def _run(args: argparse.Namespace) -> int:
+    for name, concurrency, length, stddev in _sweep_points(args):
+        config = LoadConfig(
+            base_url=args.base_url,
+            model=args.model,
+            username=args.username or os.environ.get("BENCH_USERNAME", ""),
+            password=args.password or os.environ.get("BENCH_PASSWORD", ""),
+            endpoint=args.endpoint,
+            mean_input_tokens=length,
+            stddev_input_tokens=stddev,
+            mean_output_tokens=args.mean_output_tokens,
+            stddev_output_tokens=args.stddev_output_tokens,
+            num_concurrent_requests=concurrency,
+            max_num_completed_requests=args.max_num_completed_requests,
+            timeout_s=args.timeout,
+            additional_sampling_params=json.loads(args.additional_sampling_params),
+        )
+        result = await run_load(config)
+        path = write_results(Path(args.results_dir) / name, result["summary"], result["records"])
+        s = result["summary"]
+        print(f"{path.parent}: concurrency={concurrency} input={length} "
+              f"ttft_p95={s['results_ttft_s_quantiles_p95']:.3f}s itl_mean={s['results_inter_token_latency_s_mean']:.3f}s "
+              f"throughput={s['results_mean_output_throughput_token_per_s']:.2f} tok/s errors={s['results_number_errors']}")
+    return 0
+
+
+async def _mock(args: argparse.Namespace) -> int:
+    server = MockOpenAIServer(MockEngineConfig(
+        ttft_base_s=args.ttft, ttft_per_input_token_s=args.ttft_per_token, itl_s=args.itl,
+        jitter=args.jitter, max_concurrency=args.max_concurrency, model=args.model,
+    ))
+    print(f"mock OpenAI server on http://{args.host}:{args.port}")
+    await server.serve_forever(args.host, args.port)
+    return 0
+
+
+async def _selftest(args: argparse.Namespace) -> int:
+    """Проверяет, что генератор нагрузки правильно меряет известные задержки mock-сервера."""
+    itl, ttft = 0.01, 0.05
+    server = MockOpenAIServer(MockEngineConfig(ttft_base_s=ttft, itl_s=itl))
+    port = await server.start()
+    failures = []
+    try:
+        for concurrency in (1, 4):
+            result = await run_load(LoadConfig(
+                base_url=f"http://127.0.0.1:{port}", model="Gemma-3", mean_input_tokens=64,
+                stddev_input_tokens=8, mean_output_tokens=20, stddev_output_tokens=0,
+                num_concurrent_requests=concurrency, max_num_completed_requests=8, timeout_s=60,
+            ))
+            s = result["summary"]
+            # Ожидаемые значения для ITL в определении llmperf: (ttft + (n-1)*itl) / n
+            expected_itl = (ttft + 19 * itl) / 20
+            checks = {
+                "errors": (s["results_number_errors"], 0, 0),
+                "ttft_mean": (s["results_ttft_s_mean"], ttft, ttft * 0.5 + 0.02),
+                "itl_mean": (s["results_inter_token_latency_s_mean"], expected_itl, expected_itl * 0.5),
+                "completed": (s["results_num_completed_requests"], 8, 0),
+            }
+            for name, (got, want, tol) in checks.items():
+                status = "ok" if abs(got - want) <= tol else "FAIL"
+                if status == "FAIL":
+                    failures.append(f"concurrency={concurrency} {name}: got {got}, want {want}±{tol}")
+                print(f"concurrency={concurrency:<2} {name:<10} got={got:<10.4g} want={want:<10.4g} {status}")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                path = write_results(Path(tmp), s, result["records"])
+                keys = set(json.loads(path.read_text()))
+            if REFERENCE_SUMMARY.exists():
+                reference = set(json.loads(REFERENCE_SUMMARY.read_text()))
+                if keys != reference:
+                    failures.append(f"summary schema differs from {REFERENCE_SUMMARY.name}: {sorted(keys ^ reference)}")
+    finally:
+        await server.close()
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    print("selftest: " + ("FAILED" if failures else "passed"))
+    return 1 if failures else 0
+
+
+async def _report(args: argparse.Namespace) -> int:
+    from benchmarks.compare import build_report  # numpy нужен только отчетам
+
+    report = build_report(Path(args.results_dir))
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+    return 0
+
+
+async def _compare(args: argparse.Namespace) -> int:
+    from benchmarks.compare import compare_runs, comparison_table, pair_runs
+
+    pairs = pair_runs(Path(args.base), Path(args.new))
+    if not pairs:
+        print(f"no matching runs in {args.base} and {args.new}", file=sys.stderr)
+        return 2
+    comparisons = []
+    for base, new in pairs:
+        comparisons += compare_runs(base, new, threshold=args.threshold, confidence=args.confidence,
+                                    resamples=args.resamples, seed=args.seed)
+    print(comparison_table(comparisons, args.confidence))
+    regressions = [c for c in comparisons if c.regression]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+async def _tune(args: argparse.Namespace) -> int:
+    from benchmarks import tuner  # numpy нужен только тюнеру
+
+    slos = tuner.parse_slos(args.slo)
+    space = json.loads(Path(args.space).read_text() if os.path.exists(args.space) else args.space) \
+        if args.space else tuner.DEFAULT_SPACE
+    workload = LoadConfig(
+        base_url=args.base_url,
+        model=args.model,
+        username=args.username or os.environ.get("BENCH_USERNAME", ""),
+        password=args.password or os.environ.get("BENCH_PASSWORD", ""),
+        mean_input_tokens=args.input_tokens,
+        stddev_input_tokens=args.stddev_input_tokens,
+        mean_output_tokens=args.mean_output_tokens,
+        stddev_output_tokens=args.stddev_output_tokens,
+        num_concurrent_requests=args.concurrency,
+        timeout_s=args.timeout,
+    )
+    if args.runner == "sim":
+        runs = tuner.load_reference_runs(Path(args.reference_dir))
+        model = tuner.CostModel.fit(runs, seed=args.seed)
+        print(f"cost model fitted on {len(runs)} runs from {args.reference_dir}, "
+              f"mean relative error {model.fit_error:.1%}\n")
+        print(tuner.calibration_table(model, runs, seed=args.seed) + "\n")
+        runner = tuner.SimulatedRunner(model, args.max_model_len)
+    else:
+        runner = tuner.DeploymentRunner(args.deploy_cmd, ready_timeout_s=args.ready_timeout)
+
+    def report(trial: "tuner.Trial") -> None:
+        s = trial.summary
+        status = trial.error or ("ok" if trial.feasible else "violates SLO")
+        print(f"rung {trial.rung} requests={trial.requests} {tuner.to_env(trial.params)} "
+              f"ttft_p95={s.get('results_ttft_s_quantiles_p95', float('nan')):.2f}s "
+              f"throughput={s.get(tuner.THROUGHPUT_KEY, float('nan')):.1f} tok/s {status}", flush=True)
+
+    configs = tuner.candidates(space, args.max_model_len, args.configs, args.seed)
+    trials = await tuner.successive_halving(
+        runner, configs, workload, slos, min_requests=args.min_requests, max_requests=args.max_requests,
+        eta=args.eta, seed=args.seed, on_trial=report,
+    )
+    if args.trials_output:
+        Path(args.trials_output).write_text(json.dumps([t.to_dict() for t in trials], indent=4))
+    winner = tuner.best(trials)
+    if winner is None:
+        print("no configuration could be benchmarked", file=sys.stderr)
+        return 2
+    tuner.write_env(Path(args.output), winner, slos, workload)
+    print(f"\n{'winner' if winner.feasible else 'no candidate meets the SLO; closest'}: "
+          f"{tuner.to_env(winner.params)} → {args.output}")
+    return 0 if winner.feasible else 1
+
+
+async def _features(args: argparse.Namespace) -> int:
+    from benchmarks import features
+    from benchmarks.tuner import DeploymentRunner
+
+    variants = dict(features.parse_variant(v) for v in args.variant) if args.variant else features.DEFAULT_VARIANTS
+    workload = LoadConfig(
+        base_url=args.base_url,
+        model=args.model,
+        username=args.username or os.environ.get("BENCH_USERNAME", ""),
+        password=args.password or os.environ.get("BENCH_PASSWORD", ""),
+        mean_input_tokens=args.input_tokens,
+        stddev_input_tokens=args.stddev_input_tokens,
+        mean_output_tokens=args.mean_output_tokens,
+        stddev_output_tokens=args.stddev_output_tokens,
+        num_concurrent_requests=args.concurrency,
+        max_num_completed_requests=args.max_num_completed_requests,
+        timeout_s=args.timeout,
+        system_prompt_tokens=args.system_prompt_tokens,
+    )
+    runner = DeploymentRunner(args.deploy_cmd, ready_timeout_s=args.ready_timeout)
+    rows = await features.run_variants(runner, variants, workload, Path(args.results_dir))
+    table = features.itl_table(rows)
+    (Path(args.results_dir) / "README.md").write_text(table + "\n")
+    print(table)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Load test / sweep against a deployment")
+    run.add_argument("--base-url", required=True)
+    run.add_argument("--model", default="Gemma-3")
+    run.add_argument("--username", default="")
+    run.add_argument("--password", default="")
+    run.add_argument("--endpoint", default="/v1/chat/completions")
+    run.add_argument("--concurrency", type=_int_list, default=[1], help="Например 1,4,8,16")
+    run.add_argument("--input-tokens", type=_int_list, default=[550], help="Например 512,2048,8192")
+    run.add_argument("--stddev-input-tokens", type=int, default=None)
+    run.add_argument("--mean-output-tokens", type=int, default=150)
+    run.add_argument("--stddev-output-tokens", type=int, default=10)
+    run.add_argument("--max-num-completed-requests", type=int, default=30)
+    run.add_argument("--timeout", type=float, default=600)
+    run.add_argument("--additional-sampling-params", default="{}")
+    run.add_argument("--results-dir", default="results")
+
+    mock = sub.add_parser("mock", help="Run the mock OpenAI-compatible streaming server")
+    mock.add_argument("--host", default="127.0.0.1")
+    mock.add_argument("--port", type=int, default=8000)
+    mock.add_argument("--model", default="Gemma-3")
+    mock.add_argument("--ttft", type=float, default=0.05, help="Базовый TTFT, с")
+    mock.add_argument("--ttft-per-token", type=float, default=0.0, help="Добавка к TTFT на входной токен, с")
+    mock.add_argument("--itl", type=float, default=0.01, help="Задержка между токенами, с")
+    mock.add_argument("--jitter", type=float, default=0.0)
+    mock.add_argument("--max-concurrency", type=int, default=0)
+
+    sub.add_parser("selftest", help="CPU-only regression check of the load generator against the mock server")
+
+    report = sub.add_parser("report", help="Markdown report for a directory of runs")
+    report.add_argument("results_dir")
+    report.add_argument("--output", default="")
+
+    compare = sub.add_parser("compare", help="Bootstrap comparison of two runs; exit 1 on regression")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.05, help="Допустимое относительное ухудшение")
+    compare.add_argument("--confidence", type=float, default=0.95)
+    compare.add_argument("--resamples", type=int, default=5000)
+    compare.add_argument("--seed", type=int, default=0)
+
+    tune = sub.add_parser("tune", help="Search engine parameters against an SLO; writes the winning env file")
+    tune.add_argument("--slo", required=True, help='Например "ttft_p95<10" или "ttft_p95<5,itl_mean<0.15"')
+    tune.add_argument("--runner", choices=("sim", "deploy"), default="sim",
+                      help="sim — модель движка по llmperf_test_results; deploy — свежий деплой на конфигурацию")
+    tune.add_argument("--concurrency", type=int, default=8)
+    tune.add_argument("--input-tokens", type=int, default=550)
+    tune.add_argument("--stddev-input-tokens", type=int, default=150)
+    tune.add_argument("--mean-output-tokens", type=int, default=150)
+    tune.add_argument("--stddev-output-tokens", type=int, default=10)
+    tune.add_argument("--max-model-len", type=int, default=int(os.environ.get("MAX_MODEL_LEN", "4096")))
+    tune.add_argument("--space", default="", help="JSON (строка или файл): {\"MAX_NUM_SEQS\": [8, 16], ...}")
+    tune.add_argument("--configs", type=int, default=27, help="Конфигураций в первом круге")
+    tune.add_argument("--eta", type=int, default=3)
+    tune.add_argument("--min-requests", type=int, default=10)
+    tune.add_argument("--max-requests", type=int, default=90)
+    tune.add_argument("--seed", type=int, default=0)
+    tune.add_argument("--output", default="tuned.env")
+    tune.add_argument("--trials-output", default="", help="JSON со всеми испытаниями")
+    tune.add_argument("--reference-dir", default=str(REFERENCE_SUMMARY.parent.parent))
+    tune.add_argument("--deploy-cmd", default="serve run --app-dir ray-serve-vllm serve:model")
+    tune.add_argument("--base-url", default="http://127.0.0.1:8000")
+    tune.add_argument("--model", default="Gemma-3")
+    tune.add_argument("--username", default="")
+    tune.add_argument("--password", default="")
+    tune.add_argument("--timeout", type=float, default=600)
+    tune.add_argument("--ready-timeout", type=float, default=1800, help="Ожидание готовности деплоя, с")
+
+    feats = sub.add_parser("features", help="ITL with and without prefix caching / speculative decoding")
+    feats.add_argument("--variant", action="append", default=[],
+                       help='Имя:ENV=VAL,... (повторяемый); первый — точка отсчета. По умолчанию baseline, '
+                            'prefix_caching, ngram')
+    feats.add_argument("--concurrency", type=int, default=1, help="ITL без очереди — по умолчанию 1, как baseline")
+    feats.add_argument("--input-tokens", type=int, default=550)
+    feats.add_argument("--stddev-input-tokens", type=int, default=150)
+    feats.add_argument("--mean-output-tokens", type=int, default=150)
+    feats.add_argument("--stddev-output-tokens", type=int, default=10)
+    feats.add_argument("--system-prompt-tokens", type=int, default=1024, help="Общий префикс запросов")
+    feats.add_argument("--max-num-completed-requests", type=int, default=30)
+    feats.add_argument("--results-dir", default="results/features")
+    feats.add_argument("--deploy-cmd", default="serve run --app-dir ray-serve-vllm serve:model")
+    feats.add_argument("--base-url", default="http://127.0.0.1:8000")
+    feats.add_argument("--model", default="Gemma-3")
+    feats.add_argument("--username", default="")
+    feats.add_argument("--password", default="")
+    feats.add_argument("--timeout", type=float, default=600)
+    feats.add_argument("--ready-timeout", type=float, default=1800)
+
+    args = parser.parse_args()
+    handler = {"run": _run, "mock": _mock, "selftest": _selftest, "report": _report, "compare": _compare,
+               "tune": _tune, "features": _features}[args.command]
+    return asyncio.run(handler(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Микробенчмарк кеша JWT из ray-serve-vllm/auth.py.
+
+Имитирует event loop реплики: N корутин одновременно проверяют токены ограниченного
+набора клиентов (каждый клиент шлет один и тот же токен всё время его жизни).
+Сравниваем запросы/с с кешем и без него.
+
+Запуск (нужен PyJWT и fastapi, как в образе):
+    python benchmarks/auth_cache.py --concurrency 1024 --requests 200000 --clients 64
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "ray-serve-vllm"))
+
+import auth  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+
+
+async def _run(credentials, concurrency: int, total: int) -> float:
+    per_worker = total // concurrency
+
+    async def worker(offset: int) -> None:
+        for i in range(per_worker):
+            auth.verify_jwt_token(credentials[(offset + i) % len(credentials)])
+            await asyncio.sleep(0)  # Отдаем управление, как это делает обработчик запроса
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return per_worker * concurrency / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JWT cache microbenchmark")
+    parser.add_argument("--concurrency", type=int, default=1024)
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--clients", type=int, default=64, help="Число различных токенов")
+    args = parser.parse_args()
+
+    credentials = [
+        HTTPAuthorizationCredentials(
+            scheme="Bearer",
+            credentials=auth.create_access_token({"sub": f"user{i}", "role": "admin"}, timedelta(minutes=60)),
+        )
+        for i in range(args.clients)
+    ]
+
+    results = {}
+    for label, maxsize in (("no cache", 0), ("cache", max(auth.JWT_CACHE_SIZE, args.clients))):
+        auth.TOKEN_CACHE = auth.TokenCache(maxsize=maxsize)
+        results[label] = asyncio.run(_run(credentials, args.concurrency, args.requests))
+        print(f"{label:>8}: {results[label]:>12,.0f} req/s  stats={auth.TOKEN_CACHE.stats()}")
+
+    print(f"speedup: x{results['cache'] / results['no cache']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Сравнение прогонов и отчеты по каталогам результатов в схеме llmperf.
+
+report  — Markdown-таблицы по всем прогонам каталога (как в llmperf_test_results/README.md)
+          и кривые throughput/латентность от конкурентности;
+compare — два прогона (или два дерева прогонов с одинаковыми подкаталогами): bootstrap-интервалы
+          для относительного изменения mean/p95 и флаг регрессии; код выхода 1 при регрессии.
+"""
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Метрика → "больше — лучше?"
+LATENCY_METRICS = ("ttft_s", "inter_token_latency_s", "end_to_end_latency_s")
+THROUGHPUT_METRICS = ("request_output_throughput_token_per_s",)
+QUANTILES = np.array([0.25, 0.5, 0.75, 0.9, 0.95, 0.99])
+
+
+@dataclass
+class Run:
+    name: str
+    path: Path
+    summary: Dict
+    samples: Dict[str, np.ndarray]  # Метрика → значения по успешным запросам
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.summary.get("num_concurrent_requests", 0))
+
+
+def load_run(path: Path) -> Optional[Run]:
+    """Загружает пару *_summary.json / *_individual_responses.json; None, если каталог не прогон."""
+    summaries = sorted(path.glob("*_summary.json"))
+    responses = sorted(path.glob("*_individual_responses.json"))
+    if not summaries or not responses:
+        return None
+    summary = json.loads(summaries[0].read_text())
+    # В correctness-прогонах метрики вложены в поле "metrics"
+    records = [r.get("metrics", r) for r in json.loads(responses[0].read_text())]
+    records = [r for r in records if not r.get("error_code")]
+    samples = {
+        metric: np.array([r[metric] for r in records if metric in r], dtype=float)
+        for metric in LATENCY_METRICS + THROUGHPUT_METRICS
+    }
+    return Run(name=path.name, path=path, summary=summary, samples=samples)
+
+
+def discover_runs(root: Path) -> List[Run]:
+    """Сам root или его подкаталоги; порядок — естественная сортировка имен (concurrency_4 < concurrency_16)."""
+    run = load_run(root)
+    if run is not None:
+        return [run]
+
+    def natural(p: Path) -> Tuple:
+        return tuple(int(t) if t.isdigit() else t for t in re.split(r"(\d+)", p.name))
+
+    runs = [load_run(p) for p in sorted((p for p in root.iterdir() if p.is_dir()), key=natural)]
+    return [r for r in runs if r is not None]
+
+
+# -------------------------
+# Отчет
+# -------------------------
+def quantile_table(runs: Iterable[Run], metric: str) -> str:
+    """Квантили метрики по всем прогонам разом (np.quantile по строкам матрицы с NaN-паддингом)."""
+    runs = [r for r in runs if r.samples[metric].size]
+    if not runs:
+        return ""
+    width = max(r.samples[metric].size for r in runs)
+    matrix = np.full((len(runs), width), np.nan)
+    for i, r in enumerate(runs):
+        matrix[i, :r.samples[metric].size] = r.samples[metric]
+    q = np.nanquantile(matrix, QUANTILES, axis=1).T  # (runs, quantiles)
+    means = np.nanmean(matrix, axis=1)
+    header = "| Прогон | mean | " + " | ".join(f"p{int(x * 100)}" for x in QUANTILES) + " |"
+    lines = [f"#### `{metric}`", "", header, "|" + " --- |" * (len(QUANTILES) + 2)]
+    for r, row, mean in zip(runs, q, means):
+        lines.append(f"| {r.name} | {mean:.3f} | " + " | ".join(f"{v:.3f}" for v in row) + " |")
+    return "\n".join(lines)
+
+
+def overview_table(runs: List[Run]) -> str:
+    """Таблица в формате README: throughput, ITL и TTFT (средние из summary)."""
+    lines = [
+        "| Прогон | Concurrent | Вход, tok | Throughput, tok/s | inter\\_token\\_latency\\_s, с | ttft\\_s, с |",
+        "| --- | --- | --- | --- | --- | --- |",
+    ]
+    for r in runs:
+        s = r.summary
+        if "results_mean_output_throughput_token_per_s" not in s:
+            continue
+        lines.append(
+            f"| {r.name} | {r.concurrency} | {s.get('mean_input_tokens', '')} "
+            f"| {s['results_mean_output_throughput_token_per_s']:.2f} "
+            f"| {s['results_inter_token_latency_s_mean']:.3f} | {s['results_ttft_s_mean']:.2f} |"
+        )
+    return "\n".join(lines)
+
+
+def concurrency_curves(runs: List[Run]) -> str:
+    """
+    Кривые по конкурентности для прогонов с одинаковой формой нагрузки (вход/выход).
+    Эффективность = throughput / (c * throughput при минимальном c); пик отмечен звездочкой.
+    """
+    groups: Dict[Tuple, List[Run]] = {}
+    for r in runs:
+        s = r.summary
+        if "results_mean_output_throughput_token_per_s" not in s:
+            continue
+        groups.setdefault((s.get("mean_input_tokens"), s.get("mean_output_tokens")), []).append(r)
+
+    out = []
+    for (mean_in, mean_out), group in groups.items():
+        by_c: Dict[int, Run] = {}
+        for r in sorted(group, key=lambda r: r.concurrency):
+            by_c.setdefault(r.concurrency, r)  # Для одинакового c берем первый по имени прогон
+        if len(by_c) < 2:
+            continue
+        c = np.array(list(by_c), dtype=float)
+        throughput = np.array([r.summary["results_mean_output_throughput_token_per_s"] for r in by_c.values()])
+        ttft_p95 = np.array([r.summary["results_ttft_s_quantiles_p95"] for r in by_c.values()])
+        itl_p95 = np.array([r.summary["results_inter_token_latency_s_quantiles_p95"] for r in by_c.values()])
+        efficiency = throughput / (c * throughput[0] / c[0])
+        peak = int(np.argmax(throughput))
+        out += [
+            f"#### Вход {mean_in} / выход {mean_out} tok",
+            "",
+            "| Concurrent | Throughput, tok/s | Эффективность | ttft p95, с | itl p95, с |",
+            "| --- | --- | --- | --- | --- |",
+        ]
+        for i, run in enumerate(by_c.values()):
+            mark = " *" if i == peak else ""
+            out.append(f"| {run.concurrency}{mark} | {throughput[i]:.2f} | {efficiency[i]:.0%} "
+                       f"| {ttft_p95[i]:.2f} | {itl_p95[i]:.3f} |")
+        out.append("")
+    return "\n".join(out)
+
+
+def build_report(root: Path) -> str:
+    runs = discover_runs(root)
+    parts = [f"# Отчет по {root}", "", "## Сводка", "", overview_table(runs), "",
+             "## Throughput и латентность от конкурентности", "", concurrency_curves(runs),
+             "## Квантили по запросам", ""]
+    for metric in LATENCY_METRICS + THROUGHPUT_METRICS:
+        table = quantile_table(runs, metric)
+        if table:
+            parts += [table, ""]
+    return "\n".join(parts)
+
+
+# -------------------------
+# Сравнение с bootstrap
+# -------------------------
+@dataclass
+class Comparison:
+    run: str
+    metric: str
+    statistic: str
+    base: float
+    new: float
+    ci_low: float  # Доверительный интервал относительного изменения (new - base) / base
+    ci_high: float
+    regression: bool
+    improvement: bool
+
+
+def bootstrap_relative_change(
+        base: np.ndarray,
+        new: np.ndarray,
+        statistic: str,
+        resamples: int,
+        confidence: float,
+        rng: np.random.Generator,
+) -> Tuple[float, float]:
+    """Перцентильный bootstrap: все ресэмплы одной матрицей индексов (resamples × n)."""
+    def stat(samples: np.ndarray) -> np.ndarray:
+        if statistic == "mean":
+            return samples.mean(axis=1)
+        return np.quantile(samples, 0.95, axis=1)
+
+    base_stats = stat(base[rng.integers(0, base.size, size=(resamples, base.size))])
+    new_stats = stat(new[rng.integers(0, new.size, size=(resamples, new.size))])
+    change = (new_stats - base_stats) / base_stats
+    alpha = (1.0 - confidence) / 2
+    low, high = np.quantile(change, [alpha, 1.0 - alpha])
+    return float(low), float(high)
+
+
+def compare_runs(
+        base: Run,
+        new: Run,
+        threshold: float = 0.05,
+        confidence: float = 0.95,
+        resamples: int = 5000,
+        seed: int = 0,
+) -> List[Comparison]:
+    """
+    Регрессия — если весь доверительный интервал хуже порога: для латентности
+    ci_low > +threshold, для throughput ci_high < -threshold. Улучшение — симметрично.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for metric in LATENCY_METRICS + THROUGHPUT_METRICS:
+        a, b = base.samples[metric], new.samples[metric]
+        if a.size < 2 or b.size < 2:
+            continue
+        higher_is_better = metric in THROUGHPUT_METRICS
+        for statistic in ("mean", "p95"):
+            point_a = float(a.mean() if statistic == "mean" else np.quantile(a, 0.95))
+            point_b = float(b.mean() if statistic == "mean" else np.quantile(b, 0.95))
+            low, high = bootstrap_relative_change(a, b, statistic, resamples, confidence, rng)
+            if higher_is_better:
+                regression, improvement = high < -threshold, low > threshold
+            else:
+                regression, improvement = low > threshold, high < -threshold
+            results.append(Comparison(new.name, metric, statistic, point_a, point_b, low, high,
+                                      regression, improvement))
+    return results
+
+
+def pair_runs(base_root: Path, new_root: Path) -> List[Tuple[Run, Run]]:
+    """Два прогона напрямую или деревья прогонов, сопоставленные по имени подкаталога."""
+    base_single, new_single = load_run(base_root), load_run(new_root)
+    if base_single and new_single:
+        return [(base_single, new_single)]
+    base_runs = {r.name: r for r in discover_runs(base_root)}
+    return [(base_runs[r.name], r) for r in discover_runs(new_root) if r.name in base_runs]
+
+
+def comparison_table(comparisons: List[Comparison], confidence: float) -> str:
+    lines = [
+        f"| Прогон | Метрика | Статистика | База | Новый | Изменение, {confidence:.0%} ДИ | Вердикт |",
+        "| --- | --- | --- | --- | --- | --- | --- |",
+    ]
+    for c in comparisons:
+        verdict = "**регрессия**" if c.regression else ("улучшение" if c.improvement else "—")
+        lines.append(f"| {c.run} | `{c.metric}` | {c.statistic} | {c.base:.3f} | {c.new:.3f} "
+                     f"| [{c.ci_low:+.1%}, {c.ci_high:+.1%}] | {verdict} |")
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""
+ITL с prefix caching и спекулятивным декодированием и без них (engine_features.py в ray-serve-vllm).
+
+Каждый вариант — свежий деплой с переменными окружения варианта (tuner.DeploymentRunner) и прогон
+benchmarks.loadgen на одной и той же нагрузке (одинаковый seed). Доли попаданий prefix cache и принятых
+draft-токенов считаются по приросту счетчиков vLLM в /metrics за прогон. Результаты — в схеме llmperf
+по каталогу на вариант (их же можно сравнить командой compare) и таблица относительно первого варианта.
+"""
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from benchmarks.loadgen import LoadConfig, run_load
+from benchmarks.results import write_results
+from benchmarks.tuner import DeploymentRunner
+
+# Первый вариант — точка отсчета. Prefix caching в V1 включен по умолчанию, поэтому в базе он выключен явно
+DEFAULT_VARIANTS: Dict[str, Dict[str, str]] = {
+    "baseline": {"ENABLE_PREFIX_CACHING": "False"},
+    "prefix_caching": {"ENABLE_PREFIX_CACHING": "True"},
+    "ngram": {"ENABLE_PREFIX_CACHING": "False", "SPECULATIVE_METHOD": "ngram", "NUM_SPECULATIVE_TOKENS": "3"},
+}
+# Счетчики vLLM V1 (без суффикса _total); prefix cache в части версий — с префиксом gpu_
+_COUNTERS = {
+    "prefix_queries": ("vllm:prefix_cache_queries", "vllm:gpu_prefix_cache_queries"),
+    "prefix_hits": ("vllm:prefix_cache_hits", "vllm:gpu_prefix_cache_hits"),
+    "draft_tokens": ("vllm:spec_decode_num_draft_tokens",),
+    "accepted_tokens": ("vllm:spec_decode_num_accepted_tokens",),
+}
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{[^}]*\})?\s+([0-9.eE+-]+|NaN)$")
+
+
+def parse_variant(text: str) -> Tuple[str, Dict[str, str]]:
+    """"ngram5:SPECULATIVE_METHOD=ngram,NUM_SPECULATIVE_TOKENS=5" → имя и переменные окружения."""
+    name, _, assignments = text.partition(":")
+    env = dict(item.split("=", 1) for item in assignments.split(",") if item.strip())
+    return name.strip(), {k.strip(): v.strip() for k, v in env.items()}
+
+
+async def scrape_counters(base_url: str) -> Dict[str, float]:
+    """Суммы счетчиков по всем сериям (движков может быть несколько) из /metrics реплики."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+        text = (await client.get("/metrics")).text
+    totals = {key: 0.0 for key in _COUNTERS}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        metric = match.group(1).removesuffix("_total")
+        for key, names in _COUNTERS.items():
+            if metric in names:
+                totals[key] += float(match.group(2))
+    return totals
+
+
+async def run_variants(runner: DeploymentRunner, variants: Dict[str, Dict[str, str]], workload: LoadConfig,
+                       results_dir: Path) -> List[Dict[str, Any]]:
+    rows = []
+    for name, env in variants.items():
+        async with runner.deployment(env, workload.base_url):
+            before = await scrape_counters(workload.base_url)
+            result = await run_load(workload)
+            after = await scrape_counters(workload.base_url)
+        delta = {key: after[key] - before[key] for key in after}
+        engine = {
+            "prefix_cache_hit_rate": delta["prefix_hits"] / delta["prefix_queries"] if delta["prefix_queries"] else None,
+            "spec_decode_acceptance_rate": (
+                delta["accepted_tokens"] / delta["draft_tokens"] if delta["draft_tokens"] else None
+            ),
+        }
+        path = write_results(results_dir / name, result["summary"], result["records"])
+        (path.parent / "engine_features.json").write_text(json.dumps({"env": env, **engine}, indent=4))
+        rows.append({"variant": name, "env": env, "summary": result["summary"], **engine})
+    return rows
+
+
+def itl_table(rows: List[Dict[str, Any]]) -> str:
+    """Markdown: ITL/TTFT/throughput по вариантам, изменение ITL относительно первого варианта."""
+    def fmt(value: Any, spec: str) -> str:
+        return "—" if value is None else format(value, spec)
+
+    base_itl = rows[0]["summary"]["results_inter_token_latency_s_mean"] if rows else None
+    lines = [
+        "| Вариант | ITL mean, с | ITL p95, с | Δ ITL | TTFT mean, с | Throughput, tok/s | Принято draft | Prefix cache hit |",
+        "| --- | --- | --- | --- | --- | --- | --- | --- |",
+    ]
+    for row in rows:
+        s = row["summary"]
+        itl = s["results_inter_token_latency_s_mean"]
+        lines.append(
+            f"| {row['variant']} | {itl:.3f} | {s['results_inter_token_latency_s_quantiles_p95']:.3f} "
+            f"| {itl / base_itl - 1:+.1%} | {s['results_ttft_s_mean']:.2f} "
+            f"| {s['results_mean_output_throughput_token_per_s']:.2f} "
+            f"| {fmt(row['spec_decode_acceptance_rate'], '.1%')} | {fmt(row['prefix_cache_hit_rate'], '.1%')} |"
+        )
+    return "\n".join(lines)
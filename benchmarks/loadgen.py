@@ -0,0 +1,154 @@
+"""
+Асинхронный генератор нагрузки для VLLMDeployment: /token → /v1/chat/completions (SSE).
+
+Замкнутая петля как у llmperf: num_concurrent_requests воркеров шлют запросы друг за другом,
+пока не наберется max_num_completed_requests; все воркеры делят один пул соединений httpx.
+"""
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.results import request_metrics, summarize
+
+# Словарь коротких слов: ~1 токен на слово у распространенных токенизаторов
+_WORDS = (
+    "the of and to in is was for on are with as his they at be this from have or by one had not but "
+    "what all were when we there can an your which their said if do will each about how up out them "
+    "then she many some so these would other into has more her two like him see time could no make "
+    "than first been its who now people my made over did down only way find use may water long little"
+).split()
+
+
+@dataclass
+class LoadConfig:
+    base_url: str
+    model: str
+    username: str = ""
+    password: str = ""
+    endpoint: str = "/v1/chat/completions"
+    mean_input_tokens: int = 550
+    stddev_input_tokens: int = 150
+    mean_output_tokens: int = 150
+    stddev_output_tokens: int = 10
+    num_concurrent_requests: int = 1
+    max_num_completed_requests: int = 30
+    timeout_s: float = 600.0
+    additional_sampling_params: Dict[str, Any] = field(default_factory=dict)
+    seed: int = 0
+    system_prompt_tokens: int = 0  # Общий для всех запросов system prompt (проверка prefix caching); 0 — как llmperf
+
+
+def make_prompt(rng: random.Random, num_tokens: int, num_output_tokens: int) -> str:
+    """Промпт из случайных слов заданной длины, с инструкцией в духе llmperf."""
+    header = f"Randomly stream words from the following text with {num_output_tokens} output tokens. "
+    return header + " ".join(rng.choice(_WORDS) for _ in range(max(num_tokens, 1)))
+
+
+async def fetch_token(client: httpx.AsyncClient, config: LoadConfig) -> Optional[str]:
+    """OAuth2 password flow против /token; без логина (mock-сервер) возвращает None."""
+    if not config.username:
+        return None
+    response = await client.post("/token", data={"username": config.username, "password": config.password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_request(
+        client: httpx.AsyncClient,
+        config: LoadConfig,
+        headers: Dict[str, str],
+        num_input_tokens: int,
+        num_output_tokens: int,
+        rng: random.Random,
+        system_prompt: str = "",
+) -> Dict[str, Any]:
+    """Один стриминговый запрос; usage берем из финального чанка (stream_options.include_usage)."""
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": make_prompt(rng, num_input_tokens, num_output_tokens)})
+    body = {
+        "model": config.model,
+        "messages": messages,
+        "max_tokens": num_output_tokens,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        **config.additional_sampling_params,
+    }
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    usage: Dict[str, int] = {}
+    try:
+        async with client.stream("POST", config.endpoint, json=body, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return request_metrics(None, time.perf_counter() - started, num_input_tokens, 0,
+                                       error_code=response.status_code, error_msg=response.text[:500])
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices") or []:
+                    if choice.get("delta", {}).get("content"):
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        chunks += 1
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        return request_metrics(None, time.perf_counter() - started, num_input_tokens, 0,
+                               error_code=599, error_msg=str(e)[:500])
+    e2e = time.perf_counter() - started
+    return request_metrics(
+        ttft,
+        e2e,
+        usage.get("prompt_tokens", num_input_tokens),
+        usage.get("completion_tokens", chunks),  # Без usage — по чанкам (по токену на чанк)
+    )
+
+
+async def run_load(config: LoadConfig) -> Dict[str, Any]:
+    """Прогон одной точки: возвращает {"summary": ..., "records": [...]}."""
+    rng = random.Random(config.seed)
+    system_prompt = " ".join(random.Random(config.seed + 1).choice(_WORDS) for _ in range(config.system_prompt_tokens))
+    limits = httpx.Limits(
+        max_connections=config.num_concurrent_requests,
+        max_keepalive_connections=config.num_concurrent_requests,
+    )
+    records: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(base_url=config.base_url, limits=limits, timeout=config.timeout_s) as client:
+        token = await fetch_token(client, config)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        remaining = config.max_num_completed_requests
+        deadline = time.monotonic() + config.timeout_s
+
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0 and time.monotonic() < deadline:
+                remaining -= 1
+                num_in = max(1, int(rng.gauss(config.mean_input_tokens, config.stddev_input_tokens)))
+                num_out = max(1, int(rng.gauss(config.mean_output_tokens, config.stddev_output_tokens)))
+                records.append(await run_request(client, config, headers, num_in, num_out, rng, system_prompt))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(config.num_concurrent_requests)))
+        elapsed = time.perf_counter() - started
+
+    summary = summarize(
+        records,
+        model=config.model,
+        mean_input_tokens=config.mean_input_tokens,
+        stddev_input_tokens=config.stddev_input_tokens,
+        mean_output_tokens=config.mean_output_tokens,
+        stddev_output_tokens=config.stddev_output_tokens,
+        num_concurrent_requests=config.num_concurrent_requests,
+        elapsed_s=elapsed,
+    )
+    return {"summary": summary, "records": records}
@@ -0,0 +1,81 @@
+"""
+Накладные расходы инструментирования VLLMDeployment (ray-serve-vllm/metrics.py).
+
+Прогоняет путь одного стримингового запроса — стадии auth/init/create, обертка SSE-генератора
+на N чанков и финальные наблюдения — с метриками и без, и сравнивает разницу с временем запроса
+из llmperf_test_results/baseline (e2e и ITL). Порог: < 1% времени запроса.
+    python benchmarks/metrics_overhead.py --chunks 150 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "ray-serve-vllm"))
+
+from metrics import RequestTimer  # noqa: E402
+
+BASELINE = ROOT / "llmperf_test_results" / "baseline" / "Gemma-3_550_150_summary.json"
+
+
+async def _chunks(n: int):
+    for i in range(n):
+        yield "data: {}\n\n"
+
+
+async def bare_request(chunks: int) -> None:
+    async for _ in _chunks(chunks):
+        pass
+
+
+async def instrumented_request(chunks: int) -> None:
+    timer = RequestTimer("/v1/chat/completions")
+    with timer.stage("auth"):
+        timer.role = "admin"
+    with timer.stage("init"):
+        pass
+    with timer.stage("create"):
+        pass
+    async for _ in timer.wrap_stream(_chunks(chunks)):
+        pass
+
+
+async def measure(fn, chunks: int, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await fn(chunks)
+    return (time.perf_counter() - started) / requests
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Metrics instrumentation overhead")
+    parser.add_argument("--chunks", type=int, default=150, help="SSE-чанков на запрос")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    async def run():
+        await measure(instrumented_request, args.chunks, 100)  # Прогрев: создание дочерних серий
+        bare = await measure(bare_request, args.chunks, args.requests)
+        instrumented = await measure(instrumented_request, args.chunks, args.requests)
+        return bare, instrumented
+
+    bare, instrumented = asyncio.run(run())
+    overhead = max(instrumented - bare, 0.0)
+    summary = json.loads(BASELINE.read_text())
+    e2e = summary["results_end_to_end_latency_s_mean"]
+    itl = summary["results_inter_token_latency_s_mean"]
+    per_chunk = overhead / args.chunks
+
+    print(f"overhead per request: {overhead * 1e6:.1f} us ({args.chunks} chunks)")
+    print(f"  vs baseline e2e {e2e:.2f}s: {overhead / e2e:.5%}")
+    print(f"  per chunk {per_chunk * 1e6:.2f} us vs baseline ITL {itl * 1e3:.0f} ms: {per_chunk / itl:.5%}")
+    ok = overhead / e2e < 0.01 and per_chunk / itl < 0.01
+    print("within 1% budget" if ok else "OVER 1% budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Mock OpenAI-совместимого сервера (только stdlib) для прогона бенчмарков на CPU.
+
+Повторяет HTTP-поверхность VLLMDeployment: POST /token, GET /v1/models, GET /ready,
+POST /v1/chat/completions и /v1/tasks/auto/completions (SSE и обычный JSON).
+Задержки: TTFT = ttft_base_s + ttft_per_input_token_s * prompt_tokens, далее по токену раз в itl_s;
+max_concurrency > 0 ограничивает одновременные генерации (остальные ждут — растет TTFT).
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+
+@dataclass
+class MockEngineConfig:
+    ttft_base_s: float = 0.05
+    ttft_per_input_token_s: float = 0.0
+    itl_s: float = 0.01
+    jitter: float = 0.0  # Относительный разброс задержек, 0.1 = ±10%
+    max_concurrency: int = 0
+    model: str = "Gemma-3"
+
+
+class MockOpenAIServer:
+    def __init__(self, config: MockEngineConfig):
+        self.config = config
+        self._slots = asyncio.Semaphore(config.max_concurrency) if config.max_concurrency > 0 else None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        await self.start(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _delay(self, seconds: float) -> float:
+        if self.config.jitter:
+            seconds *= 1.0 + random.uniform(-self.config.jitter, self.config.jitter)
+        return max(seconds, 0.0)
+
+    # -------------------------
+    # HTTP/1.1 с keep-alive
+    # -------------------------
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        body = await reader.readexactly(int(headers.get("content-length", "0")))
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                await self._dispatch(writer, method, path, body)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write_json(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes) -> None:
+        if method == "POST" and path == "/token":
+            self._write_json(writer, 200, {"access_token": "mock-token", "token_type": "bearer"})
+        elif method == "GET" and path == "/v1/models":
+            self._write_json(writer, 200, {"object": "list", "data": [
+                {"id": self.config.model, "object": "model", "owned_by": "owner", "permission": []}
+            ]})
+        elif method == "GET" and path == "/ready":
+            self._write_json(writer, 200, {"ready": True})
+        elif method == "POST" and path in ("/v1/chat/completions", "/v1/tasks/auto/completions"):
+            await self._chat_completion(writer, json.loads(body or b"{}"))
+        else:
+            self._write_json(writer, 404, {"detail": "Not Found"})
+        await writer.drain()
+
+    # -------------------------
+    # Имитация генерации
+    # -------------------------
+    async def _chat_completion(self, writer: asyncio.StreamWriter, request: Dict[str, Any]) -> None:
+        self.requests += 1
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        max_tokens = int(request.get("max_tokens") or 16)
+        request_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": max_tokens,
+                 "total_tokens": prompt_tokens + max_tokens}
+
+        if self._slots is not None:
+            await self._slots.acquire()
+        try:
+            await asyncio.sleep(self._delay(
+                self.config.ttft_base_s + self.config.ttft_per_input_token_s * prompt_tokens
+            ))
+            if not request.get("stream"):
+                await asyncio.sleep(self._delay(self.config.itl_s) * (max_tokens - 1))
+                self._write_json(writer, 200, {
+                    "id": request_id, "object": "chat.completion", "created": created, "model": self.config.model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "tok " * max_tokens},
+                                 "finish_reason": "length"}],
+                    "usage": usage,
+                })
+                return
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+            def event(payload: Any) -> bytes:
+                data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode("utf-8")
+                return f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n"
+
+            for i in range(max_tokens):
+                if i:
+                    await asyncio.sleep(self._delay(self.config.itl_s))
+                writer.write(event({
+                    "id": request_id, "object": "chat.completion.chunk", "created": created,
+                    "model": self.config.model,
+                    "choices": [{"index": 0, "delta": {"content": "tok "},
+                                 "finish_reason": "length" if i == max_tokens - 1 else None}],
+                }))
+                await writer.drain()
+            if (request.get("stream_options") or {}).get("include_usage"):
+                writer.write(event({"id": request_id, "object": "chat.completion.chunk", "created": created,
+                                    "model": self.config.model, "choices": [], "usage": usage}))
+            writer.write(event("[DONE]") + b"0\r\n\r\n")
+        finally:
+            if self._slots is not None:
+                self._slots.release()
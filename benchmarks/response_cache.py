@@ -0,0 +1,204 @@
+"""
+Бенчмарк кеша ответов (ray-serve-vllm/response_cache.py).
+
+Две «реплики» (два ResponseCache) делят один InMemoryBackend — локальная замена общего Redis.
+Поток из --requests детерминированных запросов по --distinct уникальным промптам (распределение Zipf):
+запросы чередуются между репликами, промах «генерирует» ответ и кладет его в кеш.
+Печатаем hit rate и CPU-время на этапы: ключ (канонический JSON + sha256), попадание JSON, попадание SSE.
+
+Перед замером — проверки (код выхода 1, если какая-то не прошла): правила ключа (temperature/n/logprobs,
+несмысловые поля), обход по Cache-Control и отключенным эндпоинтам, запись SSE-стрима и его повтор
+(JSON и SSE совпадают с исходным стримом; стрим без usage не сохраняется).
+vLLM не нужен: запрос — pydantic-модель с полями ChatCompletionRequest, от которых зависит ключ.
+    python benchmarks/response_cache.py --requests 5000 --distinct 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ray-serve-vllm"))
+
+from response_cache import InMemoryBackend, ResponseCache, _StreamRecorder  # noqa: E402
+
+
+class StreamOptions(BaseModel):
+    include_usage: Optional[bool] = None
+
+
+class ChatCompletionRequest(BaseModel):
+    """Поля vLLM ChatCompletionRequest, от которых зависят ключ и повтор ответа."""
+    model: str
+    messages: List[dict]
+    temperature: Optional[float] = None
+    n: Optional[int] = 1
+    logprobs: Optional[bool] = False
+    max_tokens: Optional[int] = None
+    stream: Optional[bool] = False
+    stream_options: Optional[StreamOptions] = None
+    user: Optional[str] = None
+    request_id: Optional[str] = None
+    priority: int = 0
+
+
+def make_body(model: str, prompt: str, chars: int) -> bytes:
+    text = ("lorem ipsum dolor sit amet " * (chars // 27 + 1))[:chars]
+    return (
+        '{"id":"chatcmpl-bench","object":"chat.completion","created":0,"model":"%s",'
+        '"choices":[{"index":0,"message":{"role":"assistant","content":"%s"},"logprobs":null,'
+        '"finish_reason":"stop"}],"usage":{"prompt_tokens":%d,"completion_tokens":%d,"total_tokens":%d}}'
+        % (model, text, len(prompt) // 4, chars // 4, (len(prompt) + chars) // 4)
+    ).encode("utf-8")
+
+
+async def drain(response) -> int:
+    size = 0
+    async for frame in response.body_iterator:
+        size += len(frame)
+    return size
+
+
+async def engine_stream(text: str, include_usage: bool) -> AsyncIterator[str]:
+    """SSE в формате OpenAIServingChat: роль, дельты текста, finish_reason, usage (по запросу), [DONE]."""
+    base = {"id": "chatcmpl-engine", "object": "chat.completion.chunk", "created": 1, "model": "Gemma-3"}
+
+    def frame(choices: list, **extra: Any) -> str:
+        return f"data: {json.dumps({**base, 'choices': choices, **extra}, ensure_ascii=False)}\n\n"
+
+    yield frame([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+    for word in text.split(" "):
+        yield frame([{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+    yield frame([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield frame([], usage={"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})
+    yield "data: [DONE]\n\n"
+
+
+def check(failures: List[str], ok: bool, name: str) -> None:
+    print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    if not ok:
+        failures.append(name)
+
+
+async def checks() -> List[str]:
+    failures: List[str] = []
+    cache = ResponseCache(InMemoryBackend(1 << 20), ttl_s=60, disabled_endpoints={"/v1/tasks/auto/completions"})
+
+    def request(**fields: Any) -> ChatCompletionRequest:
+        return ChatCompletionRequest(**{"model": "Gemma-3", "messages": [{"role": "user", "content": "hi"}],
+                                        "temperature": 0, **fields})
+
+    key = cache.key(request(), None)
+    check(failures, key is not None, "temperature=0, n=1 -> cacheable")
+    check(failures, all(cache.key(request(**f), None) is None for f in (
+        {"temperature": None}, {"temperature": 0.7}, {"n": 2}, {"logprobs": True})),
+        "temperature unset/>0, n>1, logprobs -> not cacheable")
+    check(failures, all(cache.key(request(**f), None) == key for f in (
+        {"stream": True}, {"stream_options": {"include_usage": True}}, {"user": "bob"}, {"request_id": "x"},
+        {"priority": 5})), "stream/stream_options/user/request_id/priority do not change the key")
+    check(failures, cache.key(request(max_tokens=10), None) != key and cache.key(request(), "tmpl") != key,
+          "sampling params and chat template change the key")
+
+    check(failures, cache.policy("/v1/chat/completions", {}) == (True, True), "no Cache-Control -> read and write")
+    check(failures, cache.policy("/v1/chat/completions", {"cache-control": "no-cache"}) == (False, True),
+          "no-cache -> skip read, still write")
+    check(failures, cache.policy("/v1/chat/completions", {"cache-control": "No-Store"}) == (False, False),
+          "no-store -> bypass")
+    check(failures, cache.policy("/v1/tasks/auto/completions", None) == (False, False), "disabled endpoint -> bypass")
+
+    text = "the quick brown fox jumps over the lazy dog"
+    streamed = [frame async for frame in cache.record_stream(engine_stream(text, include_usage=False), key, "check")]
+    check(failures, len(streamed) == len(text.split(" ")) + 3 and await cache.lookup(key, request(), "check") is None,
+          "stream without usage is proxied but not stored")
+
+    async for _ in cache.record_stream(engine_stream(text, include_usage=True), key, "check"):
+        pass
+    body = json.loads((await cache.lookup(key, request(), "check")).body)
+    check(failures, body["choices"][0]["message"]["content"] == text + " " and body["usage"]["total_tokens"] == 15
+          and body["choices"][0]["finish_reason"] == "stop", "recorded stream -> complete chat.completion with usage")
+
+    for include_usage in (True, False):
+        replay = await cache.lookup(key, request(stream=True, stream_options={"include_usage": include_usage}), "check")
+        recorder = _StreamRecorder()
+        async for frame in replay.body_iterator:
+            recorder.feed(frame)
+        replayed = json.loads(recorder.result() or b"{}") if include_usage else None
+        if include_usage:
+            ok = replayed["choices"] == body["choices"] and replayed["usage"] == body["usage"]
+        else:
+            ok = recorder.done and recorder.usage is None and "".join(recorder.content[0]) == text + " "
+        check(failures, ok, f"SSE replay matches the stored response (include_usage={include_usage})")
+    return failures
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--distinct", type=int, default=200)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Параметр распределения повторов")
+    parser.add_argument("--response-chars", type=int, default=600)
+    parser.add_argument("--max-bytes", type=int, default=64 << 20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("Checks:")
+    failures = await checks()
+    print()
+
+    rng = random.Random(args.seed)
+    shared = InMemoryBackend(args.max_bytes)
+    replicas = [ResponseCache(shared, ttl_s=3600), ResponseCache(shared, ttl_s=3600)]
+    weights = [1.0 / (i + 1) ** args.zipf for i in range(args.distinct)]
+    prompts = [f"You are a helpful assistant. Task #{i}: " + "context " * 100 for i in range(args.distinct)]
+
+    key_s = hit_json_s = hit_sse_s = 0.0
+    hits_json = hits_sse = 0
+    for i in range(args.requests):
+        prompt = rng.choices(prompts, weights)[0]
+        stream = rng.random() < 0.5
+        request = ChatCompletionRequest(
+            model="Gemma-3", messages=[{"role": "user", "content": prompt}],
+            temperature=0, max_tokens=150, stream=stream,
+        )
+        cache = replicas[i % 2]
+
+        started = time.process_time()
+        key = cache.key(request, None)
+        key_s += time.process_time() - started
+
+        started = time.process_time()
+        response = await cache.lookup(key, request, "bench")
+        if response is not None and stream:
+            await drain(response)
+        elapsed = time.process_time() - started
+        if response is None:
+            await cache.store(key, make_body("Gemma-3", prompt, args.response_chars), "bench")
+        elif stream:
+            hit_sse_s += elapsed
+            hits_sse += 1
+        else:
+            hit_json_s += elapsed
+            hits_json += 1
+
+    hits = sum(c.hits for c in replicas)
+    print(f"requests={args.requests}, distinct={args.distinct}, zipf={args.zipf}")
+    print(f"hit rate: {hits / args.requests:.1%} (replica-0 {replicas[0].stats()['hit_rate']:.1%}, "
+          f"replica-1 {replicas[1].stats()['hit_rate']:.1%}); backend {shared.stats()}")
+    print(f"key (canonical JSON + sha256): {key_s / args.requests * 1e6:8.1f} µs/request")
+    if hits_json:
+        print(f"hit, JSON response:            {hit_json_s / hits_json * 1e6:8.1f} µs/request")
+    if hits_sse:
+        print(f"hit, SSE replay:               {hit_sse_s / hits_sse * 1e6:8.1f} µs/request")
+    if failures:
+        print(f"\nFAILED: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Бенчмарк сериализации неблокирующего ответа /v1/chat/completions.
+
+legacy — прежний путь обработчиков: ручное копирование ChatCompletionResponse в dict,
+         два вызова datetime.now() и JSONResponse (json.dumps);
+fast   — текущий путь VLLMDeployment._serve_chat_completion: Response(model_dump_json()).
+
+Меряем CPU-время на запрос (time.process_time) и пик аллокаций (tracemalloc) для большого n
+и для длинных ответов. Нужен vllm (как в образе):
+    python benchmarks/response_serialization.py --iterations 2000
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime
+
+from starlette.responses import JSONResponse, Response
+from vllm.entrypoints.openai.protocol import (
+    ChatCompletionResponse,
+    ChatCompletionResponseChoice,
+    ChatMessage,
+    UsageInfo,
+)
+
+# (название, n, символов в каждом choice)
+SCENARIOS = [
+    ("n=1, 150 tok", 1, 600),
+    ("n=16, 150 tok", 16, 600),
+    ("n=64, 150 tok", 64, 600),
+    ("n=1, 4k tok", 1, 16_000),
+    ("n=8, 4k tok", 8, 16_000),
+]
+
+
+def make_response(n: int, chars: int) -> ChatCompletionResponse:
+    text = ("lorem ipsum dolor sit amet " * (chars // 27 + 1))[:chars]
+    return ChatCompletionResponse(
+        id="chatcmpl-bench",
+        created=int(time.time()),
+        model="Gemma-3",
+        choices=[
+            ChatCompletionResponseChoice(
+                index=i,
+                message=ChatMessage(role="assistant", content=text),
+                finish_reason="length",
+            )
+            for i in range(n)
+        ],
+        usage=UsageInfo(prompt_tokens=550, completion_tokens=n * chars // 4, total_tokens=550 + n * chars // 4),
+    )
+
+
+def legacy_path(generator: ChatCompletionResponse) -> Response:
+    choices = [{
+        "index": c.index,
+        "message": {"role": c.message.role, "content": c.message.content},
+        "finish_reason": c.finish_reason,
+    } for c in generator.choices]
+    return JSONResponse(content={
+        "id": f"chatcmpl-{datetime.now().timestamp()}",
+        "object": "chat.completion",
+        "created": int(datetime.now().timestamp()),
+        "model": "Gemma-3",
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": generator.usage.prompt_tokens,
+            "completion_tokens": generator.usage.completion_tokens,
+            "total_tokens": generator.usage.total_tokens,
+        },
+    })
+
+
+def fast_path(generator: ChatCompletionResponse) -> Response:
+    return Response(content=generator.model_dump_json(), media_type="application/json")
+
+
+def measure(fn, generator, iterations: int):
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(generator)
+    cpu_us = (time.process_time() - started) / iterations * 1e6
+
+    tracemalloc.start()
+    fn(generator)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_us, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Non-streaming response serialization benchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<16} {'path':<7} {'cpu, us/req':>12} {'peak alloc, KiB':>16}")
+    for name, n, chars in SCENARIOS:
+        generator = make_response(n, chars)
+        rows = {}
+        for label, fn in (("legacy", legacy_path), ("fast", fast_path)):
+            rows[label] = measure(fn, generator, args.iterations)
+            cpu_us, peak = rows[label]
+            print(f"{name:<16} {label:<7} {cpu_us:>12.1f} {peak / 1024:>16.1f}")
+        print(f"{'':<16} {'ratio':<7} {rows['legacy'][0] / rows['fast'][0]:>11.1f}x"
+              f" {rows['legacy'][1] / max(rows['fast'][1], 1):>15.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Запись результатов в схеме llmperf (token_benchmark_ray.py), как в llmperf_test_results/*:
+<model>_<in>_<out>_summary.json и <model>_<in>_<out>_individual_responses.json.
+"""
+import json
+import math
+import statistics
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+SUMMARY_VERSION = "2023-08-31"
+QUANTILES = (0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+METRICS = (
+    "inter_token_latency_s",
+    "ttft_s",
+    "end_to_end_latency_s",
+    "request_output_throughput_token_per_s",
+    "number_input_tokens",
+    "number_output_tokens",
+)
+# llmperf сохраняет min/max счетчиков токенов строками (артефакт pandas) — повторяем для совместимости
+_STRING_MINMAX = ("number_input_tokens", "number_output_tokens")
+
+
+def quantile(sorted_values: Sequence[float], q: float) -> float:
+    """Квантиль с линейной интерполяцией (как pandas.Series.quantile по умолчанию)."""
+    if not sorted_values:
+        return float("nan")
+    pos = (len(sorted_values) - 1) * q
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def request_metrics(
+        ttft_s: Optional[float],
+        end_to_end_latency_s: float,
+        number_input_tokens: int,
+        number_output_tokens: int,
+        error_code: Optional[int] = None,
+        error_msg: str = "",
+) -> Dict[str, Any]:
+    """
+    Запись одного запроса. ITL считается как у llmperf: e2e / число выходных токенов (usage.completion_tokens;
+    TTFT входит в сумму интервалов). Не на число SSE-чанков: при склейке событий (SSE_COALESCE_MS) и
+    спекулятивном декодировании чанк несет несколько токенов, и ITL получался бы завышенным.
+    """
+    return {
+        "error_code": error_code,
+        "error_msg": error_msg,
+        "inter_token_latency_s": end_to_end_latency_s / number_output_tokens if number_output_tokens else 0.0,
+        "ttft_s": ttft_s or 0.0,
+        "end_to_end_latency_s": end_to_end_latency_s,
+        "request_output_throughput_token_per_s": (
+            number_output_tokens / end_to_end_latency_s if end_to_end_latency_s > 0 else 0.0
+        ),
+        "number_total_tokens": number_input_tokens + number_output_tokens,
+        "number_output_tokens": number_output_tokens,
+        "number_input_tokens": number_input_tokens,
+    }
+
+
+def summarize(
+        records: List[Dict[str, Any]],
+        *,
+        model: str,
+        mean_input_tokens: int,
+        stddev_input_tokens: int,
+        mean_output_tokens: int,
+        stddev_output_tokens: int,
+        num_concurrent_requests: int,
+        elapsed_s: float,
+) -> Dict[str, Any]:
+    ok = [r for r in records if not r["error_code"]]
+    summary: Dict[str, Any] = {
+        "version": SUMMARY_VERSION,
+        "name": f"{model}_{mean_input_tokens}_{mean_output_tokens}_summary",
+        "model": model,
+        "mean_input_tokens": mean_input_tokens,
+        "stddev_input_tokens": stddev_input_tokens,
+        "mean_output_tokens": mean_output_tokens,
+        "stddev_output_tokens": stddev_output_tokens,
+        "num_concurrent_requests": num_concurrent_requests,
+    }
+    for metric in METRICS:
+        values = sorted(float(r[metric]) for r in ok)
+        prefix = f"results_{metric}"
+        for q in QUANTILES:
+            summary[f"{prefix}_quantiles_p{int(q * 100)}"] = quantile(values, q)
+        summary[f"{prefix}_mean"] = statistics.fmean(values) if values else float("nan")
+        lo = values[0] if values else float("nan")
+        hi = values[-1] if values else float("nan")
+        if metric in _STRING_MINMAX:
+            lo, hi = str(int(lo)) if values else "nan", str(int(hi)) if values else "nan"
+        summary[f"{prefix}_min"] = lo
+        summary[f"{prefix}_max"] = hi
+        summary[f"{prefix}_stddev"] = statistics.stdev(values) if len(values) > 1 else float("nan")
+
+    errors = [r for r in records if r["error_code"]]
+    total_output = sum(r["number_output_tokens"] for r in ok)
+    summary.update({
+        "results_num_requests_started": len(records),
+        "results_error_rate": len(errors) / len(records) if records else 0.0,
+        "results_number_errors": len(errors),
+        "results_error_code_frequency": str(dict(Counter(r["error_code"] for r in errors))),
+        "results_mean_output_throughput_token_per_s": total_output / elapsed_s if elapsed_s > 0 else 0.0,
+        "results_num_completed_requests": len(ok),
+        "results_num_completed_requests_per_min": len(ok) / elapsed_s * 60 if elapsed_s > 0 else 0.0,
+        "timestamp": int(time.time()),
+    })
+    return summary
+
+
+def write_results(results_dir: Path, summary: Dict[str, Any], records: List[Dict[str, Any]]) -> Path:
+    """Пишет пару файлов в results_dir и возвращает путь к summary."""
+    results_dir.mkdir(parents=True, exist_ok=True)
+    base = summary["name"][: -len("_summary")]
+    summary_path = results_dir / f"{base}_summary.json"
+    summary_path.write_text(json.dumps(summary, indent=4))
+    (results_dir / f"{base}_individual_responses.json").write_text(json.dumps(records, indent=4))
+    return summary_path
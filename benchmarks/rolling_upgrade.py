@@ -0,0 +1,261 @@
+"""
+Rolling upgrade под нагрузкой на имитации движка: сколько запросов падает при замене реплик
+без дренажа (как раньше: Serve ждет запросы в работе graceful_shutdown_timeout_s = 20 с и убивает реплику)
+и с дренажем ray-serve-vllm/drain.py (срок DRAIN_DEADLINE_S, 503 + X-Drain и повтор на другой реплике).
+
+Нагрузка — уровни конкурентности, ITL, TTFT и длина ответа из llmperf_test_results/concurrency_*;
+время сжато в --time-scale раз. Реплики заменяются по одной: новая поднимается за --startup-s, затем
+старая выводится из ротации. Триггер дренажа (SIGTERM/preStop) опережает обновление маршрутизации
+на --routing-lag-s: запросы, пришедшие на старую реплику в этом окне, повторяются на другой (как PrefixRouter).
+Запросы идут через настоящие PrefixRouterIngress._forward (выбор реплики, повтор после 503 + X-Drain)
+и VLLMDeployment.routed_chat_completion (отказ при дренаже); имитируется только генерация движка.
+Нужны ray и vllm (как в образе). Код выхода 1, если в режиме drain есть упавшие запросы.
+
+    python benchmarks/rolling_upgrade.py
+    python benchmarks/rolling_upgrade.py --time-scale 0.02 --replicas 3
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+
+import numpy as np
+from starlette.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ray-serve-vllm"))
+
+from drain import DrainController  # noqa: E402
+from prefix_routing import PrefixAffinityRouter  # noqa: E402
+from router import PrefixRouterIngress  # noqa: E402
+from serve import VLLMDeployment  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "llmperf_test_results")
+SERVE_DEFAULT_GRACEFUL_SHUTDOWN_S = 20.0
+ROUTER = PrefixRouterIngress.func_or_class  # Классы деплоев: методы вызываем без Serve
+REPLICA = VLLMDeployment.func_or_class
+
+
+class MockEngine:
+    """Генерация токенов с заданными TTFT/ITL и abort по id, как AsyncLLM.abort."""
+
+    def __init__(self, ttft_s: float, itl_s: float):
+        self.ttft_s = ttft_s
+        self.itl_s = itl_s
+        self._aborted: Set[str] = set()
+
+    async def abort(self, request_ids: List[str]) -> None:
+        self._aborted.update(request_ids)
+
+    async def generate(self, request_id: str, tokens: int) -> AsyncIterator[str]:
+        await asyncio.sleep(self.ttft_s)
+        for i in range(tokens):
+            if request_id in self._aborted:
+                yield "abort"
+                return
+            yield "tok"
+            await asyncio.sleep(self.itl_s)
+        yield "length"
+
+
+class MockReplica:
+    """
+    Реплика с настоящими routed_chat_completion и _drain_response; _serve_chat_completion заменен
+    генерацией MockEngine с тем же учетом в DrainController (track + guard_stream).
+    """
+    routed_chat_completion = REPLICA.routed_chat_completion
+    _drain_response = staticmethod(REPLICA._drain_response)
+
+    def __init__(self, name: str, engine: MockEngine, deadline_s: float, grace_s: float):
+        self.name = name
+        self.engine = engine
+        self.drain = DrainController(engine.abort, deadline_s=deadline_s, abort_grace_s=grace_s)
+        self.connections: Set[asyncio.Task] = set()  # Задачи клиентов, читающих поток этой реплики
+        self._ids = 0
+
+    async def _serve_chat_completion(self, request: Any, raw_request: Any, timer: Any, payload: Any,
+                                     headers: Any) -> StreamingResponse:
+        self._ids += 1
+        request_id = f"{self.name}-{self._ids}"
+        self.drain.track(request_id, stream=True)
+        self.connections.add(asyncio.current_task())
+        return StreamingResponse(self._stream(request_id, request.max_tokens), media_type="text/event-stream")
+
+    async def _stream(self, request_id: str, tokens: int) -> AsyncIterator[str]:
+        try:
+            async for event in self.drain.guard_stream(self.engine.generate(request_id, tokens), request_id):
+                yield event
+        finally:
+            self.connections.discard(asyncio.current_task())
+
+    def kill(self) -> int:
+        """Процесс реплики убит: соединения клиентов обрываются."""
+        killed = len(self.connections)
+        for task in list(self.connections):
+            task.cancel()
+        return killed
+
+
+class MockResponseGenerator:
+    """DeploymentResponseGenerator поверх async-генератора реплики: __anext__ и cancel()."""
+
+    def __init__(self, generator: AsyncIterator[Any]):
+        self._generator = generator
+
+    def __aiter__(self) -> "MockResponseGenerator":
+        return self
+
+    async def __anext__(self) -> Any:
+        return await self._generator.__anext__()
+
+    def cancel(self) -> None:
+        asyncio.ensure_future(self._generator.aclose())
+
+
+class MockHandle:
+    """DeploymentHandle слота: вызов идет на реплику, которая стоит в слоте сейчас."""
+
+    def __init__(self, cluster: "Cluster", slot: str):
+        self.cluster = cluster
+        self.slot = slot
+
+    def options(self, **kwargs: Any) -> "MockHandle":
+        return self
+
+    @property
+    def routed_chat_completion(self) -> "MockHandle":
+        return self  # Единственный метод, который роутер вызывает потоком
+
+    def remote(self, *args: Any) -> MockResponseGenerator:
+        return MockResponseGenerator(self.cluster.slots[self.slot].routed_chat_completion(*args))
+
+
+class Cluster:
+    """Слоты PrefixRouter → текущая реплика; замена реплики слота — как rolling upgrade деплоя с одной репликой."""
+    _forward = ROUTER._forward  # Роутер — этот объект: replicas + router, как у PrefixRouterIngress
+
+    def __init__(self, replicas: int, ttft_s: float, itl_s: float, deadline_s: float, grace_s: float):
+        self.ttft_s, self.itl_s, self.deadline_s, self.grace_s = ttft_s, itl_s, deadline_s, grace_s
+        self.slots = {f"replica-{i}": self._new_replica(f"replica-{i}-v1") for i in range(replicas)}
+        self.replicas = {slot: MockHandle(self, slot) for slot in self.slots}
+        self.router = PrefixAffinityRouter(list(self.slots))
+        self.retired: List[MockReplica] = []
+        self._requests = 0
+
+    def _new_replica(self, name: str) -> MockReplica:
+        return MockReplica(name, MockEngine(self.ttft_s, self.itl_s), self.deadline_s, self.grace_s)
+
+    @property
+    def resubmitted(self) -> int:
+        return sum(r.drain.rejected for r in [*self.slots.values(), *self.retired])
+
+    async def request(self, tokens: int) -> Tuple[bool, float]:
+        """Запрос клиента через роутер; успех — поток дошел до finish_reason=length."""
+        started = time.perf_counter()
+        self._requests += 1
+        body = {"model": "model", "messages": [{"role": "user", "content": f"request {self._requests}"}],
+                "stream": True, "max_tokens": tokens}
+        try:
+            response = await self._forward(body, {"sub": "bench", "role": "admin"})
+            if not isinstance(response, StreamingResponse) or response.status_code != 200:
+                return False, time.perf_counter() - started
+            last = None
+            async for last in response.body_iterator:
+                pass
+            return last == "length", time.perf_counter() - started
+        except asyncio.CancelledError:  # Соединение с убитой репликой оборвано
+            return False, time.perf_counter() - started
+
+    async def upgrade(self, slot: str, mode: str, startup_s: float, routing_lag_s: float) -> int:
+        """Заменяет реплику слота; возвращает число генераций старой реплики, снятых или оборванных."""
+        new = self._new_replica(f"{slot}-v2")
+        await asyncio.sleep(startup_s)  # Новая реплика грузит модель
+        old = self.slots[slot]
+        self.retired.append(old)
+        if mode == "drain":
+            task = old.drain.begin("rolling upgrade")  # SIGTERM / preStop приходит раньше смены маршрута
+            await asyncio.sleep(routing_lag_s)
+            self.slots[slot] = new
+            return (await task)["aborted"]
+        await asyncio.sleep(routing_lag_s)
+        self.slots[slot] = new
+        try:  # Serve ждет запросы в работе до graceful_shutdown_timeout_s, затем убивает процесс
+            await asyncio.wait_for(old.drain._idle.wait(), timeout=self.deadline_s)
+            return 0
+        except asyncio.TimeoutError:
+            return old.kill()
+
+
+def llmperf_levels() -> List[Dict[str, float]]:
+    levels = []
+    for path in glob.glob(os.path.join(RESULTS_DIR, "concurrency_*")):
+        summary = json.load(open(glob.glob(os.path.join(path, "*_summary.json"))[0]))
+        levels.append({
+            "concurrency": int(re.search(r"(\d+)$", path).group(1)),
+            "ttft_s": summary["results_ttft_s_mean"],
+            "itl_s": summary["results_inter_token_latency_s_mean"],
+            "tokens": int(summary["mean_output_tokens"]),
+        })
+    return sorted(levels, key=lambda level: level["concurrency"])
+
+
+async def run_point(level: Dict[str, float], mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    scale = args.time_scale
+    deadline = args.drain_deadline_s if mode == "drain" else SERVE_DEFAULT_GRACEFUL_SHUTDOWN_S
+    cluster = Cluster(args.replicas, level["ttft_s"] * scale, level["itl_s"] * scale, deadline * scale, 5 * scale)
+    results: List[Tuple[bool, float]] = []
+    stop = asyncio.Event()
+
+    async def client() -> None:
+        while not stop.is_set():
+            results.append(await asyncio.create_task(cluster.request(level["tokens"])))
+
+    clients = [asyncio.create_task(client()) for _ in range(int(level["concurrency"]))]
+    await asyncio.sleep(args.warmup_s * scale)
+    aborted = 0
+    for slot in list(cluster.slots):
+        aborted += await cluster.upgrade(slot, mode, args.startup_s * scale, args.routing_lag_s * scale)
+    stop.set()
+    await asyncio.gather(*clients)
+
+    latencies = [latency for ok, latency in results if ok]
+    return {
+        "requests": len(results),
+        "failed": sum(1 for ok, _ in results if not ok),
+        "resubmitted": cluster.resubmitted,
+        "aborted": aborted,
+        "e2e_p95_s": float(np.quantile(latencies, 0.95)) / scale if latencies else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--time-scale", type=float, default=0.01, help="Множитель времени имитации")
+    parser.add_argument("--drain-deadline-s", type=float, default=300.0)
+    parser.add_argument("--startup-s", type=float, default=60.0, help="Старт новой реплики (загрузка модели)")
+    parser.add_argument("--routing-lag-s", type=float, default=10.0, help="Сколько старая реплика еще получает запросы")
+    parser.add_argument("--warmup-s", type=float, default=30.0, help="Нагрузка до начала обновления")
+    args = parser.parse_args()
+    logging.getLogger("ray.serve").setLevel(logging.ERROR)  # Логи дренажа на каждый прогон не нужны
+
+    print("| Concurrent | Режим | Запросов | Упало | Повторено на другой реплике | Снято по сроку | p95 e2e, с |")
+    print("| --- | --- | --- | --- | --- | --- | --- |")
+    drain_failures = 0
+    for level in llmperf_levels():
+        for mode in ("kill", "drain"):
+            r = asyncio.run(run_point(level, mode, args))
+            if mode == "drain":
+                drain_failures += r["failed"]
+            print(f"| {level['concurrency']} | {mode} | {r['requests']} | {r['failed']} | {r['resubmitted']} "
+                  f"| {r['aborted']} | {r['e2e_p95_s']:.1f} |", flush=True)
+    sys.exit(1 if drain_failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Склейка одинаковых запросов в работе (ray-serve-vllm/single_flight.py) на имитации движка.
+Запросы идут через настоящие VLLMDeployment._serve_chat_completion и _generate_chat_completion (ключ склейки,
+допуск, адаптер и дренаж ведущего, склейка SSE и замеры у каждого подписчика); имитируется только
+OpenAIServingChat поверх движка. Нужны ray и vllm (как в образе).
+
+Проверки (код выхода 1, если какая-то не прошла):
+  - одинаковые потоковые запросы, пришедшие вразнобой, — одна генерация, каждый подписчик (и опоздавший)
+    получает весь поток целиком;
+  - уход части подписчиков не обрывает генерацию остальным, уход всех — снимает ее с движка;
+  - неблокирующие запросы получают копии одного ответа; 429 ведущего подписчикам не передается;
+  - недетерминированные запросы (temperature > 0) не клеятся.
+Затем нагрузка: --requests запросов по --distinct промптам (распределение Zipf) с пуассоновскими приходами;
+печатаем долю склеенных запросов и сэкономленные генерации.
+
+    python benchmarks/single_flight.py
+    python benchmarks/single_flight.py --requests 2000 --distinct 50 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from typing import Any, AsyncIterator, List, Optional
+
+from starlette.responses import Response
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ray-serve-vllm"))
+
+from vllm.entrypoints.openai.protocol import (  # noqa: E402
+    ChatCompletionRequest, ChatCompletionResponse, ChatCompletionResponseChoice, ChatMessage, UsageInfo,
+)
+
+from adapters import AdapterRegistry  # noqa: E402
+from admission import AdmissionController, AdmissionRejected  # noqa: E402
+from budget import TokenBudget  # noqa: E402
+from drain import DrainController  # noqa: E402
+from serve import VLLMDeployment  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+from streaming import StreamSettings  # noqa: E402
+
+REPLICA = VLLMDeployment.func_or_class  # Класс деплоя: методы вызываем без Serve
+
+
+class FakeEngine:
+    """Генерация с заданными TTFT/ITL; закрытие потока до конца — abort, как у AsyncLLM."""
+
+    def __init__(self, ttft_s: float, itl_s: float):
+        self.ttft_s = ttft_s
+        self.itl_s = itl_s
+        self.generations = 0
+        self.aborted = 0
+        self.active = 0
+
+    async def stream(self, prompt: str, tokens: int) -> AsyncIterator[str]:
+        self.generations += 1
+        self.active += 1
+        finished = False
+        try:
+            await asyncio.sleep(self.ttft_s)
+            for i in range(tokens):
+                yield f"data: {json.dumps({'prompt': prompt, 'token': i})}\n\n"
+                await asyncio.sleep(self.itl_s)
+            yield "data: [DONE]\n\n"
+            finished = True
+        finally:
+            self.active -= 1
+            if not finished:
+                self.aborted += 1
+
+    async def complete(self, request: ChatCompletionRequest, prompt: str, tokens: int) -> ChatCompletionResponse:
+        self.generations += 1
+        await asyncio.sleep(self.ttft_s + tokens * self.itl_s)
+        return ChatCompletionResponse(
+            id=f"chatcmpl-{request.request_id}", created=0, model=request.model,
+            choices=[ChatCompletionResponseChoice(index=0, message=ChatMessage(role="assistant", content=prompt))],
+            usage=UsageInfo(prompt_tokens=1, completion_tokens=tokens, total_tokens=tokens + 1),
+        )
+
+
+class FakeServingChat:
+    """OpenAIServingChat.create_chat_completion: SSE-поток или готовый ChatCompletionResponse."""
+
+    def __init__(self, replica: "Replica"):
+        self.replica = replica
+
+    async def create_chat_completion(self, request: ChatCompletionRequest, raw_request: Any) -> Any:
+        prompt = request.messages[-1]["content"]
+        if request.stream:
+            return self.replica.engine.stream(prompt, request.max_tokens)
+        return await self.replica.engine.complete(request, prompt, request.max_tokens)
+
+
+class RejectingAdmission(AdmissionController):
+    """Допуск реплики; reject=True — следующий запрос получает 429 (лимит ведущего)."""
+
+    def __init__(self):
+        super().__init__(max_inflight=256, max_queue=256)
+        self.reject = False
+
+    async def acquire(self, user: str, role: str, cost: float) -> Any:
+        if self.reject:
+            self.reject = False
+            raise AdmissionRejected("rate limit", 1.0)
+        return await super().acquire(user, role, cost)
+
+
+class Replica:
+    """VLLMDeployment с настоящим путем запроса; движок, OpenAIServingChat и лимит ведущего — имитация."""
+    _serve_chat_completion = REPLICA._serve_chat_completion
+    _generate_chat_completion = REPLICA._generate_chat_completion
+    _drain_response = staticmethod(REPLICA._drain_response)
+
+    def __init__(self, engine: FakeEngine, single_flight: Optional[SingleFlight]):
+        self.engine = engine
+        self.single_flight = single_flight
+        self.openai_serving_chat = FakeServingChat(self)
+        self.budget = TokenBudget()  # Без токенизатора движка — пропускает запрос
+        self.response_cache = None
+        self.chat_template = None
+        self.stream_settings = StreamSettings()
+        self.admission = RejectingAdmission()
+        self.admission_default_max_tokens = 512
+        self.priority_scheduling = False
+        self.adapters = AdapterRegistry({}, max_resident=1)
+        self.drain = DrainController(self._abort)
+
+    async def _abort(self, request_ids: List[str]) -> None:
+        pass
+
+    async def _initialize_serving_chat(self) -> None:
+        pass
+
+    async def handle(self, request: ChatCompletionRequest) -> Response:
+        return await self._serve_chat_completion(request, None, None, {"sub": "bench", "role": "admin"})
+
+
+def make_request(prompt: str, tokens: int, stream: bool = True, temperature: float = 0.0) -> ChatCompletionRequest:
+    return ChatCompletionRequest(model="model", messages=[{"role": "user", "content": prompt}], stream=stream,
+                                 temperature=temperature, max_tokens=tokens)
+
+
+async def read_all(response: Any, stop_after: Optional[int] = None) -> List[str]:
+    chunks = []
+    async for chunk in response.body_iterator:
+        chunks.append(chunk)
+        if stop_after is not None and len(chunks) >= stop_after:
+            await response.body_iterator.aclose()  # Клиент отключился
+            break
+    return chunks
+
+
+async def client_of(replica: Replica, request: ChatCompletionRequest) -> List[str]:
+    return await read_all(await replica.handle(request))
+
+
+async def delayed(delay_s: float, coro: Any) -> Any:
+    await asyncio.sleep(delay_s)
+    return await coro
+
+
+def check(failures: List[str], ok: bool, name: str) -> None:
+    print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    if not ok:
+        failures.append(name)
+
+
+async def scenarios(ttft_s: float, itl_s: float, tokens: int) -> List[str]:
+    failures: List[str] = []
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica = Replica(engine, SingleFlight())
+    stream_time = ttft_s + tokens * itl_s
+
+    async def client(delay_s: float, stop_after: Optional[int] = None) -> List[str]:
+        await asyncio.sleep(delay_s)
+        return await read_all(await replica.handle(make_request("same", tokens)), stop_after)
+
+    delays = [0.0, 0.0, ttft_s / 2, stream_time / 3, stream_time * 2 / 3]
+    results = await asyncio.gather(*(client(d) for d in delays))
+    check(failures, engine.generations == 1, f"{len(delays)} staggered streams -> {engine.generations} generation(s)")
+    check(failures, all(r == results[0] for r in results) and len(results[0]) == tokens + 1,
+          "every subscriber, late joiners included, gets the full stream")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    results = await asyncio.gather(client(0.0, stop_after=2), client(0.0), client(0.0, stop_after=tokens // 2))
+    check(failures, engine.generations == 1 and engine.aborted == 0 and len(results[1]) == tokens + 1,
+          "partial cancellation keeps the generation for the remaining subscriber")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    await asyncio.gather(client(0.0, stop_after=1), client(0.0, stop_after=3))
+    await asyncio.sleep(itl_s * 2)
+    check(failures, engine.aborted == 1 and engine.active == 0, "last subscriber leaving aborts the engine generation")
+    await client(0.0)
+    check(failures, engine.generations == 2, "request after an aborted flight starts a new generation")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    clients = [asyncio.ensure_future(client(0.0)) for _ in range(2)]
+    await asyncio.sleep(ttft_s / 2)
+    for task in clients:
+        task.cancel()  # Клиенты ушли до первого токена
+    await asyncio.gather(*clients, return_exceptions=True)
+    await asyncio.sleep(ttft_s)
+    check(failures, engine.generations == 1 and engine.aborted == 1 and not replica.single_flight.stats()["inflight"],
+          "streams cancelled before the first chunk abort the generation and release the flight")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    handlers = [asyncio.ensure_future(replica.handle(make_request("json", tokens, stream=False))) for _ in range(2)]
+    await asyncio.sleep(ttft_s / 2)
+    for handler in handlers:
+        handler.cancel()
+    await asyncio.gather(*handlers, return_exceptions=True)
+    response = await replica.handle(make_request("json", tokens, stream=False))
+    check(failures, engine.generations == 2 and response.status_code == 200,
+          "cancelled non-streaming requests release the flight")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    responses = await asyncio.gather(*(delayed(i * ttft_s / 4,
+                                               replica.handle(make_request("json", tokens, stream=False)))
+                                       for i in range(4)))
+    check(failures, engine.generations == 1 and len({r.body for r in responses}) == 1
+          and len({id(r) for r in responses}) == 4, "non-streaming requests get copies of one response")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine, replica.admission.reject = engine, True
+    responses = await asyncio.gather(*(replica.handle(make_request("limited", tokens, stream=False)) for _ in range(3)))
+    statuses = sorted(r.status_code for r in responses)
+    check(failures, statuses == [200, 200, 429], f"leader's 429 is not shared with followers: {statuses}")
+
+    engine = FakeEngine(ttft_s, itl_s)
+    replica.engine = engine
+    await asyncio.gather(*(client_of(replica, make_request("sampled", tokens, temperature=0.7)) for _ in range(3)))
+    check(failures, engine.generations == 3, "sampled requests (temperature > 0) are not coalesced")
+
+    await asyncio.sleep(ttft_s)  # Отмененные генерации закрываются в фоне
+    check(failures, replica.admission.stats()["inflight"] == 0 and not replica.drain.active,
+          "admission slots and drain entries of leaders are released after all scenarios")
+    return failures
+
+
+async def load(args: argparse.Namespace, coalesce: bool) -> FakeEngine:
+    rng = random.Random(args.seed)
+    engine = FakeEngine(args.ttft_ms / 1000, args.itl_ms / 1000)
+    replica = Replica(engine, SingleFlight() if coalesce else None)
+    weights = [1.0 / (i + 1) ** args.zipf for i in range(args.distinct)]
+
+    async def one(delay_s: float, prompt: int) -> None:
+        await asyncio.sleep(delay_s)
+        await client_of(replica, make_request(f"prompt {prompt}", args.tokens))
+
+    at, tasks = 0.0, []
+    for _ in range(args.requests):
+        at += rng.expovariate(args.rate)
+        tasks.append(one(at, rng.choices(range(args.distinct), weights)[0]))
+    await asyncio.gather(*tasks)
+    return engine
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttft-ms", type=float, default=20.0)
+    parser.add_argument("--itl-ms", type=float, default=2.0)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Параметр распределения повторов")
+    parser.add_argument("--rate", type=float, default=100.0, help="Запросов в секунду")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("Scenarios:")
+    failures = await scenarios(args.ttft_ms / 1000, args.itl_ms / 1000, args.tokens)
+
+    baseline = await load(args, coalesce=False)
+    coalesced = await load(args, coalesce=True)
+    saved = 1 - coalesced.generations / baseline.generations
+    print(f"\nLoad: {args.requests} requests, {args.distinct} prompts (zipf {args.zipf}), {args.rate:g} req/s, "
+          f"stream {args.ttft_ms + args.tokens * args.itl_ms:.0f} ms")
+    print(f"  engine generations: {baseline.generations} without coalescing, {coalesced.generations} with "
+          f"(coalescing ratio {saved:.1%})")
+    if failures:
+        print(f"\nFAILED: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
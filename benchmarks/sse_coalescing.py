@@ -0,0 +1,202 @@
+"""
+Бенчмарк склейки SSE (ray-serve-vllm/streaming.py): CPU сервера и межтокенные интервалы у клиента
+со склейкой и без, на уровнях конкурентности из llmperf_test_results/concurrency_*.
+
+Сервер — отдельный процесс (stdlib asyncio, HTTP/1.1 chunked; одна запись + drain на событие,
+как у uvicorn). Имитация движка повторяет vLLM V1: токены появляются с ITL из summary соответствующего
+прогона (или --itl-ms) и копятся в коллекторе, пока их не заберут (RequestOutputCollector, DELTA);
+каждое чтение — один chat.completion.chunk со всеми накопленными токенами; дальше streaming.coalesce. CPU сервера — разность
+time.process_time() процесса сервера до и после нагрузки (GET /cpu), без учета его запуска.
+Клиент фиксирует время прихода каждого токена и каждой записи (HTTP-чанка).
+
+    python benchmarks/sse_coalescing.py                      # ITL из llmperf-прогонов, окно 20 мс
+    python benchmarks/sse_coalescing.py --itl-ms 5 --tokens 300 --coalesce-ms 0 10 20
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ray-serve-vllm"))
+
+from streaming import StreamSettings, coalesce  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "llmperf_test_results")
+
+
+# -------------------------
+# Сервер (дочерний процесс)
+# -------------------------
+async def fake_engine(tokens: int, itl_s: float, rng: random.Random):
+    created = int(time.time())
+    ready = asyncio.Event()
+    produced = 0
+
+    async def decode() -> None:  # Шаги движка идут независимо от чтения
+        nonlocal produced
+        for _ in range(tokens):
+            await asyncio.sleep(itl_s * rng.uniform(0.5, 1.5))
+            produced += 1
+            ready.set()
+
+    task = asyncio.get_running_loop().create_task(decode())
+    taken = 0
+    try:
+        while taken < tokens:
+            await ready.wait()
+            ready.clear()
+            delta, taken = produced - taken, produced
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": "Gemma-3",
+                     "choices": [{"index": 0, "delta": {"content": "tok " * delta},
+                                  "finish_reason": "length" if taken == tokens else None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        task.cancel()
+
+
+async def serve(port: int, tokens: int, itl_s: float, settings: StreamSettings) -> None:
+    rng = random.Random(0)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            if head.startswith(b"GET /cpu "):
+                body = str(time.process_time()).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+            async for frame in coalesce(fake_engine(tokens, itl_s, rng), settings):
+                data = frame.encode("utf-8")
+                writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    print(server.sockets[0].getsockname()[1], flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+# -------------------------
+# Клиент
+# -------------------------
+async def stream_once(port: int) -> Tuple[List[float], List[float]]:
+    """Время прихода каждого токена и каждой записи (чанка)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    events: List[float] = []
+    writes: List[float] = []
+    while True:
+        size = int((await reader.readline()).strip(), 16)
+        if size == 0:
+            break
+        data = await reader.readexactly(size + 2)
+        now = time.perf_counter()
+        writes.append(now)
+        events += [now] * data.count(b"tok ")
+    writer.close()
+    return events, writes
+
+
+async def server_cpu(port: int) -> float:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /cpu HTTP/1.1\r\nHost: bench\r\n\r\n")
+    body = (await reader.read()).split(b"\r\n\r\n", 1)[1]
+    writer.close()
+    return float(body)
+
+
+def run_point(concurrency: int, tokens: int, itl_s: float, coalesce_ms: float, rounds: int) -> Dict[str, float]:
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--tokens", str(tokens), "--itl-ms", str(itl_s * 1000),
+         "--coalesce-ms", str(coalesce_ms)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    port = int(server.stdout.readline())
+
+    async def clients() -> Tuple[float, List[Tuple[List[float], List[float]]]]:
+        results = []
+        cpu_before = await server_cpu(port)
+
+        async def worker() -> None:
+            for _ in range(rounds):
+                results.append(await stream_once(port))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return await server_cpu(port) - cpu_before, results
+
+    started = time.perf_counter()
+    cpu, results = asyncio.run(clients())
+    wall = time.perf_counter() - started
+    server.terminate()
+    server.wait()
+
+    token_gaps = np.concatenate([np.diff(e) for e, _ in results])
+    write_gaps = np.concatenate([np.diff(w) for _, w in results])
+    num_tokens = sum(len(e) for e, _ in results)
+    return {
+        "cpu_s": cpu,
+        "cpu_us_per_token": cpu / num_tokens * 1e6,
+        "server_cpu_util": cpu / wall,
+        "writes_per_request": float(np.mean([len(w) for _, w in results])),
+        "token_gap_p95_ms": float(np.quantile(token_gaps, 0.95) * 1000),
+        "write_gap_p95_ms": float(np.quantile(write_gaps, 0.95) * 1000),
+    }
+
+
+def llmperf_levels() -> List[Tuple[int, float, int]]:
+    """(конкурентность, ITL, средний выход) из llmperf_test_results/concurrency_*."""
+    levels = []
+    for path in glob.glob(os.path.join(RESULTS_DIR, "concurrency_*")):
+        summary = json.load(open(glob.glob(os.path.join(path, "*_summary.json"))[0]))
+        levels.append((int(re.search(r"(\d+)$", path).group(1)),
+                       summary["results_inter_token_latency_s_mean"], int(summary["mean_output_tokens"])))
+    return sorted(levels)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--coalesce-ms", type=float, nargs="+", default=[0.0, 20.0])
+    parser.add_argument("--itl-ms", type=float, default=None, help="ITL имитации; по умолчанию — из llmperf-прогонов")
+    parser.add_argument("--tokens", type=int, default=None, help="Токенов на ответ; по умолчанию — из llmperf-прогонов")
+    parser.add_argument("--rounds", type=int, default=1, help="Запросов на одного клиента")
+    args = parser.parse_args()
+
+    if args.serve:
+        settings = StreamSettings(coalesce_ms=args.coalesce_ms[0])
+        asyncio.run(serve(0, args.tokens, args.itl_ms / 1000, settings))
+        return
+
+    print("| Concurrent | ITL, мс | Окно, мс | CPU сервера, мкс/токен | Загрузка CPU | Записей/запрос "
+          "| p95 интервала токенов, мс | p95 интервала записей, мс |")
+    print("| --- | --- | --- | --- | --- | --- | --- | --- |")
+    for concurrency, itl_s, tokens in llmperf_levels():
+        itl_s = args.itl_ms / 1000 if args.itl_ms is not None else itl_s
+        tokens = args.tokens or tokens
+        for window in args.coalesce_ms:
+            r = run_point(concurrency, tokens, itl_s, window, args.rounds)
+            print(f"| {concurrency} | {itl_s * 1000:.1f} | {window:g} | {r['cpu_us_per_token']:.1f} "
+                  f"| {r['server_cpu_util']:.1%} | {r['writes_per_request']:.0f} "
+                  f"| {r['token_gap_p95_ms']:.1f} | {r['write_gap_p95_ms']:.1f} |", flush=True)
+
+
+if __name__ == "__main__":
+    main()
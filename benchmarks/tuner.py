@@ -0,0 +1,609 @@
+"""
+Офлайн-подбор параметров движка (MAX_NUM_SEQS, MAX_NUM_BATCHED_TOKENS, ENABLE_CHUNKED_PREFILL,
+GPU_MEMORY_UTIL, MAX_SEQ_LEN_TO_CAPTURE) под SLO, например "ttft_p95<10" при concurrency 8.
+
+Поиск — successive halving: n конфигураций прогоняются на коротком бенчмарке, лучшая 1/eta
+переходит на следующий круг с числом запросов в eta раз больше. Цель — максимальный throughput
+среди конфигураций, выполняющих SLO; нарушающие ранжируются по величине нарушения.
+Внутри круга у всех конфигураций один seed (одинаковые длины запросов), сравнение парное.
+
+Прогон конфигурации делает runner:
+  DeploymentRunner — поднимает свежий деплой командой (serve run ...) с переменными окружения
+                     конфигурации, ждет /ready, гоняет benchmarks.loadgen и останавливает деплой;
+  SimulatedRunner  — пошаговая модель планировщика vLLM V1 (continuous batching, бюджет токенов
+                     на шаг, чанковый prefill, емкость KV-кеша, CUDA graphs) на CPU.
+Время шага симулятора линейно по коэффициентам CostModel; они подбираются по прогонам
+llmperf_test_results (метод наименьших квадратов с неотрицательными коэффициентами, см. CostModel.fit).
+Эталонные прогоны сделаны с конфигурацией REFERENCE_PARAMS. Память и GPU, а не только тайминги,
+в данных не видны: емкость KV считается из параметров железа CostModel, а риск OOM при высоком
+GPU_MEMORY_UTIL симулятор не моделирует — верхнюю границу задает пространство поиска.
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import os
+import random
+import shlex
+import signal
+import time
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.loadgen import LoadConfig, run_load
+from benchmarks.results import request_metrics, summarize
+
+# Переменная окружения serve.build_config → кандидаты
+DEFAULT_SPACE: Dict[str, List[Any]] = {
+    "MAX_NUM_SEQS": [4, 8, 16, 32, 64, 128, 256],
+    "MAX_NUM_BATCHED_TOKENS": [1024, 2048, 4096, 8192, 16384],
+    "ENABLE_CHUNKED_PREFILL": [False, True],
+    "GPU_MEMORY_UTIL": [0.85, 0.9, 0.95, 0.97],
+    "MAX_SEQ_LEN_TO_CAPTURE": [2048, 4096, 8192, 32768],
+}
+# Значения по умолчанию в serve.build_config — всегда среди кандидатов, чтобы победителя было с чем сравнить
+SERVE_DEFAULTS: Dict[str, Any] = {
+    "MAX_NUM_SEQS": 128,
+    "MAX_NUM_BATCHED_TOKENS": 4096,
+    "ENABLE_CHUNKED_PREFILL": False,
+    "GPU_MEMORY_UTIL": 0.97,
+    "MAX_SEQ_LEN_TO_CAPTURE": 8192,
+}
+# Конфигурация, на которой сняты llmperf_test_results (deploy-gemma3.json: gemma-3-12b AWQ, 2×RTX 3060, PP=2).
+# max_ongoing_requests тогда не задавался — действовал дефолт Serve (5): при concurrency 8 и 16 запросы
+# ждали в очереди Serve, отсюда рост TTFT в concurrency_8/16
+REFERENCE_PARAMS: Dict[str, Any] = {
+    "MAX_ONGOING_REQUESTS": 5,
+    "MAX_NUM_SEQS": 256,
+    "MAX_NUM_BATCHED_TOKENS": 2048,
+    "ENABLE_CHUNKED_PREFILL": True,
+    "GPU_MEMORY_UTIL": 0.9,
+    "MAX_SEQ_LEN_TO_CAPTURE": 32768,
+}
+REFERENCE_MAX_MODEL_LEN = 32768
+REFERENCE_DIR = Path(__file__).resolve().parent.parent / "llmperf_test_results"
+
+# Псевдонимы метрик SLO → поле summary в схеме llmperf
+_SLO_METRICS = {"ttft": "ttft_s", "itl": "inter_token_latency_s", "e2e": "end_to_end_latency_s"}
+THROUGHPUT_KEY = "results_mean_output_throughput_token_per_s"
+# Предельный батч CUDA graphs в vLLM (max_capture_size по умолчанию); больше — eager
+_MAX_CAPTURE_BATCH = 512
+
+
+def validate(params: Dict[str, Any], max_model_len: int) -> Optional[str]:
+    """Проверки vLLM SchedulerConfig: такую конфигурацию движок не запустит — прогонять нечего."""
+    if params["MAX_NUM_BATCHED_TOKENS"] < params["MAX_NUM_SEQS"]:
+        return "MAX_NUM_BATCHED_TOKENS < MAX_NUM_SEQS"
+    if not params["ENABLE_CHUNKED_PREFILL"] and params["MAX_NUM_BATCHED_TOKENS"] < max_model_len:
+        return f"MAX_NUM_BATCHED_TOKENS < max-model-len ({max_model_len}) without chunked prefill"
+    return None
+
+
+def to_env(params: Dict[str, Any]) -> Dict[str, str]:
+    return {k: str(v) for k, v in params.items()}  # bool → "True"/"False", как читает _get_bool_env
+
+
+# -------------------------
+# SLO
+# -------------------------
+@dataclass
+class SLO:
+    metric: str  # Поле summary, например results_ttft_s_quantiles_p95
+    op: str  # "<" или ">"
+    limit: float
+    text: str
+
+    def violation(self, summary: Dict[str, Any]) -> float:
+        """Относительное нарушение; 0 — выполнено."""
+        value = float(summary.get(self.metric, float("nan")))
+        if math.isnan(value):
+            return float("inf")
+        if self.op == "<":
+            return max(0.0, value / self.limit - 1.0)
+        return max(0.0, self.limit / value - 1.0) if value > 0 else float("inf")
+
+
+def parse_slos(text: str) -> List[SLO]:
+    """
+    "ttft_p95<10,itl_mean<0.2,throughput>40": ttft/itl/e2e со статистикой mean|p25..p99 (секунды)
+    или throughput (tok/s в целом по прогону).
+    """
+    slos = []
+    for item in filter(None, (t.strip() for t in text.split(","))):
+        op = "<" if "<" in item else ">"
+        name, limit = (s.strip() for s in item.split(op, 1))
+        if name == "throughput":
+            metric = THROUGHPUT_KEY
+        else:
+            alias, _, stat = name.partition("_")
+            if alias not in _SLO_METRICS or not (stat == "mean" or stat.startswith("p")):
+                raise ValueError(f"unknown SLO metric {name!r}")
+            suffix = "mean" if stat == "mean" else f"quantiles_{stat}"
+            metric = f"results_{_SLO_METRICS[alias]}_{suffix}"
+        slos.append(SLO(metric, op, float(limit), item))
+    return slos
+
+
+def evaluate(summary: Dict[str, Any], slos: Sequence[SLO]) -> Tuple[bool, float]:
+    """(выполнен ли SLO, оценка): throughput для выполняющих, минус нарушение — для остальных."""
+    if summary.get("results_number_errors"):
+        return False, -(1.0 + float(summary.get("results_error_rate", 1.0)))
+    violation = max((slo.violation(summary) for slo in slos), default=0.0)
+    if violation > 0:
+        return False, -violation
+    return True, float(summary.get(THROUGHPUT_KEY, 0.0))
+
+
+# -------------------------
+# Модель стоимости и симулятор движка
+# -------------------------
+# Коэффициенты (θ): время шага = f(шаг) · θ, к TTFT и e2e запроса добавляется overhead
+#   overhead_s      — постоянная задержка запроса вне движка (HTTP, JWT, шаблон чата, токенизация);
+#   step_s          — постоянная часть шага;
+#   per_seq_s       — на каждую декодируемую последовательность (сэмплинг, детокенизация);
+#   per_kv_token_s  — на токен контекста декодируемых последовательностей (чтение KV в attention);
+#   per_prefill_token_s — на токен prefill (матрицы весов);
+#   per_prefill_attn_s  — на пару (токен prefill, токен контекста до него) — квадратичная часть prefill.
+COEFFICIENTS = ("overhead_s", "step_s", "per_seq_s", "per_kv_token_s", "per_prefill_token_s", "per_prefill_attn_s")
+
+
+@dataclass
+class CostModel:
+    theta: np.ndarray = field(default_factory=lambda: np.array([1.0, 0.05, 1e-3, 1e-7, 1e-3, 1e-8]))
+    # Железо и модель эталонных прогонов: емкость KV-кеша = (util * память - веса - активации) / байт на токен
+    gpu_memory_gb: float = 24.0  # 2× RTX 3060 12 ГБ (pipeline parallel)
+    weights_gb: float = 8.0  # gemma-3-12b int4 AWQ
+    activation_gb: float = 2.0  # Активации, CUDA graphs, буферы сэмплера
+    kv_bytes_per_token: int = 65536  # Глобальные слои Gemma-3-12B (8 × 8 KV-голов × 256 × K/V × bf16); локальные держат окно
+    eager_factor: float = 1.3  # Замедление шага без CUDA graphs (контекст > MAX_SEQ_LEN_TO_CAPTURE); в данных не видно
+    fit_error: Optional[float] = None  # Средняя относительная ошибка на эталонных прогонах после fit()
+
+    def kv_capacity(self, gpu_memory_util: float) -> int:
+        free_gb = gpu_memory_util * self.gpu_memory_gb - self.weights_gb - self.activation_gb
+        return max(0, int(free_gb * 1e9 / self.kv_bytes_per_token))
+
+    @classmethod
+    def fit(cls, runs: Sequence["ReferenceRun"], iterations: int = 8, seed: int = 0, **hardware: Any) -> "CostModel":
+        """
+        Подбор θ по средним TTFT и e2e эталонных прогонов. При фиксированном расписании шагов TTFT и e2e
+        каждого запроса линейны по θ (сумма признаков шагов, в течение которых запрос был в движке),
+        поэтому чередуем: симуляция с текущими θ → NNLS по относительным ошибкам → новые θ.
+        Берем итерацию с наименьшей ошибкой.
+        """
+        model = cls(**hardware)
+        best: Optional[Tuple[float, np.ndarray]] = None
+        for _ in range(iterations):
+            rows, sims = [], []
+            for run in runs:
+                sim = simulate(model, REFERENCE_PARAMS, run.workload, REFERENCE_MAX_MODEL_LEN, seed=seed)
+                sims.append(sim)
+                rows.append(sim.mean_features("ttft") / run.ttft_mean)
+                rows.append(sim.mean_features("e2e") / run.e2e_mean)
+            error = _mean_relative_error(runs, sims)
+            if best is None or error < best[0]:
+                best = (error, model.theta.copy())
+            a = np.array(rows)
+            scale = np.sqrt((a ** 2).mean(axis=0)) + 1e-30  # Признаки различаются на порядки — нормируем столбцы
+            model.theta = _nnls(a / scale, np.ones(len(rows))) / scale
+        model.theta, model.fit_error = best[1], best[0]
+        return model
+
+
+def _nnls(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Наименьшие квадраты с x >= 0: исключаем самый отрицательный коэффициент, пока такие есть."""
+    active = list(range(a.shape[1]))
+    x = np.zeros(a.shape[1])
+    while active:
+        solution = np.linalg.lstsq(a[:, active], b, rcond=None)[0]
+        if (solution >= 0).all():
+            x[active] = solution
+            break
+        active.pop(int(np.argmin(solution)))
+    return x
+
+
+def _mean_relative_error(runs: Sequence["ReferenceRun"], sims: Sequence["SimResult"]) -> float:
+    errors = []
+    for run, sim in zip(runs, sims):
+        errors.append(abs(sim.summary["results_ttft_s_mean"] / run.ttft_mean - 1))
+        errors.append(abs(sim.summary["results_end_to_end_latency_s_mean"] / run.e2e_mean - 1))
+    return float(np.mean(errors))
+
+
+@dataclass
+class _Seq:
+    prompt: int
+    output: int
+    sent: float  # Клиент отправил запрос
+    target: int = 0  # Токенов, которые должны быть в KV до декодирования (после вытеснения — промпт + сгенерированное)
+    computed: int = 0  # Токенов в KV
+    generated: int = 0
+    first_token: Optional[float] = None
+    f_ttft: np.ndarray = field(default_factory=lambda: np.zeros(len(COEFFICIENTS)))
+    f_e2e: np.ndarray = field(default_factory=lambda: np.zeros(len(COEFFICIENTS)))
+
+    def __post_init__(self) -> None:
+        self.target = self.prompt
+        self.f_ttft[0] = self.f_e2e[0] = 1.0  # overhead_s
+
+
+@dataclass
+class SimResult:
+    summary: Dict[str, Any]
+    records: List[Dict[str, Any]]
+    features: Dict[str, List[np.ndarray]]  # "ttft"/"e2e" → признаки завершенных запросов
+    preemptions: int = 0
+
+    def mean_features(self, kind: str) -> np.ndarray:
+        return np.mean(self.features[kind], axis=0)
+
+
+def simulate(model: CostModel, params: Dict[str, Any], workload: LoadConfig, max_model_len: int,
+             seed: int = 0) -> SimResult:
+    """
+    Замкнутая петля llmperf (num_concurrent_requests клиентов, запрос за запросом) против модели планировщика V1.
+    Перед движком — очередь Serve: в реплике одновременно до MAX_ONGOING_REQUESTS запросов (по умолчанию,
+    как в build_app, — MAX_NUM_SEQS). В движке
+    на шаге сначала идут запущенные последовательности (декод — по токену, недочитанный prefill — чанком),
+    затем ожидающие, пока есть бюджет MAX_NUM_BATCHED_TOKENS, слоты MAX_NUM_SEQS и место в KV.
+    Без чанкового prefill промпт, не помещающийся в остаток бюджета, ждет следующего шага.
+    Нехватка KV при декоде вытесняет последнюю запущенную последовательность (recompute).
+    """
+    rng = random.Random(seed)  # Длины — как в benchmarks.loadgen
+    capacity = model.kv_capacity(params["GPU_MEMORY_UTIL"])
+    budget_per_step = params["MAX_NUM_BATCHED_TOKENS"]
+    max_seqs = params["MAX_NUM_SEQS"]
+    chunked = params["ENABLE_CHUNKED_PREFILL"]
+    capture_len = params["MAX_SEQ_LEN_TO_CAPTURE"]
+    max_ongoing = params.get("MAX_ONGOING_REQUESTS", max_seqs)
+    overhead = model.theta[0]
+
+    remaining = workload.max_num_completed_requests
+    now = 0.0
+    arrivals: List[Tuple[float, _Seq]] = []  # Запрос дойдет до реплики через overhead после отправки
+    queued: List[_Seq] = []  # Очередь Serve перед репликой
+    waiting: List[_Seq] = []
+    running: List[_Seq] = []
+    records: List[Dict[str, Any]] = []
+    features: Dict[str, List[np.ndarray]] = {"ttft": [], "e2e": []}
+    preemptions = 0
+
+    def send(at: float) -> None:
+        nonlocal remaining
+        if remaining <= 0:
+            return
+        remaining -= 1
+        num_in = max(1, int(rng.gauss(workload.mean_input_tokens, workload.stddev_input_tokens)))
+        num_out = max(1, int(rng.gauss(workload.mean_output_tokens, workload.stddev_output_tokens)))
+        if num_in + num_out > max_model_len:  # vLLM отвечает 400 сразу
+            records.append(request_metrics(None, overhead, num_in, 0, error_code=400,
+                                           error_msg="maximum context length exceeded"))
+            send(at + overhead)
+            return
+        arrivals.append((at + overhead, _Seq(num_in, num_out, at)))
+
+    for _ in range(workload.num_concurrent_requests):
+        send(0.0)
+
+    while arrivals or queued or waiting or running:
+        arrivals.sort(key=lambda item: item[0])
+        if not queued and not waiting and not running:
+            now = max(now, arrivals[0][0])  # Движок простаивает до следующего запроса
+        while arrivals and arrivals[0][0] <= now:
+            queued.append(arrivals.pop(0)[1])
+        while queued and len(running) + len(waiting) < max_ongoing:
+            waiting.append(queued.pop(0))
+
+        budget = budget_per_step
+        held = sum(s.computed for s in running)
+        decode: List[_Seq] = []
+        prefill: List[Tuple[_Seq, int]] = []
+        for seq in list(running):
+            if seq.computed >= seq.target:
+                while held + 1 > capacity and running[-1] is not seq:  # Нет блока под токен — вытесняем последнюю
+                    victim = running.pop()
+                    held -= victim.computed
+                    decode = [s for s in decode if s is not victim]
+                    prefill = [(s, c) for s, c in prefill if s is not victim]
+                    victim.target, victim.computed = victim.prompt + victim.generated, 0
+                    waiting.insert(0, victim)
+                    preemptions += 1
+                if seq not in running or budget < 1:
+                    continue
+                decode.append(seq)
+                budget -= 1
+                held += 1
+            elif budget > 0:
+                chunk = min(seq.target - seq.computed, budget)
+                prefill.append((seq, chunk))
+                budget -= chunk
+                held += chunk
+        while waiting and len(running) < max_seqs and budget > 0:
+            seq = waiting[0]
+            need = seq.target - seq.computed
+            chunk = min(need, budget) if chunked else need
+            if chunk > budget or held + chunk > capacity:
+                break
+            running.append(waiting.pop(0))
+            prefill.append((seq, chunk))
+            budget -= chunk
+            held += chunk
+        if not decode and not prefill:
+            if not arrivals:
+                break  # Запрос не помещается в KV-кеш даже один — дальше не продвинуться
+            now = max(now, arrivals[0][0])
+            continue
+
+        eager = len(decode) > _MAX_CAPTURE_BATCH or any(s.computed > capture_len for s in decode)
+        g = model.eager_factor if eager else 1.0
+        f = np.array([
+            0.0,
+            g,
+            g * len(decode),
+            sum(s.computed for s in decode),
+            sum(c for _, c in prefill),
+            sum(c * (s.computed + c / 2) for s, c in prefill),
+        ])
+        now += float(f @ model.theta)
+        for seq in itertools.chain(running, waiting, queued):  # Шаг идет в TTFT/e2e всех запросов в реплике
+            seq.f_e2e += f
+            if seq.first_token is None:
+                seq.f_ttft += f
+
+        for seq, chunk in prefill:
+            seq.computed += chunk
+        for seq in decode + [s for s, _ in prefill if s.computed >= s.target]:
+            if seq in decode:
+                seq.computed += 1
+                seq.target += 1
+            seq.generated += 1  # Последний чанк prefill тоже выдает токен
+            if seq.first_token is None:
+                seq.first_token = now
+            if seq.generated >= seq.output:
+                running.remove(seq)
+                records.append(request_metrics(seq.first_token - seq.sent, now - seq.sent,
+                                               seq.prompt, seq.output))
+                features["ttft"].append(seq.f_ttft)
+                features["e2e"].append(seq.f_e2e)
+                send(now)
+
+    for seq in queued + waiting + [s for _, s in arrivals]:  # Не поместившиеся в KV — ошибка, как OOM/таймаут
+        records.append(request_metrics(None, now - seq.sent, seq.prompt, 0, error_code=599,
+                                       error_msg="does not fit into KV cache"))
+    summary = summarize(
+        records,
+        model=workload.model,
+        mean_input_tokens=workload.mean_input_tokens,
+        stddev_input_tokens=workload.stddev_input_tokens,
+        mean_output_tokens=workload.mean_output_tokens,
+        stddev_output_tokens=workload.stddev_output_tokens,
+        num_concurrent_requests=workload.num_concurrent_requests,
+        elapsed_s=now,
+    )
+    if not features["ttft"]:
+        features = {"ttft": [np.zeros(len(COEFFICIENTS))], "e2e": [np.zeros(len(COEFFICIENTS))]}
+    return SimResult(summary, records, features, preemptions)
+
+
+# -------------------------
+# Эталонные прогоны
+# -------------------------
+@dataclass
+class ReferenceRun:
+    name: str
+    workload: LoadConfig
+    ttft_mean: float
+    e2e_mean: float
+    itl_mean: float
+    throughput: float
+
+
+def load_reference_runs(root: Path = REFERENCE_DIR) -> List[ReferenceRun]:
+    """Прогоны token_benchmark_ray (baseline, concurrency_*, context_*, sampler_*) — у correctness метрик нет."""
+    runs = []
+    for path in sorted(root.glob("*/*_summary.json")):
+        s = json.loads(path.read_text())
+        if "results_ttft_s_mean" not in s:
+            continue
+        workload = LoadConfig(
+            base_url="", model=s["model"],
+            mean_input_tokens=int(s["mean_input_tokens"]), stddev_input_tokens=int(s["stddev_input_tokens"]),
+            mean_output_tokens=int(s["mean_output_tokens"]), stddev_output_tokens=int(s["stddev_output_tokens"]),
+            num_concurrent_requests=int(s["num_concurrent_requests"]),
+            max_num_completed_requests=int(s["results_num_completed_requests"]),
+        )
+        runs.append(ReferenceRun(
+            path.parent.name, workload, s["results_ttft_s_mean"], s["results_end_to_end_latency_s_mean"],
+            s["results_inter_token_latency_s_mean"], s[THROUGHPUT_KEY],
+        ))
+    return runs
+
+
+def calibration_table(model: CostModel, runs: Sequence[ReferenceRun], seed: int = 0) -> str:
+    """Markdown: измерено / модель по каждому эталонному прогону."""
+    lines = [
+        "| Прогон | ttft mean, с | модель | itl mean, с | модель | throughput, tok/s | модель |",
+        "| --- | --- | --- | --- | --- | --- | --- |",
+    ]
+    for run in runs:
+        s = simulate(model, REFERENCE_PARAMS, run.workload, REFERENCE_MAX_MODEL_LEN, seed=seed).summary
+        lines.append(
+            f"| {run.name} | {run.ttft_mean:.2f} | {s['results_ttft_s_mean']:.2f} "
+            f"| {run.itl_mean:.3f} | {s['results_inter_token_latency_s_mean']:.3f} "
+            f"| {run.throughput:.1f} | {s[THROUGHPUT_KEY]:.1f} |"
+        )
+    return "\n".join(lines)
+
+
+# -------------------------
+# Прогон конфигурации
+# -------------------------
+Runner = Callable[[Dict[str, Any], LoadConfig], Awaitable[Dict[str, Any]]]
+
+
+class TrialFailed(Exception):
+    """Конфигурация не поднялась (процесс деплоя завершился или не стал готов вовремя)."""
+
+
+class SimulatedRunner:
+    """Прогон на модели движка: та же схема summary, что у benchmarks.loadgen."""
+
+    def __init__(self, model: CostModel, max_model_len: int):
+        self.model = model
+        self.max_model_len = max_model_len
+
+    async def __call__(self, params: Dict[str, Any], workload: LoadConfig) -> Dict[str, Any]:
+        return simulate(self.model, params, workload, self.max_model_len, seed=workload.seed).summary
+
+
+class DeploymentRunner:
+    """
+    Свежий деплой на каждую конфигурацию: команда (по умолчанию serve run из ray-serve-vllm) с переменными
+    окружения конфигурации поверх текущих; готовность — 200 на GET /ready; после прогона — SIGINT группе
+    процессов (serve run при этом удаляет приложение), через stop_timeout_s — SIGKILL.
+    """
+
+    def __init__(self, deploy_cmd: str, ready_timeout_s: float = 1800.0, stop_timeout_s: float = 120.0):
+        self.deploy_cmd = deploy_cmd
+        self.ready_timeout_s = ready_timeout_s
+        self.stop_timeout_s = stop_timeout_s
+
+    async def __call__(self, params: Dict[str, Any], workload: LoadConfig) -> Dict[str, Any]:
+        async with self.deployment(params, workload.base_url):
+            return (await run_load(workload))["summary"]
+
+    @contextlib.asynccontextmanager
+    async def deployment(self, params: Dict[str, Any], base_url: str) -> AsyncIterator[None]:
+        """Деплой с переменными params поднят и готов внутри блока, остановлен после."""
+        process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.deploy_cmd), env={**os.environ, **to_env(params)}, start_new_session=True,
+        )
+        try:
+            await self._wait_ready(process, base_url)
+            yield
+        finally:
+            await self._stop(process)
+
+    async def _wait_ready(self, process: asyncio.subprocess.Process, base_url: str) -> None:
+        deadline = time.monotonic() + self.ready_timeout_s
+        async with httpx.AsyncClient(base_url=base_url, timeout=5) as client:
+            while time.monotonic() < deadline:
+                if process.returncode is not None:
+                    raise TrialFailed(f"deploy command exited with {process.returncode}")
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(5)
+        raise TrialFailed(f"deployment not ready after {self.ready_timeout_s:.0f}s")
+
+    async def _stop(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        os.killpg(process.pid, signal.SIGINT)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=self.stop_timeout_s)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+
+
+# -------------------------
+# Successive halving
+# -------------------------
+@dataclass
+class Trial:
+    params: Dict[str, Any]
+    rung: int
+    requests: int
+    feasible: bool = False
+    score: float = float("-inf")
+    summary: Dict[str, Any] = field(default_factory=dict)
+    error: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        metrics = {k: self.summary.get(k) for k in (
+            "results_ttft_s_quantiles_p95", "results_inter_token_latency_s_mean",
+            "results_end_to_end_latency_s_quantiles_p95", THROUGHPUT_KEY, "results_number_errors",
+        )}
+        return {"params": self.params, "rung": self.rung, "requests": self.requests, "feasible": self.feasible,
+                "score": self.score, "error": self.error, **metrics}
+
+
+def _rank(trial: Trial) -> Tuple[bool, float, float]:
+    """При равной (до 0.1) оценке — меньший GPU_MEMORY_UTIL: запас против OOM, которого симулятор не видит."""
+    return trial.feasible, round(trial.score, 1), -float(trial.params.get("GPU_MEMORY_UTIL", 0))
+
+
+def candidates(space: Dict[str, List[Any]], max_model_len: int, n: int, seed: int) -> List[Dict[str, Any]]:
+    """n допустимых конфигураций из сетки space (случайная выборка) плюс значения по умолчанию serve.py."""
+    grid = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    grid = [p for p in grid if validate(p, max_model_len) is None]
+    random.Random(seed).shuffle(grid)
+    defaults = {k: SERVE_DEFAULTS.get(k, values[0]) for k, values in space.items()}
+    chosen = [defaults] if validate(defaults, max_model_len) is None else []
+    chosen += [p for p in grid if p != defaults][: max(0, n - len(chosen))]
+    return chosen
+
+
+async def successive_halving(
+        runner: Runner,
+        configs: List[Dict[str, Any]],
+        workload: LoadConfig,
+        slos: Sequence[SLO],
+        min_requests: int = 10,
+        max_requests: int = 90,
+        eta: int = 3,
+        seed: int = 0,
+        on_trial: Optional[Callable[[Trial], None]] = None,
+) -> List[Trial]:
+    """Все испытания по кругам; победитель — лучший в последнем круге (см. best())."""
+    trials: List[Trial] = []
+    requests, rung = min_requests, 0
+    while configs:
+        scored = []
+        for params in configs:
+            trial = Trial(params, rung, requests)
+            try:
+                trial.summary = await runner(params, replace(workload, max_num_completed_requests=requests,
+                                                             seed=seed + rung))
+                trial.feasible, trial.score = evaluate(trial.summary, slos)
+            except TrialFailed as e:
+                trial.error = str(e)
+            trials.append(trial)
+            scored.append(trial)
+            if on_trial:
+                on_trial(trial)
+        if len(configs) == 1 or requests >= max_requests:
+            break
+        scored.sort(key=_rank, reverse=True)
+        configs = [t.params for t in scored[: max(1, len(scored) // eta)]]
+        requests, rung = min(requests * eta, max_requests), rung + 1
+    return trials
+
+
+def best(trials: Sequence[Trial]) -> Optional[Trial]:
+    last_rung = max((t.rung for t in trials), default=0)
+    final = [t for t in trials if t.rung == last_rung and not t.error]
+    return max(final, key=_rank, default=None)
+
+
+def write_env(path: Path, trial: Trial, slos: Sequence[SLO], workload: LoadConfig) -> None:
+    """Файл KEY=VALUE для env_vars деплоя (как в deploy-gemma3.json) с метриками победителя в комментарии."""
+    s = trial.summary
+    lines = [
+        f"# SLO: {', '.join(slo.text for slo in slos)} at concurrency {workload.num_concurrent_requests}, "
+        f"input {workload.mean_input_tokens}, output {workload.mean_output_tokens} tokens"
+        + ("" if trial.feasible else " — NOT MET by any candidate"),
+        f"# ttft p95 {s.get('results_ttft_s_quantiles_p95', float('nan')):.3f}s, "
+        f"itl mean {s.get('results_inter_token_latency_s_mean', float('nan')):.3f}s, "
+        f"throughput {s.get(THROUGHPUT_KEY, float('nan')):.1f} tok/s over {trial.requests} requests",
+    ]
+    lines += [f"{k}={v}" for k, v in to_env(trial.params).items()]
+    path.write_text("\n".join(lines) + "\n")
@@ -0,0 +1,226 @@
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger("ray.serve")
+
+ADAPTER_LOADS = Counter("vllm_lora_adapter_loads_total", "LoRA adapter loads by result", ["result"])
+ADAPTER_EVICTIONS = Counter("vllm_lora_adapter_evictions_total", "LoRA adapters unloaded to free room")
+ADAPTERS_RESIDENT = Gauge("vllm_lora_adapters_resident", "LoRA adapters currently loaded in the engine")
+ADAPTERS_RESIDENT_BYTES = Gauge("vllm_lora_adapters_resident_bytes", "Weight bytes of loaded LoRA adapters")
+
+# Файлы весов адаптера: по их размеру считаем занимаемую память
+_WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+
+@dataclass
+class Adapter:
+    name: str  # Имя, которое клиент передает в поле model
+    path: str  # Локальный каталог или id репозитория HF
+    size_bytes: int = 0  # Размер весов на диске; 0 — неизвестен (учитывается только лимит по числу)
+
+
+class AdapterLoadError(Exception):
+    """Адаптер не удалось загрузить в движок; code — HTTP-статус ответа vLLM."""
+    def __init__(self, message: str, code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def _weights_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return 0
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(_WEIGHT_SUFFIXES)
+    )
+
+
+def parse_adapters(raw: str) -> Dict[str, Adapter]:
+    """
+    Реестр адаптеров: JSON-объект {"name": "path"}, JSON-список [{"name", "path"}]
+    или строка "name=path,name2=path2" (как LORA_ADAPTERS в окружении).
+    """
+    raw = raw.strip()
+    if not raw:
+        return {}
+    if raw[0] in "{[":
+        data = json.loads(raw)
+        items = data.items() if isinstance(data, dict) else [(a["name"], a["path"]) for a in data]
+    else:
+        items = [item.split("=", 1) for item in raw.split(",") if item.strip()]
+    return {name.strip(): Adapter(name.strip(), path.strip(), _weights_size(path.strip())) for name, path in items}
+
+
+class AdapterRegistry:
+    """
+    LoRA-адаптеры одной реплики: загрузка при первом запросе и LRU загруженных с лимитом по числу и байтам.
+
+    Загрузка идет через OpenAIServingModels.load_lora_adapter (add_lora в движке), после чего
+    OpenAIServingChat сам сопоставляет request.model с адаптером. Пока адаптер грузится, ждут только
+    запросы к нему (блокировка на адаптер); базовая модель и загруженные адаптеры идут без ожидания.
+    Адаптер с запросами в работе не вытесняется: acquire/release держат счетчик до конца ответа.
+    """
+
+    def __init__(self, adapters: Dict[str, Adapter], max_resident: int, max_bytes: int = 0):
+        self.adapters = adapters
+        self.max_resident = max_resident
+        self.max_bytes = max_bytes  # 0 — без лимита по памяти
+        self._resident: "OrderedDict[str, asyncio.Event]" = OrderedDict()  # name → загружен (set) / грузится
+        self._inflight: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Вытесняемые: из _resident уже убраны, но в vLLM еще зарегистрированы — повторная загрузка ждет выгрузки
+        self._evicting: Dict[str, asyncio.Event] = {}
+        self.models: Any = None  # OpenAIServingModels — через bind() после построения обёрток
+        self.engine: Any = None
+
+    @classmethod
+    def from_env(cls, default_max_resident: int) -> "AdapterRegistry":
+        """
+        LORA_ADAPTERS — реестр строкой (см. parse_adapters), LORA_ADAPTERS_FILE — то же из файла (например, ConfigMap).
+        LORA_MAX_RESIDENT — адаптеров в движке одновременно (по умолчанию max-cpu-loras),
+        LORA_MAX_RESIDENT_BYTES — лимит суммарного размера их весов.
+        """
+        adapters = parse_adapters(os.environ.get("LORA_ADAPTERS", ""))
+        path = os.environ.get("LORA_ADAPTERS_FILE")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                adapters.update(parse_adapters(f.read()))
+        return cls(
+            adapters,
+            max_resident=int(os.environ.get("LORA_MAX_RESIDENT", default_max_resident)),
+            max_bytes=int(os.environ.get("LORA_MAX_RESIDENT_BYTES", "0")),
+        )
+
+    def bind(self, models: Any, engine: Any) -> None:
+        self.models = models
+        self.engine = engine
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.adapters
+
+    def is_loaded(self, name: str) -> bool:
+        event = self._resident.get(name)
+        return event is not None and event.is_set()
+
+    async def acquire(self, name: Optional[str]) -> Optional[str]:
+        """Гарантирует, что адаптер загружен, и закрепляет его; для базовой модели — None."""
+        if not name or name not in self.adapters:
+            return None
+        if not self.is_loaded(name):
+            await self._load(name)
+        self._resident.move_to_end(name)
+        self._inflight[name] = self._inflight.get(name, 0) + 1
+        return name
+
+    def release(self, name: Optional[str]) -> None:
+        if name is not None:
+            self._inflight[name] -= 1
+
+    async def guard_stream(self, generator: AsyncIterator[Any], name: Optional[str]) -> AsyncIterator[Any]:
+        """Держит адаптер закрепленным до конца SSE-стрима."""
+        try:
+            async for chunk in generator:
+                yield chunk
+        finally:
+            self.release(name)
+
+    async def _load(self, name: str) -> None:
+        from vllm.entrypoints.openai.protocol import ErrorResponse, LoadLoRAAdapterRequest
+
+        adapter = self.adapters[name]
+        async with self._locks.setdefault(name, asyncio.Lock()):
+            if self.is_loaded(name):
+                return  # Загрузил конкурентный запрос, пока ждали
+            evicting = self._evicting.get(name)
+            if evicting is not None:
+                await evicting.wait()  # Иначе vLLM ответит "already loaded", а выгрузка снимет адаптер после нас
+            victims = self._pick_victims(adapter.size_bytes)  # Без await: выбор, резерв и пометка атомарны для event loop
+            ready = self._resident[name] = asyncio.Event()
+            try:
+                try:
+                    for victim in victims:
+                        await self._unload(victim)
+                        self._evicting.pop(victim).set()
+                finally:
+                    for victim in victims:  # Выгрузка оборвалась — не держим ждущих вечно
+                        event = self._evicting.pop(victim, None)
+                        if event is not None:
+                            event.set()
+                result = await self.models.load_lora_adapter(
+                    LoadLoRAAdapterRequest(lora_name=name, lora_path=adapter.path)
+                )
+                if isinstance(result, ErrorResponse):
+                    raise AdapterLoadError(result.message, result.code)
+            except BaseException as e:
+                self._resident.pop(name, None)
+                ADAPTER_LOADS.labels("error").inc()
+                logger.warning(f"[lora] failed to load adapter {name} from {adapter.path}: {e}")
+                raise
+            ready.set()
+            ADAPTER_LOADS.labels("ok").inc()
+            self._update_gauges()
+            logger.info(f"[lora] loaded adapter {name} ({len(self._resident)}/{self.max_resident} resident)")
+
+    def _resident_bytes(self) -> int:
+        return sum(self.adapters[n].size_bytes for n in self._resident)
+
+    def _pick_victims(self, incoming_bytes: int) -> List[str]:
+        """Самые давно использованные загруженные адаптеры без запросов в работе, пока новый не поместится."""
+        victims = []
+        count, size = len(self._resident), self._resident_bytes()
+        for name, ready in list(self._resident.items()):
+            over_count = count + 1 > self.max_resident
+            over_bytes = self.max_bytes > 0 and size + incoming_bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            if ready.is_set() and self._inflight.get(name, 0) == 0:
+                del self._resident[name]
+                self._evicting[name] = asyncio.Event()
+                victims.append(name)
+                count, size = count - 1, size - self.adapters[name].size_bytes
+        if count + 1 > self.max_resident:
+            logger.warning("[lora] all resident adapters are busy, exceeding LORA_MAX_RESIDENT temporarily")
+        return victims
+
+    async def _unload(self, name: str) -> None:
+        """Снимает адаптер из OpenAIServingModels и освобождает его веса в воркерах."""
+        from vllm.entrypoints.openai.protocol import UnloadLoRAAdapterRequest
+
+        lora_request = self.models.lora_requests.get(name)
+        await self.models.unload_lora_adapter(UnloadLoRAAdapterRequest(lora_name=name))
+        if lora_request is not None:
+            await self.engine.remove_lora(lora_request.lora_int_id)  # unload_lora_adapter движок не трогает
+        ADAPTER_EVICTIONS.inc()
+        self._update_gauges()
+        logger.info(f"[lora] evicted adapter {name}")
+
+    def _update_gauges(self) -> None:
+        ADAPTERS_RESIDENT.set(len(self._resident))
+        ADAPTERS_RESIDENT_BYTES.set(self._resident_bytes())
+
+    def model_cards(self, parent: Optional[str]) -> List[Dict[str, Any]]:
+        """Адаптеры реестра для /v1/models: загруженные и доступные для загрузки по запросу."""
+        return [
+            {
+                "id": a.name, "object": "model", "owned_by": "vllm", "root": a.path, "parent": parent,
+                "permission": [], "status": "loaded" if self.is_loaded(a.name) else "available",
+            }
+            for a in self.adapters.values()
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "registered": len(self.adapters),
+            "resident": [n for n in self._resident if self.is_loaded(n)],
+            "resident_bytes": self._resident_bytes(),
+            "max_resident": self.max_resident,
+            "max_bytes": self.max_bytes,
+            "inflight": {n: c for n, c in self._inflight.items() if c},
+        }
@@ -0,0 +1,309 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+ADMISSION_REQUESTS = Counter(
+    "vllm_admission_requests_total",
+    "Admission decisions (admitted/rejected_rate/rejected_queue)",
+    ["result"],
+)
+ADMISSION_INFLIGHT = Gauge("vllm_admission_inflight", "Generations holding an admission slot")
+ADMISSION_QUEUED = Gauge("vllm_admission_queued", "Requests waiting in the admission queue")
+
+
+@dataclass
+class Limits:
+    """Лимиты пользователя или роли; None — ограничение не задано."""
+    tokens_per_s: Optional[float] = None  # Скорость пополнения бакета (промпт + max_tokens в секунду)
+    burst_tokens: Optional[float] = None  # Емкость бакета; по умолчанию — 60 секунд скорости
+    weight: Optional[float] = None  # Вес в справедливой очереди
+    max_concurrency: Optional[int] = None  # Одновременных генераций на пользователя
+    priority: Optional[int] = None  # Приоритет vLLM (меньше — раньше), только для ролей
+
+
+def _float_env(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else None
+
+
+def _limits_from_env(prefix: str) -> Limits:
+    concurrency = _float_env(f"{prefix}_MAX_CONCURRENCY")
+    priority = _float_env(f"{prefix}_PRIORITY")
+    weight = _float_env(f"{prefix}_WEIGHT")
+    if concurrency is not None and concurrency < 1:  # 0 — ни один запрос никогда не будет допущен
+        raise ValueError(f"{prefix}_MAX_CONCURRENCY must be >= 1, got {concurrency:g}")
+    if weight is not None and weight <= 0:
+        raise ValueError(f"{prefix}_WEIGHT must be > 0, got {weight:g}")
+    return Limits(
+        tokens_per_s=_float_env(f"{prefix}_RATE_TOKENS_PER_S"),
+        burst_tokens=_float_env(f"{prefix}_BURST_TOKENS"),
+        weight=weight,
+        max_concurrency=int(concurrency) if concurrency is not None else None,
+        priority=int(priority) if priority is not None else None,
+    )
+
+
+def load_limits() -> Tuple[Dict[str, Limits], Dict[str, Limits]]:
+    """
+    Лимиты в той же схеме, что и пользователи (user_store.parse_users): для каждого псевдонима из USER_LIST
+        ALICE_RATE_TOKENS_PER_S, ALICE_BURST_TOKENS, ALICE_WEIGHT, ALICE_MAX_CONCURRENCY
+    (ключ — ALICE_USERNAME), для ролей из ADMISSION_ROLES (по умолчанию admin,user,guest,batch):
+        ROLE_ADMIN_RATE_TOKENS_PER_S, ..., ROLE_ADMIN_PRIORITY
+    """
+    users: Dict[str, Limits] = {}
+    for alias in [u.strip().upper() for u in os.environ.get("USER_LIST", "").split(",") if u.strip()]:
+        username = os.environ.get(f"{alias}_USERNAME")
+        if username:
+            users[username] = _limits_from_env(alias)
+    roles: Dict[str, Limits] = {}
+    for role in [r.strip() for r in os.environ.get("ADMISSION_ROLES", "admin,user,guest,batch").split(",") if r.strip()]:
+        roles[role] = _limits_from_env(f"ROLE_{role.upper()}")
+    return users, roles
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: превышен лимит скорости или очередь заполнена (HTTP 429)."""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Бакет с долгом: запрос проходит, пока баланс положительный, и может увести его в минус —
+    так крупный запрос не блокируется навсегда, а следующие ждут, пока долг погасится.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self, now: float) -> float:
+        """0, если запрос можно пропустить сейчас; иначе секунды до положительного баланса."""
+        self._refill(now)
+        return 0.0 if self.tokens > 0 else -self.tokens / self.rate + 1e-3
+
+    def consume(self, cost: float) -> None:
+        self.tokens -= cost
+
+
+@dataclass
+class Ticket:
+    user: str
+    role: str
+    cost: float
+
+
+class _Waiter:
+    __slots__ = ("ticket", "weight_tag", "future", "cancelled")
+
+    def __init__(self, ticket: Ticket, weight_tag: float, future: "asyncio.Future[Ticket]"):
+        self.ticket = ticket
+        self.weight_tag = weight_tag
+        self.future = future
+        self.cancelled = False
+
+
+class AdmissionController:
+    """
+    Допуск запросов в движок реплики:
+      1) token bucket на пользователя и на роль (стоимость = оценка промпта + max_tokens) — иначе 429;
+      2) не больше max_inflight одновременных генераций; лишние ждут в ограниченной очереди (иначе 429);
+      3) из очереди — взвешенная справедливая очередь (WFQ): у каждого пользователя виртуальное время
+         окончания = max(V, прошлый тег) + стоимость / вес; первым идет наименьший тег.
+    Всё работает в event loop реплики, блокировки не нужны.
+    """
+    def __init__(
+            self,
+            max_inflight: int,
+            max_queue: int,
+            users: Optional[Dict[str, Limits]] = None,
+            roles: Optional[Dict[str, Limits]] = None,
+            queue_retry_after_s: float = 1.0,
+    ):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.users = users or {}
+        self.roles = roles or {}
+        self.queue_retry_after_s = queue_retry_after_s
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._queue: List[Tuple[float, int, _Waiter]] = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._inflight = 0
+        self._user_inflight: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_queue = 0
+
+    @classmethod
+    def from_env(cls, default_max_inflight: int) -> "AdmissionController":
+        users, roles = load_limits()
+        return cls(
+            max_inflight=int(os.environ.get("ADMISSION_MAX_INFLIGHT", default_max_inflight)),
+            max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "256")),
+            users=users,
+            roles=roles,
+            queue_retry_after_s=float(os.environ.get("ADMISSION_QUEUE_RETRY_AFTER_S", "1")),
+        )
+
+    # -------------------------
+    # Политики
+    # -------------------------
+    def _limit(self, user: str, role: str, field: str) -> Any:
+        value = getattr(self.users.get(user, Limits()), field)
+        if value is None:
+            value = getattr(self.roles.get(role, Limits()), field)
+        return value
+
+    def priority_for(self, role: str) -> Optional[int]:
+        return self.roles.get(role, Limits()).priority
+
+    def _bucket(self, scope: str, name: str, limits: Optional[Limits]) -> Optional[TokenBucket]:
+        if limits is None or not limits.tokens_per_s:
+            return None
+        bucket = self._buckets.get((scope, name))
+        if bucket is None:
+            capacity = limits.burst_tokens or limits.tokens_per_s * 60
+            bucket = self._buckets[(scope, name)] = TokenBucket(limits.tokens_per_s, capacity)
+        return bucket
+
+    def _can_run(self, user: str, role: str) -> bool:
+        cap = self._limit(user, role, "max_concurrency")
+        return cap is None or self._user_inflight.get(user, 0) < cap
+
+    def _grant(self, ticket: Ticket) -> Ticket:
+        self._inflight += 1
+        self._user_inflight[ticket.user] = self._user_inflight.get(ticket.user, 0) + 1
+        self.admitted += 1
+        ADMISSION_REQUESTS.labels("admitted").inc()
+        self._publish()
+        return ticket
+
+    def _publish(self) -> None:
+        ADMISSION_INFLIGHT.set(self._inflight)
+        ADMISSION_QUEUED.set(self._queued)
+
+    # -------------------------
+    # Допуск / освобождение
+    # -------------------------
+    async def acquire(self, user: str, role: str, cost: float) -> Ticket:
+        """Ждет слот; AdmissionRejected — если лимит скорости исчерпан или очередь полна."""
+        now = time.monotonic()
+        must_queue = self._inflight >= self.max_inflight or self._queued > 0 or not self._can_run(user, role)
+        if must_queue and self._queued >= self.max_queue:
+            self.rejected_queue += 1
+            ADMISSION_REQUESTS.labels("rejected_queue").inc()
+            raise AdmissionRejected("admission queue is full", self.queue_retry_after_s)
+
+        buckets = [b for b in (self._bucket("user", user, self.users.get(user)),
+                               self._bucket("role", role, self.roles.get(role))) if b is not None]
+        wait = max((b.retry_after(now) for b in buckets), default=0.0)
+        if wait > 0:
+            self.rejected_rate += 1
+            ADMISSION_REQUESTS.labels("rejected_rate").inc()
+            raise AdmissionRejected("token rate limit exceeded", wait)
+        for b in buckets:
+            b.consume(cost)
+
+        ticket = Ticket(user, role, cost)
+        if not must_queue:
+            return self._grant(ticket)
+
+        weight = self._limit(user, role, "weight") or 1.0
+        tag = max(self._virtual_time, self._last_tag.get(user, 0.0)) + cost / weight
+        self._last_tag[user] = tag
+        waiter = _Waiter(ticket, tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (tag, next(self._seq), waiter))
+        self._queued += 1
+        # Очередь могла стоять из-за чужого max_concurrency при свободных слотах — раздаем сразу,
+        # а не только из release(): иначе такой ожидающий блокирует всех остальных
+        self._dispatch()
+        self._publish()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            # Клиент ушел, пока ждал: если слот уже выдан — возвращаем его
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            elif not waiter.cancelled:
+                waiter.cancelled = True
+                self._queued -= 1
+                self._publish()
+            raise
+
+    def release(self, ticket: Ticket) -> None:
+        self._inflight -= 1
+        left = self._user_inflight.get(ticket.user, 1) - 1
+        if left:
+            self._user_inflight[ticket.user] = left
+        else:
+            self._user_inflight.pop(ticket.user, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Раздает освободившиеся слоты ожидающим в порядке WFQ-тегов, пропуская упершихся в свой лимит."""
+        skipped = []
+        while self._queue and self._inflight < self.max_inflight:
+            tag, seq, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            if not self._can_run(waiter.ticket.user, waiter.ticket.role):
+                skipped.append((tag, seq, waiter))
+                continue
+            self._queued -= 1
+            self._virtual_time = max(self._virtual_time, tag)
+            waiter.future.set_result(self._grant(waiter.ticket))
+        for item in skipped:
+            heapq.heappush(self._queue, item)
+        self._publish()
+
+    async def guard_stream(self, generator: AsyncIterator[Any], ticket: Ticket) -> AsyncIterator[Any]:
+        """Держит слот до конца SSE-стрима (или обрыва соединения клиентом)."""
+        try:
+            async for chunk in generator:
+                yield chunk
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self._inflight,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "rejected_rate": self.rejected_rate,
+            "rejected_queue": self.rejected_queue,
+        }
+
+
+def estimate_cost(messages: Any, max_tokens: Optional[int], default_max_tokens: int,
+                  prompt_tokens: Optional[int] = None) -> float:
+    """
+    Стоимость запроса в токенах: промпт + max_tokens. Промпт — подсчет токенизатором (TokenBudget),
+    если он уже сделан, иначе ~4 символа на токен.
+    """
+    if prompt_tokens is not None:
+        return prompt_tokens + (max_tokens or default_max_tokens)
+    chars = 0
+    for message in messages or []:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        if isinstance(content, list):
+            chars += sum(len(p.get("text", "")) for p in content if isinstance(p, dict))
+        elif content:
+            chars += len(content)
+    return math.ceil(chars / 4) + (max_tokens or default_max_tokens)
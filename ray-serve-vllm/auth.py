@@ -1,61 +1,39 @@
 import os
+import time
+import hmac
 import hashlib
+import threading
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 from fastapi import HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 
+from user_store import UserStore
+
 # JWT-настройки: берем из переменных окружения или используем значения по умолчанию.
 JWT_KEY = os.environ.get("JWT_KEY", "default_jwt_key")
 JWT_ALGORITHM = "HS256"
 SKIP_EXP_CHECK = os.environ.get("SKIP_EXP_CHECK", "false").lower() in ["true", "1", "yes"]
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.environ.get("REFRESH_TOKEN_EXPIRE_MINUTES", str(7 * 24 * 60)))
 
-def load_users() -> Dict[str, Dict[str, str]]:
-    """
-    Загружает пользователей из переменной окружения USER_LIST.
-    Для каждого псевдонима (ALICE, BOB и т.д.) ожидаются:
-        ALICE_USERNAME, ALICE_HASHED_PASSWORD, ALICE_ROLE
-    """
-    user_list_str = os.environ.get("USER_LIST", "")
-    users_db = {}
-    if user_list_str:
-        user_names = [u.strip().upper() for u in user_list_str.split(",") if u.strip()]
-        for user_upper in user_names:
-            username = os.environ.get(f"{user_upper}_USERNAME")
-            hashed_password = os.environ.get(f"{user_upper}_HASHED_PASSWORD")
-            role = os.environ.get(f"{user_upper}_ROLE")
-            if username and hashed_password and role:
-                users_db[username] = {
-                    "username": username,
-                    "hashed_password": hashed_password,
-                    "role": role
-                }
-    return users_db
-
-# При импорте модуля сразу загружаем пользователей
-USERS_DB = load_users()
-
-def hash_password(plain_password: str) -> str:
-    """
-    Хэшируем пароль, используя JWT_KEY как «соль».
-    (В реальном приложении лучше использовать соль индивидуальную для каждого пользователя)
-    """
-    to_hash = JWT_KEY + plain_password
-    return hashlib.sha256(to_hash.encode("utf-8")).hexdigest()
+# Кеш проверенных токенов: размер 0 отключает кеш полностью.
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", "4096"))
+JWT_CACHE_TTL_SECONDS = float(os.environ.get("JWT_CACHE_TTL_SECONDS", "300"))
+
+# Пользователи: индекс в памяти; при USER_STORE_PATH — из смонтированного секрета с фоновой перезагрузкой.
+# Без индивидуальной соли ({ALIAS}_SALT) солью остается JWT_KEY — совместимо с прежними хэшами.
+USER_STORE = UserStore.from_env(default_salt=JWT_KEY)
 
 def authenticate_user(username: str, plain_password: str) -> Optional[Dict[str, str]]:
     """
-    Проверяем, есть ли пользователь в USERS_DB и совпадает ли хэш.
+    Проверяем, есть ли пользователь в USER_STORE и совпадает ли хэш.
+    Синхронная функция: из обработчиков вызывать через run_in_threadpool.
     """
-    user = USERS_DB.get(username)
-    if not user:
-        return None
-    hashed_input = hash_password(plain_password)
-    if hashed_input == user["hashed_password"]:
-        return user
-    return None
+    user = USER_STORE.authenticate(username, plain_password)
+    return user.to_dict() if user else None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -66,20 +44,121 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_KEY, algorithm=JWT_ALGORITHM)
 
+def issue_tokens(user: Dict[str, str]) -> Dict[str, str]:
+    """
+    Пара токенов для /token и /token/refresh: access (sub, role) и refresh (только sub и версия пароля).
+    Роль в новый access-токен берется из хранилища на момент обновления.
+    """
+    expire = timedelta(minutes=int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "60")))
+    access_token = create_access_token({"sub": user["username"], "role": user["role"]}, expire)
+    record = USER_STORE.get(user["username"])
+    refresh_token = create_access_token(
+        {"sub": user["username"], "type": "refresh", "ver": record.credentials_version if record else ""},
+        timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES),
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+def refresh_tokens(refresh_token: str) -> Dict[str, str]:
+    """
+    Новая пара токенов по refresh-токену. Пользователь должен остаться в хранилище с тем же паролем:
+    удаление или смена пароля в секрете отзывает выданные refresh-токены после перезагрузки.
+    """
+    try:
+        payload = jwt.decode(refresh_token, JWT_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token has expired")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    if payload.get("type") != "refresh":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    record = USER_STORE.get(payload.get("sub", ""))
+    if record is None or not hmac.compare_digest(str(payload.get("ver", "")).encode("utf-8"),
+                                                 record.credentials_version.encode("utf-8")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token has been revoked")
+    return issue_tokens(record.to_dict())
+
+class TokenCache:
+    """
+    Ограниченный LRU-кеш уже проверенных JWT.
+    Ключ — SHA-256 от токена (сам токен в памяти не держим), запись живет до exp токена,
+    но не дольше ttl_seconds. Кешируются только успешно проверенные payload.
+    """
+    def __init__(self, maxsize: int = JWT_CACHE_SIZE, ttl_seconds: float = JWT_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                # Токен истек: удаляем запись и заставляем пройти полную проверку (она вернет 401)
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(payload)
+
+    def put(self, key: bytes, payload: dict) -> None:
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        exp = payload.get("exp")
+        if not SKIP_EXP_CHECK and isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# Общий кеш процесса (одна реплика — один кеш)
+TOKEN_CACHE = TokenCache()
+
 def verify_jwt_token(credentials: HTTPAuthorizationCredentials) -> dict:
     """
     Проверка заголовка Authorization: Bearer <TOKEN>.
+    Повторно предъявленный токен берется из TOKEN_CACHE без jwt.decode.
     """
     token = credentials.credentials
+    cache_key = TOKEN_CACHE.digest(token)
+    cached = TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
     try:
         options = {"verify_exp": not SKIP_EXP_CHECK}
         payload = jwt.decode(token, JWT_KEY, algorithms=[JWT_ALGORITHM], options=options)
         username = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("type") == "refresh":  # Refresh-токен не дает доступа к API
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Invalid token payload"
             )
+        TOKEN_CACHE.put(cache_key, payload)
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -107,3 +186,7 @@ def check_role(payload: dict, required_role: str = "admin"):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
@@ -0,0 +1,244 @@
+import os
+import json
+import math
+import argparse
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class AutoscalingSettings:
+    """Параметры load-aware автоскейлинга; значения по умолчанию подобраны по прогонам llmperf (пик throughput при 8 потоках)."""
+    min_replicas: int = 1
+    max_replicas: int = 4
+    target_running_per_replica: float = 8.0  # Сколько активных последовательностей держит реплика без роста ITL
+    max_waiting_per_replica: float = 2.0  # Допустимая очередь в планировщике vLLM
+    target_kv_usage: float = 0.8  # Целевая доля занятого KV-кеша
+    upscale_delay_s: float = 30.0
+    downscale_delay_s: float = 300.0
+    interval_s: float = 10.0  # Период решений LoadAutoscaler и отчетов реплик
+    report_ttl_s: float = 30.0  # Отчет реплики старше этого не учитываем (реплика остановлена или в дренаже)
+
+    @classmethod
+    def from_env(cls) -> "AutoscalingSettings":
+        return cls(
+            min_replicas=int(os.environ.get("AUTOSCALE_MIN_REPLICAS", cls.min_replicas)),
+            max_replicas=int(os.environ.get("AUTOSCALE_MAX_REPLICAS", cls.max_replicas)),
+            target_running_per_replica=float(os.environ.get("AUTOSCALE_TARGET_RUNNING", cls.target_running_per_replica)),
+            max_waiting_per_replica=float(os.environ.get("AUTOSCALE_MAX_WAITING", cls.max_waiting_per_replica)),
+            target_kv_usage=float(os.environ.get("AUTOSCALE_TARGET_KV_USAGE", cls.target_kv_usage)),
+            upscale_delay_s=float(os.environ.get("AUTOSCALE_UPSCALE_DELAY_S", cls.upscale_delay_s)),
+            downscale_delay_s=float(os.environ.get("AUTOSCALE_DOWNSCALE_DELAY_S", cls.downscale_delay_s)),
+            interval_s=float(os.environ.get("AUTOSCALE_INTERVAL_S", cls.interval_s)),
+            report_ttl_s=float(os.environ.get("AUTOSCALE_REPORT_TTL_S", cls.report_ttl_s)),
+        )
+
+
+@dataclass
+class LoadSignals:
+    """Сигналы нагрузки, суммированные по всем репликам (kv_cache_usage — среднее)."""
+    num_running: float
+    num_waiting: float
+    kv_cache_usage: float
+    generation_tokens_per_s: float = 0.0
+
+
+def desired_replicas(signals: LoadSignals, current: int, settings: AutoscalingSettings) -> int:
+    """
+    Сколько реплик нужно под текущую нагрузку, без учета задержек.
+    Давление = максимум из загрузки по активным последовательностям, очереди и KV-кешу;
+    нужное число реплик = ceil(current * давление), в пределах [min_replicas, max_replicas].
+    """
+    current = max(current, 1)
+    pressure = max(
+        signals.num_running / (settings.target_running_per_replica * current),
+        signals.kv_cache_usage / settings.target_kv_usage,
+    )
+    if settings.max_waiting_per_replica > 0:
+        pressure = max(pressure, signals.num_waiting / (settings.max_waiting_per_replica * current))
+    elif signals.num_waiting > 0:
+        pressure = max(pressure, 1.0 + 1.0 / current)  # Любая очередь — повод добавить реплику
+    desired = math.ceil(current * pressure - 1e-9)
+    return min(max(desired, settings.min_replicas), settings.max_replicas)
+
+
+def apply_delays(
+        desired: int,
+        current: int,
+        now: float,
+        state: Dict[str, Any],
+        settings: AutoscalingSettings,
+) -> int:
+    """
+    Гистерезис: рост применяется, если решение держится upscale_delay_s, снижение — downscale_delay_s.
+    state хранит начало текущей серии решений и переживает вызовы (в LoadAutoscaler — между тиками).
+    """
+    direction = (desired > current) - (desired < current)
+    if direction == 0:
+        state.pop("since", None)
+        state.pop("direction", None)
+        return current
+    if state.get("direction") != direction:
+        state["direction"] = direction
+        state["since"] = now
+    delay = settings.upscale_delay_s if direction > 0 else settings.downscale_delay_s
+    if now - state["since"] >= delay:
+        state.pop("since", None)
+        state.pop("direction", None)
+        return desired
+    return current
+
+
+# -------------------------
+# Интеграция с Ray Serve (load_autoscaler.LoadAutoscaler)
+# -------------------------
+def aggregate(snapshots: List[Dict[str, float]]) -> LoadSignals:
+    """Снимки EngineLoadStats реплик → суммарные сигналы (kv_cache_usage — среднее)."""
+    kv = [s.get("kv_cache_usage", 0.0) for s in snapshots]
+    return LoadSignals(
+        num_running=sum(s.get("num_running", 0.0) for s in snapshots),
+        num_waiting=sum(s.get("num_waiting", 0.0) for s in snapshots),
+        kv_cache_usage=sum(kv) / len(kv) if kv else 0.0,
+        generation_tokens_per_s=sum(s.get("generation_tokens_per_s", 0.0) for s in snapshots),
+    )
+
+
+def target_replicas(details: Dict[str, Any], app_name: str, deployment: str) -> Optional[int]:
+    """Текущее целевое число реплик деплоя из GET /api/serve/applications/."""
+    app = (details.get("applications") or {}).get(app_name) or {}
+    return ((app.get("deployments") or {}).get(deployment) or {}).get("target_num_replicas")
+
+
+def scaled_config(details: Dict[str, Any], app_name: str, deployment: str, num_replicas: int) -> Optional[Dict[str, Any]]:
+    """
+    Тело PUT /api/serve/applications/: конфиги всех приложений как есть, у деплоя — новый num_replicas.
+    Меняется только num_replicas, поэтому Serve добавляет/снимает реплики, не перезапуская остальные.
+    None — приложение развернуто не через REST-конфиг (serve run): менять нечего.
+    """
+    applications = []
+    found = False
+    for name, app in (details.get("applications") or {}).items():
+        config = app.get("deployed_app_config")
+        if config is None:
+            if name == app_name:
+                return None
+            continue
+        config = json.loads(json.dumps(config))  # Глубокая копия
+        if name == app_name:
+            found = True
+            deployments = config.setdefault("deployments", [])
+            entry = next((d for d in deployments if d.get("name") == deployment), None)
+            if entry is None:
+                entry = {"name": deployment}
+                deployments.append(entry)
+            entry.pop("autoscaling_config", None)  # Встроенный автоскейлинг Serve и этот контроллер не совмещаются
+            entry["num_replicas"] = num_replicas
+        applications.append(config)
+    return {"applications": applications} if found else None
+
+
+# -------------------------
+# Офлайн-реплей трасс llmperf_test_results
+# -------------------------
+def _load_trace(results_dir: Path) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    summary_path = next(results_dir.glob("*_summary.json"))
+    responses_path = next(results_dir.glob("*_individual_responses.json"))
+    summary = json.loads(summary_path.read_text())
+    # В correctness-прогонах метрики вложены в поле "metrics"
+    records = [r.get("metrics", r) for r in json.loads(responses_path.read_text())]
+    responses = [r for r in records if not r.get("error_code")]
+    return summary, responses
+
+
+def replay_trace(
+        results_dir: Path,
+        settings: AutoscalingSettings,
+        kv_capacity_tokens: int,
+        tick_s: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Восстанавливает временной ряд нагрузки одной реплики из трассы llmperf и прогоняет политику.
+    llmperf — замкнутая петля: num_concurrent_requests клиентов шлют запросы друг за другом,
+    поэтому старт запроса = конец предыдущего у того же клиента. Очередь — часть TTFT сверх
+    минимального TTFT прогона (чистый prefill); KV — входные + уже сгенерированные токены.
+    """
+    summary, responses = _load_trace(results_dir)
+    concurrency = int(summary["num_concurrent_requests"])
+    min_ttft = min(r["ttft_s"] for r in responses)
+
+    clients = [0.0] * concurrency
+    spans = []
+    for i, r in enumerate(responses):
+        start = clients[i % concurrency]
+        queued_until = start + max(r["ttft_s"] - min_ttft, 0.0)
+        first_token = start + r["ttft_s"]
+        end = start + r["end_to_end_latency_s"]
+        clients[i % concurrency] = end
+        spans.append((start, queued_until, first_token, end, r))
+
+    horizon = max(s[3] for s in spans)
+    state: Dict[str, Any] = {}
+    replicas = settings.min_replicas
+    timeline = []
+    t = 0.0
+    while t <= horizon:
+        waiting = running = 0
+        kv_tokens = 0.0
+        gen_rate = 0.0
+        for start, queued_until, first_token, end, r in spans:
+            if start <= t < queued_until:
+                waiting += 1
+            elif queued_until <= t < end:
+                running += 1
+                generated = 0.0
+                if t >= first_token and end > first_token:
+                    generated = r["number_output_tokens"] * (t - first_token) / (end - first_token)
+                    gen_rate += r["number_output_tokens"] / (end - first_token)
+                kv_tokens += r["number_input_tokens"] + generated
+        signals = LoadSignals(
+            num_running=running,
+            num_waiting=waiting,
+            kv_cache_usage=min(kv_tokens / kv_capacity_tokens, 1.0),
+            generation_tokens_per_s=gen_rate,
+        )
+        desired = desired_replicas(signals, replicas, settings)
+        replicas = apply_delays(desired, replicas, t, state, settings)
+        timeline.append({"t": t, "replicas": replicas, "desired": desired, **asdict(signals)})
+        t += tick_s
+
+    return {
+        "results_dir": str(results_dir),
+        "concurrency": concurrency,
+        "duration_s": horizon,
+        "max_desired": max(p["desired"] for p in timeline),
+        "final_replicas": replicas,
+        "mean_running": sum(p["num_running"] for p in timeline) / len(timeline),
+        "mean_waiting": sum(p["num_waiting"] for p in timeline) / len(timeline),
+        "peak_kv_cache_usage": max(p["kv_cache_usage"] for p in timeline),
+        "timeline": timeline,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay llmperf traces through the load-aware autoscaling policy")
+    parser.add_argument("results_dirs", nargs="+", type=Path, help="Каталоги llmperf_test_results/*")
+    parser.add_argument("--kv-capacity-tokens", type=int, default=int(os.environ.get("KV_CAPACITY_TOKENS", "65536")),
+                        help="Объем KV-кеша реплики в токенах (см. 'GPU KV cache size' в логе vLLM)")
+    parser.add_argument("--tick", type=float, default=1.0)
+    parser.add_argument("--timeline", action="store_true", help="Печатать временной ряд решений")
+    args = parser.parse_args()
+
+    settings = AutoscalingSettings.from_env()
+    for results_dir in args.results_dirs:
+        res = replay_trace(results_dir, settings, args.kv_capacity_tokens, args.tick)
+        print(
+            f"{results_dir.name:>24}: concurrency={res['concurrency']:<3} duration={res['duration_s']:.0f}s "
+            f"running={res['mean_running']:.1f} waiting={res['mean_waiting']:.1f} "
+            f"kv_peak={res['peak_kv_cache_usage']:.0%} desired_max={res['max_desired']} final={res['final_replicas']}"
+        )
+        if args.timeline:
+            for point in res["timeline"]:
+                print(f"  t={point['t']:>6.0f} running={point['num_running']:>3.0f} "
+                      f"waiting={point['num_waiting']:>3.0f} kv={point['kv_cache_usage']:.0%} "
+                      f"desired={point['desired']} replicas={point['replicas']}")
@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("ray.serve")
+
+# handler(body, owner) -> (status_code, тело JSON, заголовки); тело — ответ chat.completion или ошибка
+BatchHandler = Callable[[Dict[str, Any], str], Awaitable[Tuple[int, bytes, Dict[str, str]]]]
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class BatchInputError(ValueError):
+    """Невалидный JSONL при загрузке (HTTP 400)."""
+
+
+@dataclass
+class BatchJob:
+    id: str
+    owner: str
+    created_at: int
+    total: int
+    status: str = "in_progress"  # in_progress | completed | failed | cancelling | cancelled
+    completed: int = 0
+    failed: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    running_s: float = 0.0  # Время обработки, суммарно по всем запускам (с учетом рестартов реплики)
+    finished_at: Optional[int] = None
+    error: Optional[str] = None
+    _session_started: Optional[float] = field(default=None, repr=False)
+
+    def elapsed_s(self) -> float:
+        session = time.monotonic() - self._session_started if self._session_started is not None else 0.0
+        return self.running_s + session
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Объект в духе OpenAI Batch API плюс пропускная способность."""
+        elapsed = self.elapsed_s()
+        return {
+            "id": self.id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "request_counts": {"total": self.total, "completed": self.completed, "failed": self.failed},
+            "usage": {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens},
+            "elapsed_s": round(elapsed, 3),
+            "output_tokens_per_s": round(self.completion_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+            "total_tokens_per_s": round((self.prompt_tokens + self.completion_tokens) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    def to_meta(self) -> Dict[str, Any]:
+        meta = asdict(self)
+        meta.pop("_session_started")
+        meta["running_s"] = self.elapsed_s()
+        return meta
+
+
+def parse_batch_input(data: bytes) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    JSONL в формате OpenAI Batch ({"custom_id", "method", "url", "body"}) или просто
+    ChatCompletionRequest на строку (тогда custom_id = line-<номер>). custom_id должны быть уникальны.
+    """
+    items: List[Tuple[str, Dict[str, Any]]] = []
+    seen: Set[str] = set()
+    for lineno, line in enumerate(data.decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BatchInputError(f"line {lineno}: invalid JSON: {e}") from e
+        body = record.get("body", record) if isinstance(record, dict) else None
+        if not isinstance(body, dict) or not isinstance(body.get("messages"), list):
+            raise BatchInputError(f"line {lineno}: expected a chat completion request with 'messages'")
+        custom_id = str(record.get("custom_id") or f"line-{lineno}")
+        if custom_id in seen:
+            raise BatchInputError(f"line {lineno}: duplicate custom_id {custom_id!r}")
+        seen.add(custom_id)
+        items.append((custom_id, body))
+    if not items:
+        raise BatchInputError("batch input is empty")
+    return items
+
+
+class BatchManager:
+    """
+    Пакетная обработка JSONL внутри реплики. Каталог задания в BATCH_DIR:
+        input.jsonl  — нормализованный вход ({"custom_id", "body"} на строку);
+        output.jsonl — результаты по мере готовности (порядок завершения, не входа);
+        meta.json    — статус и счетчики (пишется атомарно, не чаще раза в BATCH_META_INTERVAL_S);
+        lock         — flock на время обработки: после падения реплики блокировка снимается ядром,
+                       и задание подхватывает любая реплика (при старте или в фоновом обходе).
+    При возобновлении custom_id, уже записанные в output.jsonl, пропускаются.
+    Одновременно в движке не больше max_inflight запросов всех заданий реплики.
+    """
+
+    def __init__(self, root: str, handler: BatchHandler, max_inflight: int, meta_interval_s: float = 1.0):
+        self.root = root
+        self.handler = handler
+        self.max_inflight = max_inflight
+        self.meta_interval_s = meta_interval_s
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._jobs: Dict[str, BatchJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self.stopped = False  # Реплика дренируется: новые задания не берем
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, handler: BatchHandler, default_max_inflight: int) -> "BatchManager":
+        return cls(
+            root=os.environ.get("BATCH_DIR", os.path.expanduser("~/batches")),
+            handler=handler,
+            max_inflight=int(os.environ.get("BATCH_MAX_INFLIGHT", default_max_inflight)),
+            meta_interval_s=float(os.environ.get("BATCH_META_INTERVAL_S", "1")),
+        )
+
+    # -------------------------
+    # Файлы задания
+    # -------------------------
+    def _path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.root, job_id, name)
+
+    def _write_meta(self, job: BatchJob) -> None:
+        tmp = self._path(job.id, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(job.to_meta(), f)
+        os.replace(tmp, self._path(job.id, "meta.json"))
+
+    def _read_meta(self, job_id: str) -> Optional[BatchJob]:
+        try:
+            with open(self._path(job_id, "meta.json")) as f:
+                return BatchJob(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _load_output(self, job: BatchJob) -> Set[str]:
+        """
+        custom_id из output.jsonl; счетчики задания пересчитываются по файлу (meta.json мог отстать).
+        Недописанный хвост (обрыв при падении) отрезаем.
+        """
+        path = self._path(job.id, "output.jsonl")
+        job.completed = job.failed = job.prompt_tokens = job.completion_tokens = 0
+        if not os.path.exists(path):
+            return set()
+        done: Set[str] = set()
+        good = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    done.add(record["custom_id"])
+                except (ValueError, KeyError):
+                    break
+                good += len(line)
+                if record.get("error") is None:
+                    usage = record["response"]["body"].get("usage") or {}
+                    job.completed += 1
+                    job.prompt_tokens += usage.get("prompt_tokens", 0)
+                    job.completion_tokens += usage.get("completion_tokens", 0)
+                else:
+                    job.failed += 1
+        os.truncate(path, good)
+        return done
+
+    # -------------------------
+    # API
+    # -------------------------
+    def create(self, data: bytes, owner: str) -> BatchJob:
+        items = parse_batch_input(data)
+        job = BatchJob(id=f"batch_{uuid.uuid4().hex}", owner=owner, created_at=int(time.time()), total=len(items))
+        os.makedirs(os.path.join(self.root, job.id))
+        with open(self._path(job.id, "input.jsonl"), "w") as f:
+            for custom_id, body in items:
+                f.write(json.dumps({"custom_id": custom_id, "body": body}, ensure_ascii=False) + "\n")
+        self._write_meta(job)
+        self._jobs[job.id] = job
+        if not self.stopped:  # При дренаже задание подхватит другая реплика из общего BATCH_DIR
+            self._start(job)
+        logger.info(f"[batch] created {job.id}: {job.total} requests by {owner}")
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """Задание этой реплики или (на общем томе) — чужое, по meta.json."""
+        if job_id in self._jobs:
+            return self._jobs[job_id]
+        if "/" in job_id or job_id.startswith("."):
+            return None
+        return self._read_meta(job_id)
+
+    def list_jobs(self, owner: Optional[str] = None) -> List[BatchJob]:
+        jobs = [self.get(name) for name in sorted(os.listdir(self.root))]
+        return [j for j in jobs if j is not None and (owner is None or j.owner == owner)]
+
+    def output_path(self, job_id: str) -> Optional[str]:
+        path = self._path(job_id, "output.jsonl")
+        return path if self.get(job_id) is not None and os.path.exists(path) else None
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self.get(job_id)
+        if job is None or job.status in TERMINAL_STATUSES:
+            return job
+        job.status = "cancelling"  # Запросы в полете дорабатывают, новые не отправляются
+        if job_id not in self._running:  # Задание ведет другая реплика — она прочтет статус из meta.json
+            self._write_meta(job)
+        return job
+
+    def resume(self) -> None:
+        """Подхватывает незавершенные задания (после рестарта реплики)."""
+        if self.stopped:
+            return
+        for name in sorted(os.listdir(self.root)):
+            if name in self._running:
+                continue
+            job = self._read_meta(name)
+            if job is not None and job.status not in TERMINAL_STATUSES:
+                self._jobs[job.id] = job
+                self._start(job)
+
+    def stop(self) -> None:
+        """Дренаж реплики: прерывает свои задания; их подхватит другая реплика (или эта после рестарта)."""
+        self.stopped = True
+        for task in list(self._running.values()):
+            task.cancel()
+
+    async def watch(self, interval_s: float) -> None:
+        """Фоновый обход: задания упавших реплик подхватываются без ожидания рестарта."""
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                self.resume()
+            except OSError as e:
+                logger.warning(f"[batch] resume scan failed: {e}")
+
+    # -------------------------
+    # Обработка
+    # -------------------------
+    def _start(self, job: BatchJob) -> None:
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._running[job.id] = task
+        task.add_done_callback(lambda _: self._running.pop(job.id, None))
+
+    async def _run(self, job: BatchJob) -> None:
+        lock = open(self._path(job.id, "lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()  # Задание уже обрабатывает другая реплика
+            self._jobs.pop(job.id, None)
+            return
+        try:
+            fresh = self._read_meta(job.id)  # Статус мог смениться (например, отмена с другой реплики)
+            if fresh is not None and fresh.status in TERMINAL_STATUSES:
+                return
+            if fresh is not None and fresh.status == "cancelling":
+                job.status = "cancelling"
+            done = self._load_output(job)
+            job._session_started = time.monotonic()
+            await self._process(job, done)
+            job.status = "cancelled" if job.status == "cancelling" else "completed"
+        except Exception as e:
+            logger.error(f"[batch] {job.id} failed: {e}", exc_info=True)
+            job.status, job.error = "failed", str(e)
+        finally:
+            if job.status in TERMINAL_STATUSES:
+                job.finished_at = int(time.time())
+            job.running_s = job.elapsed_s()
+            job._session_started = None
+            self._write_meta(job)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+            if job.status in TERMINAL_STATUSES:
+                logger.info(f"[batch] {job.id} {job.status}: {job.to_dict()}")
+
+    async def _process(self, job: BatchJob, done: Set[str]) -> None:
+        pending: Set[asyncio.Task] = set()
+        last_meta = time.monotonic()
+        with open(self._path(job.id, "input.jsonl")) as source, \
+                open(self._path(job.id, "output.jsonl"), "ab") as sink:
+
+            def write(custom_id: str, status_code: int, body: bytes) -> None:
+                nonlocal last_meta
+                ok = status_code == 200
+                line = (
+                    b'{"id":"batch_req_' + uuid.uuid4().hex.encode() + b'","custom_id":'
+                    + json.dumps(custom_id).encode() + b',"response":{"status_code":'
+                    + str(status_code).encode() + b',"body":' + body + b'},"error":'
+                    + (b"null" if ok else json.dumps({"code": status_code}).encode()) + b"}\n"
+                )  # Тело ответа вставляем готовыми байтами, без повторной сериализации
+                sink.write(line)
+                sink.flush()
+                if ok:
+                    job.completed += 1
+                    usage = json.loads(body).get("usage") or {}
+                    job.prompt_tokens += usage.get("prompt_tokens", 0)
+                    job.completion_tokens += usage.get("completion_tokens", 0)
+                else:
+                    job.failed += 1
+                if time.monotonic() - last_meta >= self.meta_interval_s:
+                    last_meta = time.monotonic()
+                    fresh = self._read_meta(job.id)
+                    if fresh is not None and fresh.status == "cancelling":
+                        job.status = "cancelling"  # Отмена пришла через другую реплику
+                    self._write_meta(job)
+
+            async def one(custom_id: str, body: Dict[str, Any]) -> None:
+                try:
+                    status_code, content = await self._call(body, job.owner)
+                except Exception as e:
+                    status_code, content = 500, json.dumps({"error": str(e)}).encode()
+                finally:
+                    self._slots.release()
+                write(custom_id, status_code, content)
+
+            try:
+                for line in source:
+                    record = json.loads(line)
+                    if record["custom_id"] in done:
+                        continue
+                    await self._slots.acquire()
+                    if job.status == "cancelling":
+                        self._slots.release()
+                        break
+                    task = asyncio.get_running_loop().create_task(one(record["custom_id"], record["body"]))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                if pending:
+                    await asyncio.gather(*pending)
+            except BaseException:
+                # Остановка реплики: недописанные запросы уйдут при возобновлении
+                for task in pending:
+                    task.cancel()
+                raise
+
+    async def _call(self, body: Dict[str, Any], owner: str) -> Tuple[int, bytes]:
+        """Запрос через handler; на 429 от допуска ждем Retry-After и повторяем."""
+        while True:
+            status_code, content, headers = await self.handler(body, owner)
+            if status_code != 429:
+                return status_code, content
+            await asyncio.sleep(float(headers.get("retry-after", "1")))
@@ -0,0 +1,261 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+logger = logging.getLogger("ray.serve")
+
+BUDGET_REQUESTS = Counter(
+    "vllm_token_budget_requests_total",
+    "Pre-admission token budget results (ok/clamped/truncated/rejected/skipped)",
+    ["result"],
+)
+BUDGET_DROPPED_MESSAGES = Counter("vllm_token_budget_dropped_messages_total", "Messages dropped by prompt truncation")
+TOKEN_COUNT_CACHE = Counter("vllm_token_count_cache_total", "Token count cache lookups by result", ["result"])
+
+STRATEGIES = ("off", "reject", "drop_oldest", "keep_system_last_n")
+
+
+@dataclass
+class BudgetDecision:
+    """Итог проверки: если error задан — запрос отклоняется (400), иначе messages/max_tokens уже применены."""
+    result: str  # ok / clamped / truncated / rejected / skipped
+    prompt_tokens: Optional[int] = None  # Оценка промпта после усечения
+    dropped_messages: int = 0
+    error: Optional[str] = None
+
+
+class TokenCountCache:
+    """LRU: sha256 текста сообщения → число токенов. Повторные system prompt и история диалога не токенизируются заново."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def get(self, key: bytes) -> Optional[int]:
+        count = self._entries.get(key)
+        if count is not None:
+            self._entries.move_to_end(key)
+        TOKEN_COUNT_CACHE.labels("hit" if count is not None else "miss").inc()
+        return count
+
+    def put(self, key: bytes, count: int) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = count
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+def _message_text(message: Any) -> Optional[str]:
+    """Текст сообщения для подсчета; None — есть не-текстовые части (изображения и т.п.), бюджет не считаем."""
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    if content is None or isinstance(content, str):
+        text = content or ""
+    elif isinstance(content, list):
+        parts = []
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "text":
+                return None
+            parts.append(part.get("text", ""))
+        text = "\n".join(parts)
+    else:
+        return None
+    tool_calls = message.get("tool_calls") if isinstance(message, dict) else None
+    if tool_calls:
+        text += repr(tool_calls)  # Грубо, но в большую сторону: аргументы вызовов тоже попадают в промпт
+    return text
+
+
+def _tools_text(tools: List[Any]) -> str:
+    """JSON-схемы tools: шаблон чата вставляет их в промпт целиком."""
+    return json.dumps([t.model_dump(exclude_none=True) if hasattr(t, "model_dump") else t for t in tools],
+                      ensure_ascii=False, sort_keys=True)
+
+
+def _role(message: Any) -> Optional[str]:
+    return message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+
+
+class TokenBudget:
+    """
+    Проверка промпта и max_tokens против max-model-len до допуска в движок.
+
+    Промпт оценивается суммой токенов сообщений и JSON tools (токенизатор движка, счетчики в LRU) плюс
+    tokens_per_message на разметку шаблона чата. Дальше:
+      - max_tokens, не помещающийся в остаток контекста за вычетом safety_tokens, урезается (clamp) до этого остатка,
+        если он не меньше min_completion;
+      - иначе промпт усекается по стратегии: drop_oldest — выбрасываем самые старые ходы (ход — от user-сообщения
+        до следующего), keep_system_last_n — оставляем system и последние keep_last_n сообщений (по границе хода),
+        затем при необходимости тоже выбрасываем старые ходы; последний ход не трогаем никогда;
+      - не помещается и после этого (или strategy=reject) — 400 до токенизации в движке.
+    Оценка разметки приблизительна; усечение и clamp целятся ниже лимита на safety_tokens, а точную границу
+    по-прежнему проверяет движок.
+    """
+
+    def __init__(self, strategy: str = "reject", keep_last_n: int = 8, clamp_max_tokens: bool = True,
+                 min_completion: int = 16, tokens_per_message: int = 4, safety_tokens: int = 32,
+                 cache_size: int = 4096, thread_min_chars: int = 8192):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"TOKEN_BUDGET_STRATEGY must be one of {STRATEGIES}, got {strategy!r}")
+        self.strategy = strategy
+        self.keep_last_n = keep_last_n
+        self.clamp_max_tokens = clamp_max_tokens
+        self.min_completion = min_completion
+        self.tokens_per_message = tokens_per_message
+        self.safety_tokens = safety_tokens
+        self.thread_min_chars = thread_min_chars  # Длинные тексты токенизируем в пуле потоков, не в event loop
+        self.cache = TokenCountCache(cache_size)
+        self.tokenizer: Any = None
+        self.max_model_len: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        return cls(
+            strategy=os.environ.get("TOKEN_BUDGET_STRATEGY", "reject"),
+            keep_last_n=int(os.environ.get("TOKEN_BUDGET_KEEP_LAST_N", "8")),
+            clamp_max_tokens=os.environ.get("TOKEN_BUDGET_CLAMP_MAX_TOKENS", "true").lower() in ("1", "true", "yes"),
+            min_completion=int(os.environ.get("TOKEN_BUDGET_MIN_COMPLETION_TOKENS", "16")),
+            tokens_per_message=int(os.environ.get("TOKEN_BUDGET_TOKENS_PER_MESSAGE", "4")),
+            safety_tokens=int(os.environ.get("TOKEN_BUDGET_SAFETY_TOKENS", "32")),
+            cache_size=int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", "4096")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.strategy != "off" and self.tokenizer is not None and bool(self.max_model_len)
+
+    def bind(self, tokenizer: Any, max_model_len: int) -> None:
+        """Токенизатор движка (engine.get_tokenizer) и лимит контекста из get_model_config()."""
+        self.tokenizer = tokenizer
+        self.max_model_len = max_model_len
+
+    # -------------------------
+    # Подсчет токенов
+    # -------------------------
+    def _encode_len(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    async def _count(self, items: List[Tuple[bytes, str]]) -> List[int]:
+        """Токены текстов по ключам LRU; промахи токенизируем одним проходом."""
+        counts = [self.cache.get(key) for key, _ in items]
+        misses = {key: text for (key, text), count in zip(items, counts) if count is None}
+        if misses:
+            if sum(len(t) for t in misses.values()) >= self.thread_min_chars:
+                fresh = await asyncio.to_thread(lambda: {k: self._encode_len(t) for k, t in misses.items()})
+            else:
+                fresh = {k: self._encode_len(t) for k, t in misses.items()}
+            for key, count in fresh.items():
+                self.cache.put(key, count)
+            counts = [c if c is not None else fresh[key] for c, (key, _) in zip(counts, items)]
+        return counts
+
+    async def count_messages(self, messages: List[Any]) -> Optional[List[int]]:
+        """Токены каждого сообщения (с разметкой); None — сообщения с не-текстовыми частями."""
+        items = []
+        for message in messages:
+            text = _message_text(message)
+            if text is None:
+                return None
+            items.append((hashlib.sha256(f"{_role(message)}\x00{text}".encode("utf-8")).digest(), text))
+        return [c + self.tokens_per_message for c in await self._count(items)]
+
+    async def count_tools(self, tools: Optional[List[Any]]) -> int:
+        """Токены JSON-описаний tools; одинаковый набор у повторных запросов берется из LRU."""
+        if not tools:
+            return 0
+        text = _tools_text(tools)
+        return (await self._count([(hashlib.sha256(f"tools\x00{text}".encode("utf-8")).digest(), text)]))[0]
+
+    # -------------------------
+    # Усечение
+    # -------------------------
+    @staticmethod
+    def _turns(messages: List[Any]) -> List[List[int]]:
+        """Ходы из не-system сообщений: ход начинается с user-сообщения, ответы и tool-сообщения идут с ним."""
+        turns: List[List[int]] = []
+        for i, message in enumerate(messages):
+            if _role(message) in ("system", "developer"):
+                continue
+            if _role(message) == "user" or not turns:
+                turns.append([i])
+            else:
+                turns[-1].append(i)
+        return turns
+
+    def _truncate(self, messages: List[Any], counts: List[int], target: int) -> List[int]:
+        """Индексы сохраняемых сообщений: промпт не больше target, если это достижимо без последнего хода."""
+        turns = self._turns(messages)
+        keep = set(range(len(messages)))
+        total = sum(counts)
+        if self.strategy == "keep_system_last_n":
+            tail = len(messages) - self.keep_last_n
+            while len(turns) > 1 and turns[0][-1] < tail:  # Ходы целиком до последних keep_last_n сообщений
+                for i in turns.pop(0):
+                    keep.discard(i)
+                    total -= counts[i]
+        while total > target and len(turns) > 1:
+            for i in turns.pop(0):
+                keep.discard(i)
+                total -= counts[i]
+        return sorted(keep)
+
+    # -------------------------
+    # Проверка запроса
+    # -------------------------
+    async def apply(self, request: Any) -> BudgetDecision:
+        """Проверяет ChatCompletionRequest и при необходимости усекает messages / урезает max_tokens на месте."""
+        if not self.enabled:
+            return BudgetDecision("skipped")
+        messages = list(request.messages or [])
+        counts = await self.count_messages(messages)
+        if counts is None:
+            BUDGET_REQUESTS.labels("skipped").inc()
+            return BudgetDecision("skipped")
+        tools = await self.count_tools(getattr(request, "tools", None))  # Не усекаются: входят в промпт целиком
+        limit = self.max_model_len
+        requested = request.max_completion_tokens or request.max_tokens
+        want = requested or self.min_completion  # Без max_tokens vLLM отдает весь остаток контекста
+        prompt = sum(counts) + tools
+        decision = BudgetDecision("ok", prompt_tokens=prompt)
+
+        def room() -> int:  # Остаток контекста под ответ с запасом на неточность оценки
+            return limit - prompt - self.safety_tokens
+
+        if prompt + want > limit and not (self.clamp_max_tokens and requested and room() >= self.min_completion):
+            if self.strategy in ("drop_oldest", "keep_system_last_n"):
+                need = self.min_completion if self.clamp_max_tokens else want
+                kept = self._truncate(messages, counts, limit - need - self.safety_tokens - tools)
+                if len(kept) < len(messages):
+                    decision.dropped_messages = len(messages) - len(kept)
+                    request.messages = [messages[i] for i in kept]
+                    prompt = sum(counts[i] for i in kept) + tools
+                    decision.result, decision.prompt_tokens = "truncated", prompt
+                    BUDGET_DROPPED_MESSAGES.inc(decision.dropped_messages)
+                    logger.info(f"[budget] {self.strategy}: dropped {decision.dropped_messages} messages, "
+                                f"prompt ~{prompt} tokens of {limit}")
+
+        if requested and requested > room() and self.clamp_max_tokens and room() >= self.min_completion:
+            clamped = room()
+            if request.max_completion_tokens:
+                request.max_completion_tokens = clamped
+            if request.max_tokens:
+                request.max_tokens = clamped
+            if decision.result == "ok":
+                decision.result = "clamped"
+        elif prompt + want > limit:
+            decision.result = "rejected"
+            decision.error = (
+                f"This model's maximum context length is {limit} tokens. However, you requested about "
+                f"{prompt + want} tokens ({prompt} in the messages, {want} in the completion). "
+                f"Please reduce the length of the messages or completion."
+            )
+        BUDGET_REQUESTS.labels(decision.result).inc()
+        return decision
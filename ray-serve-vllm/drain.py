@@ -0,0 +1,194 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger("ray.serve")
+
+ACTIVE_REQUESTS = Gauge("vllm_drain_active_requests", "In-flight generations tracked by the replica")
+DRAIN_REJECTED = Counter("vllm_drain_rejected_requests_total", "Requests rejected because the replica is draining")
+DRAIN_ABORTED = Counter("vllm_drain_aborted_requests_total", "Requests aborted when the drain deadline expired")
+
+# Заголовок ответа 503 от реплики в режиме дренажа: PrefixRouter повторяет такой запрос на другой реплике
+DRAIN_HEADER = "X-Drain"
+
+
+@dataclass
+class ActiveRequest:
+    request_id: str  # id запроса в движке (chatcmpl-...) — по нему abort
+    stream: bool
+    started: float = field(default_factory=time.monotonic)
+    streamed: bool = False  # Клиенту ушел хотя бы один чанк — повторить запрос прозрачно уже нельзя
+
+
+class DrainController:
+    """
+    Дренаж реплики перед остановкой: флаг готовности, учет генераций в работе и срок дренажа.
+
+    begin() снимает готовность: новые запросы получают 503 с X-Drain (PrefixRouter повторяет их на другой
+    реплике, прямой клиент — по Retry-After), а начатые дорабатывают. check_health при дренаже не падает:
+    нездоровую реплику Serve перезапускает сразу, и начатые стримы оборвались бы. Через deadline_s после begin() оставшиеся снимаются с движка (abort),
+    после чего ждем еще abort_grace_s, пока их ответы закроются.
+    Триггеры: SIGTERM (если обработчик удалось поставить), файл DRAIN_TRIGGER_FILE (preStop-хук пода)
+    и __del__ деплоя (Serve уже дождался запросов в работе в пределах graceful_shutdown_timeout_s).
+    """
+
+    def __init__(self, abort: Callable[[List[str]], Awaitable[Any]], deadline_s: float = 300.0,
+                 abort_grace_s: float = 5.0, trigger_file: Optional[str] = None):
+        self.abort = abort
+        self.deadline_s = deadline_s
+        self.abort_grace_s = abort_grace_s
+        self.trigger_file = trigger_file
+        self.draining = False
+        self.drain_started: Optional[float] = None
+        self.active: Dict[str, ActiveRequest] = {}
+        self.rejected = 0
+        self.aborted: Dict[str, float] = {}  # request_id → момент abort (для ответа 503 вместо обрезанного)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._drain_task: Optional[asyncio.Task] = None
+        self._on_begin: List[Callable[[], None]] = []
+
+    @classmethod
+    def from_env(cls, abort: Callable[[List[str]], Awaitable[Any]]) -> "DrainController":
+        return cls(
+            abort,
+            deadline_s=float(os.environ.get("DRAIN_DEADLINE_S", "300")),
+            abort_grace_s=float(os.environ.get("DRAIN_ABORT_GRACE_S", "5")),
+            trigger_file=os.environ.get("DRAIN_TRIGGER_FILE") or None,
+        )
+
+    @property
+    def ready(self) -> bool:
+        return not self.draining
+
+    def on_begin(self, callback: Callable[[], None]) -> None:
+        """Действие при начале дренажа (например, остановить пакетные задания)."""
+        self._on_begin.append(callback)
+
+    # -------------------------
+    # Учет запросов
+    # -------------------------
+    def track(self, request_id: str, stream: bool) -> None:
+        self.active[request_id] = ActiveRequest(request_id, stream)
+        self._idle.clear()
+        ACTIVE_REQUESTS.set(len(self.active))
+
+    def finish(self, request_id: str) -> None:
+        self.active.pop(request_id, None)
+        ACTIVE_REQUESTS.set(len(self.active))
+        if not self.active:
+            self._idle.set()
+
+    def reject(self) -> None:
+        """Учет запроса, отклоненного из-за дренажа."""
+        self.rejected += 1
+        DRAIN_REJECTED.inc()
+
+    def was_aborted(self, request_id: str) -> bool:
+        return request_id in self.aborted
+
+    async def guard_stream(self, generator: AsyncIterator[Any], request_id: str) -> AsyncIterator[Any]:
+        """Запрос считается активным до конца SSE-стрима; отмечает первый отправленный чанк."""
+        entry = self.active.get(request_id)
+        try:
+            async for chunk in generator:
+                if entry is not None:
+                    entry.streamed = True
+                yield chunk
+        finally:
+            self.finish(request_id)
+
+    # -------------------------
+    # Дренаж
+    # -------------------------
+    def begin(self, reason: str) -> asyncio.Task:
+        """Снимает готовность и запускает отсчет срока; повторные вызовы возвращают ту же задачу."""
+        if self._drain_task is None:
+            self.draining = True
+            self.drain_started = time.monotonic()
+            logger.warning(f"[drain] draining replica ({reason}): {len(self.active)} requests in flight, "
+                           f"deadline {self.deadline_s:.0f}s")
+            for callback in self._on_begin:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning(f"[drain] on_begin callback failed: {e}")
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+        return self._drain_task
+
+    async def wait(self, reason: str) -> Dict[str, Any]:
+        return await asyncio.shield(self.begin(reason))
+
+    async def _drain(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.deadline_s)
+        except asyncio.TimeoutError:
+            ids = list(self.active)
+            now = time.monotonic()
+            for request_id in ids:
+                self.aborted[request_id] = now
+            DRAIN_ABORTED.inc(len(ids))
+            logger.warning(f"[drain] deadline {self.deadline_s:.0f}s expired, aborting {len(ids)} requests")
+            try:
+                await self.abort(ids)
+            except Exception as e:
+                logger.error(f"[drain] abort failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=self.abort_grace_s)
+            except asyncio.TimeoutError:
+                logger.warning(f"[drain] {len(self.active)} requests still open after abort")
+        summary = {"waited_s": round(time.monotonic() - started, 3), "aborted": len(self.aborted),
+                   "still_active": len(self.active)}
+        logger.info(f"[drain] finished: {summary}")
+        return summary
+
+    async def watch_trigger(self, interval_s: float = 1.0) -> None:
+        """Ждет появления DRAIN_TRIGGER_FILE (preStop: touch файла) и начинает дренаж."""
+        if not self.trigger_file:
+            return
+        while not self.draining:
+            if os.path.exists(self.trigger_file):
+                self.begin(f"trigger file {self.trigger_file}")
+                return
+            await asyncio.sleep(interval_s)
+
+    def install_signal_handler(self) -> bool:
+        """
+        SIGTERM → дренаж, по его окончании — прежний обработчик. Ставится только из главного потока
+        процесса; у актора Ray event loop обычно в отдельном потоке — тогда остаются файл-триггер и __del__.
+        """
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        async def drain_then_exit() -> None:
+            await self.wait("SIGTERM")
+            loop.remove_signal_handler(signal.SIGTERM)
+            signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)  # Дальше — штатное завершение процесса
+
+        try:
+            loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(drain_then_exit()))
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            logger.info(f"[drain] SIGTERM handler not installed ({e}); relying on trigger file and __del__")
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "ready": self.ready,
+            "draining_for_s": round(now - self.drain_started, 3) if self.drain_started else None,
+            "deadline_s": self.deadline_s,
+            "active": len(self.active),
+            "active_streamed": sum(1 for r in self.active.values() if r.streamed),
+            "oldest_active_s": round(now - min((r.started for r in self.active.values()), default=now), 3),
+            "rejected": self.rejected,
+            "aborted": len(self.aborted),
+        }
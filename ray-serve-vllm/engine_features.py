@@ -0,0 +1,148 @@
+import os
+import json
+import secrets
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+
+# Заголовок запроса: "off" — не переиспользовать KV-кеш других запросов (уникальный cache_salt)
+PREFIX_CACHE_HEADER = "X-Prefix-Cache"
+
+PREFIX_CACHING_HASH_ALGOS = ("builtin", "sha256", "sha256_cbor_64bit")
+# draft — отдельная малая модель; eagle/eagle3 — draft-голова, обученная под целевую модель
+SPECULATIVE_METHODS = ("ngram", "eagle", "eagle3", "draft")
+
+
+def _bool_env(env: Mapping[str, str], name: str) -> Optional[bool]:
+    value = env.get(name)
+    if value is None or not value.strip():
+        return None  # Не задано — решает vLLM
+    return value.strip().lower() in ("1", "true", "yes", "y", "on")
+
+
+@dataclass
+class PrefixCachingConfig:
+    """
+    Prefix caching V1: блоки KV с общим префиксом (system prompt, история диалога) переиспользуются
+    между запросами, prefill идет только по новому хвосту. В V1 включено по умолчанию, поэтому
+    enabled=None не передает флаг вовсе, False — явный --no-enable-prefix-caching.
+    """
+    enabled: Optional[bool] = None
+    hash_algo: Optional[str] = None  # builtin (быстрее) / sha256 (без коллизий между арендаторами)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "PrefixCachingConfig":
+        config = cls(enabled=_bool_env(env, "ENABLE_PREFIX_CACHING"),
+                     hash_algo=env.get("PREFIX_CACHING_HASH_ALGO") or None)
+        config.validate()
+        return config
+
+    def validate(self) -> None:
+        if self.hash_algo is not None and self.hash_algo not in PREFIX_CACHING_HASH_ALGOS:
+            raise ValueError(f"PREFIX_CACHING_HASH_ALGO must be one of {PREFIX_CACHING_HASH_ALGOS}, got {self.hash_algo!r}")
+        if self.hash_algo is not None and self.enabled is False:
+            raise ValueError("PREFIX_CACHING_HASH_ALGO is set but ENABLE_PREFIX_CACHING is false")
+
+    def cli_args(self) -> Dict[str, Any]:
+        args: Dict[str, Any] = {}
+        if self.enabled is not None:
+            args["enable-prefix-caching" if self.enabled else "no-enable-prefix-caching"] = True
+        if self.hash_algo is not None:
+            args["prefix-caching-hash-algo"] = self.hash_algo
+        return args
+
+
+@dataclass
+class SpeculativeConfig:
+    """
+    Спекулятивное декодирование: за шаг целевая модель проверяет num_speculative_tokens предложенных токенов.
+    ngram — предложения из самого промпта (без доп. модели; выигрыш на ответах, повторяющих вход),
+    eagle/eagle3 — draft-голова SPECULATIVE_MODEL, draft — отдельная малая модель.
+    Проверка rejection sampling не меняет распределение ответа, меняется только ITL.
+    Отключить спекуляцию для отдельного запроса V1 не позволяет: конфигурация общая для движка.
+    """
+    method: Optional[str] = None  # None — выключено
+    model: Optional[str] = None
+    num_speculative_tokens: int = 3
+    prompt_lookup_min: int = 2  # ngram: длины n-грамм, которые ищем в промпте
+    prompt_lookup_max: int = 4
+    draft_tensor_parallel_size: Optional[int] = None
+    extra: Dict[str, Any] = field(default_factory=dict)  # SPECULATIVE_CONFIG — поля сверх перечисленных
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "SpeculativeConfig":
+        """
+        SPECULATIVE_METHOD=ngram|eagle|eagle3|draft, SPECULATIVE_MODEL, NUM_SPECULATIVE_TOKENS,
+        NGRAM_PROMPT_LOOKUP_MIN/MAX, SPECULATIVE_DRAFT_TP; SPECULATIVE_CONFIG — JSON поверх (как --speculative-config).
+        """
+        extra = json.loads(env["SPECULATIVE_CONFIG"]) if env.get("SPECULATIVE_CONFIG") else {}
+        if not isinstance(extra, dict):
+            raise ValueError("SPECULATIVE_CONFIG must be a JSON object")
+        draft_tp = env.get("SPECULATIVE_DRAFT_TP")
+        config = cls(
+            method=(env.get("SPECULATIVE_METHOD") or "").strip().lower() or None,
+            model=env.get("SPECULATIVE_MODEL") or None,
+            num_speculative_tokens=int(env.get("NUM_SPECULATIVE_TOKENS", "3")),
+            prompt_lookup_min=int(env.get("NGRAM_PROMPT_LOOKUP_MIN", "2")),
+            prompt_lookup_max=int(env.get("NGRAM_PROMPT_LOOKUP_MAX", "4")),
+            draft_tensor_parallel_size=int(draft_tp) if draft_tp else None,
+            extra=extra,
+        )
+        config.validate(use_v1=env.get("VLLM_USE_V1", "1") != "0")
+        return config
+
+    @property
+    def enabled(self) -> bool:
+        return self.method is not None or bool(self.extra)
+
+    def validate(self, use_v1: bool = True) -> None:
+        if self.method is None:
+            return
+        if self.method not in SPECULATIVE_METHODS:
+            raise ValueError(f"SPECULATIVE_METHOD must be one of {SPECULATIVE_METHODS}, got {self.method!r}")
+        if self.num_speculative_tokens < 1:
+            raise ValueError("NUM_SPECULATIVE_TOKENS must be >= 1")
+        if self.method == "ngram":
+            if not 1 <= self.prompt_lookup_min <= self.prompt_lookup_max:
+                raise ValueError("expected 1 <= NGRAM_PROMPT_LOOKUP_MIN <= NGRAM_PROMPT_LOOKUP_MAX")
+        elif not self.model:
+            raise ValueError(f"SPECULATIVE_METHOD={self.method} requires SPECULATIVE_MODEL")
+        if self.method == "draft" and use_v1:
+            # vLLM 0.10 V1 не поддерживает отдельную draft-модель; при VLLM_USE_V1=1 движок не стартует
+            raise ValueError("SPECULATIVE_METHOD=draft is not supported by the vLLM V1 engine; use eagle/eagle3 or ngram")
+
+    def to_dict(self) -> Dict[str, Any]:
+        config: Dict[str, Any] = {}
+        if self.method is not None:
+            config["num_speculative_tokens"] = self.num_speculative_tokens
+            if self.method == "ngram":
+                config.update(method="ngram", prompt_lookup_min=self.prompt_lookup_min,
+                              prompt_lookup_max=self.prompt_lookup_max)
+            else:
+                config["model"] = self.model
+                if self.method != "draft":
+                    config["method"] = self.method  # Для draft vLLM определяет метод по модели
+            if self.draft_tensor_parallel_size is not None:
+                config["draft_tensor_parallel_size"] = self.draft_tensor_parallel_size
+        config.update(self.extra)
+        return config
+
+    def cli_args(self) -> Dict[str, Any]:
+        return {"speculative-config": json.dumps(self.to_dict())} if self.enabled else {}
+
+
+def engine_feature_args(env: Mapping[str, str] = os.environ) -> Dict[str, Any]:
+    """Ключи CLI vLLM для build_config; ошибки конфигурации — ValueError еще на драйвере, до старта реплик."""
+    return {**PrefixCachingConfig.from_env(env).cli_args(), **SpeculativeConfig.from_env(env).cli_args()}
+
+
+def apply_prefix_cache_opt_out(request: Any, headers: Optional[Mapping[str, str]]) -> bool:
+    """
+    X-Prefix-Cache: off — случайный cache_salt: запрос не читает и не отдает другим свои блоки KV-кеша
+    (полный prefill, зато без разделения кеша с чужими запросами). PrefixRouter пересылает заголовок
+    реплике (ключи в нижнем регистре); то же можно задать полем cache_salt в теле запроса.
+    """
+    if headers is None or headers.get(PREFIX_CACHE_HEADER.lower(), "").strip().lower() != "off":
+        return False
+    if not getattr(request, "cache_salt", None):
+        request.cache_salt = secrets.token_hex(16)
+    return True
@@ -0,0 +1,129 @@
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from prometheus_client import Gauge
+
+# Окно сглаживания для токенов/с (экспоненциальное среднее)
+THROUGHPUT_HALF_LIFE_S = 10.0
+
+# Доли за то же окно: vLLM экспортирует только счетчики (vllm:prefix_cache_hits, vllm:spec_decode_num_*)
+PREFIX_CACHE_HIT_RATE = Gauge("vllm_prefix_cache_hit_rate", "Share of prompt tokens served from the prefix cache (smoothed)")
+SPEC_DECODE_ACCEPTANCE_RATE = Gauge(
+    "vllm_spec_decode_acceptance_rate", "Share of draft tokens accepted by the target model (smoothed)"
+)
+SPEC_DECODE_ACCEPTANCE_LENGTH = Gauge(
+    "vllm_spec_decode_mean_acceptance_length", "Tokens emitted per speculative step, including the bonus token (smoothed)"
+)
+
+
+class EngineLoadStats:
+    """
+    Последний снимок нагрузки vLLM-движка на реплике: running/waiting, заполнение KV-кеша,
+    сглаженные токены/с. Заполняется из stat logger движка, читается обработчиками и автоскейлером.
+    Там же — сглаженные доли попаданий prefix cache и принятых draft-токенов (engine_features.py).
+    """
+    def __init__(self, half_life_s: float = THROUGHPUT_HALF_LIFE_S):
+        self.half_life_s = half_life_s
+        self.num_running = 0
+        self.num_waiting = 0
+        self.kv_cache_usage = 0.0
+        self.prompt_tokens_per_s = 0.0
+        self.generation_tokens_per_s = 0.0
+        # Сглаженные счетчики за шаг: доля = отношение средних, а не среднее отношений
+        self._prefix = {"queries": 0.0, "hits": 0.0}
+        self._spec = {"drafts": 0.0, "draft_tokens": 0.0, "accepted": 0.0}
+        self.updated_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, scheduler_stats: Any, iteration_stats: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if scheduler_stats is not None:
+                self.num_running = scheduler_stats.num_running_reqs
+                self.num_waiting = scheduler_stats.num_waiting_reqs
+                # В разных версиях vLLM поле называется по-разному
+                usage = getattr(scheduler_stats, "kv_cache_usage", None)
+                if usage is None:
+                    usage = getattr(scheduler_stats, "gpu_cache_usage", 0.0)
+                self.kv_cache_usage = float(usage)
+                # Счетчики за шаг (в V1 — с prefix caching и спекулятивным декодированием соответственно)
+                alpha = 1.0 - 0.5 ** (max(now - self.updated_at, 1e-6) / self.half_life_s) if self.updated_at else 1.0
+                prefix = getattr(scheduler_stats, "prefix_cache_stats", None)
+                if prefix is not None and prefix.queries:
+                    self._smooth(self._prefix, alpha, queries=prefix.queries, hits=prefix.hits)
+                spec = getattr(scheduler_stats, "spec_decoding_stats", None)
+                if spec is not None and spec.num_draft_tokens:
+                    self._smooth(self._spec, alpha, drafts=spec.num_drafts, draft_tokens=spec.num_draft_tokens,
+                                 accepted=spec.num_accepted_tokens)
+            if iteration_stats is not None and self.updated_at is not None:
+                dt = max(now - self.updated_at, 1e-6)
+                alpha = 1.0 - 0.5 ** (dt / self.half_life_s)
+                self.prompt_tokens_per_s += alpha * (iteration_stats.num_prompt_tokens / dt - self.prompt_tokens_per_s)
+                self.generation_tokens_per_s += alpha * (
+                    iteration_stats.num_generation_tokens / dt - self.generation_tokens_per_s
+                )
+            self.updated_at = now
+        PREFIX_CACHE_HIT_RATE.set(self.prefix_cache_hit_rate)
+        SPEC_DECODE_ACCEPTANCE_RATE.set(self.spec_acceptance_rate)
+        SPEC_DECODE_ACCEPTANCE_LENGTH.set(self.spec_acceptance_length)
+
+    @staticmethod
+    def _smooth(window: Dict[str, float], alpha: float, **values: float) -> None:
+        for key, value in values.items():
+            window[key] += alpha * (value - window[key])
+
+    @property
+    def prefix_cache_hit_rate(self) -> float:
+        return self._prefix["hits"] / self._prefix["queries"] if self._prefix["queries"] else 0.0
+
+    @property
+    def spec_acceptance_rate(self) -> float:
+        return self._spec["accepted"] / self._spec["draft_tokens"] if self._spec["draft_tokens"] else 0.0
+
+    @property
+    def spec_acceptance_length(self) -> float:
+        return 1.0 + self._spec["accepted"] / self._spec["drafts"] if self._spec["drafts"] else 0.0
+
+    def features(self) -> Dict[str, float]:
+        """Эффект prefix caching и спекулятивного декодирования (для /v1/engine/features и бенчмарков)."""
+        with self._lock:
+            return {
+                "prefix_cache_hit_rate": self.prefix_cache_hit_rate,
+                "spec_decode_acceptance_rate": self.spec_acceptance_rate,
+                "spec_decode_mean_acceptance_length": self.spec_acceptance_length,
+            }
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "num_running": float(self.num_running),
+                "num_waiting": float(self.num_waiting),
+                "kv_cache_usage": self.kv_cache_usage,
+                "prompt_tokens_per_s": self.prompt_tokens_per_s,
+                "generation_tokens_per_s": self.generation_tokens_per_s,
+            }
+
+
+def make_stat_logger_factory(stats: EngineLoadStats):
+    """
+    Фабрика stat logger'а для AsyncLLM (V1): AsyncLLMEngine.from_engine_args(..., stat_loggers=[factory]).
+    Переданный список заменяет консольный LoggingStatLogger vLLM (Prometheus-логгер остается всегда),
+    поэтому serve.py передает LoggingStatLogger рядом с этой фабрикой.
+    """
+    from vllm.v1.metrics.loggers import StatLoggerBase  # Импорт на акторе, где установлен vLLM
+
+    class LoadStatLogger(StatLoggerBase):
+        def __init__(self, vllm_config: Any, engine_index: int = 0):
+            self.engine_index = engine_index
+
+        def record(self, scheduler_stats: Any, iteration_stats: Any, engine_idx: int = 0) -> None:
+            stats.update(scheduler_stats, iteration_stats)
+
+        def log_engine_initialized(self) -> None:
+            pass
+
+    def factory(vllm_config: Any, engine_index: int = 0) -> "LoadStatLogger":
+        return LoadStatLogger(vllm_config, engine_index)
+
+    return factory
@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import ray
+from ray import serve
+
+from autoscaling import AutoscalingSettings, aggregate, apply_delays, desired_replicas, scaled_config, target_replicas
+
+logger = logging.getLogger("ray.serve")
+
+
+@serve.deployment(name="LoadAutoscaler", num_replicas=1, ray_actor_options={"num_cpus": 0})
+class LoadAutoscaler:
+    """
+    Автоскейлинг VLLMDeployment по очереди и KV-кешу движка (AUTOSCALING_POLICY=load).
+    Пользовательских политик в Ray 2.49 нет, поэтому решение принимает этот деплой: реплики раз в
+    AUTOSCALE_INTERVAL_S присылают снимок EngineLoadStats (report), а контроллер по сумме снимков считает
+    desired_replicas с гистерезисом apply_delays и выставляет num_replicas через REST API Serve
+    (PUT /api/serve/applications/ — тот же, которым приложение разворачивается).
+    Приложение должно быть развернуто REST-конфигом: после serve run конфига нет, и контроллер только пишет в лог.
+    """
+    async def __init__(self, deployment: str = "VLLMDeployment") -> None:
+        self.deployment = deployment
+        self.settings = AutoscalingSettings.from_env()
+        self.app_name = serve.get_replica_context().app_name
+        head = ray.get_runtime_context().gcs_address.rsplit(":", 1)[0]  # Дашборд работает на head-узле, рядом с GCS
+        self.dashboard_url = os.environ.get("AUTOSCALE_DASHBOARD_URL", f"http://{head}:8265").rstrip("/")
+        self.reports: Dict[str, Tuple[float, Dict[str, float]]] = {}  # Реплика → (момент отчета, снимок)
+        self.state: Dict[str, Any] = {}
+        self._warned = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"[autoscale] LoadAutoscaler for {self.app_name}/{deployment} via {self.dashboard_url}: {self.settings}")
+
+    async def report(self, replica: str, snapshot: Dict[str, float]) -> None:
+        self.reports[replica] = (time.monotonic(), snapshot)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.interval_s)
+            try:
+                await self._tick()
+            except Exception as e:  # Дашборд недоступен и т.п. — попробуем на следующем тике
+                logger.warning(f"[autoscale] scaling step failed: {e}")
+
+    async def _tick(self) -> Optional[int]:
+        now = time.monotonic()
+        self.reports = {r: v for r, v in self.reports.items() if now - v[0] <= self.settings.report_ttl_s}
+        if not self.reports:  # Пока реплики не прислали метрики, число реплик не меняем
+            return None
+        async with httpx.AsyncClient(base_url=self.dashboard_url, timeout=10) as client:
+            response = await client.get("/api/serve/applications/")
+            response.raise_for_status()
+            details = response.json()
+            current = target_replicas(details, self.app_name, self.deployment) or len(self.reports)
+            signals = aggregate([snapshot for _, snapshot in self.reports.values()])
+            desired = desired_replicas(signals, current, self.settings)
+            replicas = apply_delays(desired, current, now, self.state, self.settings)
+            if replicas == current:
+                return current
+            body = scaled_config(details, self.app_name, self.deployment, replicas)
+            if body is None:
+                if not self._warned:
+                    self._warned = True
+                    logger.warning(f"[autoscale] {self.app_name} was not deployed from a REST config, "
+                                   f"cannot scale {self.deployment} to {replicas} replicas")
+                return current
+            response = await client.put("/api/serve/applications/", json=body)
+            response.raise_for_status()
+        logger.info(f"[autoscale] {self.deployment}: {current} -> {replicas} replicas "
+                    f"(running={signals.num_running:.0f} waiting={signals.num_waiting:.0f} "
+                    f"kv={signals.kv_cache_usage:.0%})")
+        return replicas
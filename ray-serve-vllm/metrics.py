@@ -0,0 +1,119 @@
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import Histogram, REGISTRY, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+
+# Стадии обработки запроса:
+#   auth   — verify_jwt_token;
+#   budget — подсчет токенов промпта против max-model-len, усечение истории / урезание max_tokens;
+#   cache  — поиск в кеше ответов (ключ + чтение из хранилища);
+#   admission — ожидание слота в AdmissionController (token bucket + WFQ-очередь);
+#   adapter — загрузка LoRA-адаптера при первом запросе к нему (для загруженного — no-op);
+#   init   — _initialize_serving_chat (после старта реплики — no-op);
+#   create — openai_serving_chat.create_chat_completion (для stream — до получения генератора,
+#            для обычного ответа — вся генерация);
+#   ttfc   — от начала запроса до первого SSE-чанка;
+#   stream — от первого до последнего SSE-чанка;
+#   total  — от начала запроса до отправки последнего байта.
+STAGE_SECONDS = Histogram(
+    "vllm_deployment_stage_seconds",
+    "Latency of VLLMDeployment request handling stages",
+    ["endpoint", "role", "stage"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+             1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+# Кеш дочерних серий: labels() в prometheus_client берет блокировку и строит кортеж на каждый вызов
+_children: Dict[Tuple[str, str, str], Any] = {}
+
+
+def observe(endpoint: str, role: str, stage: str, seconds: float) -> None:
+    key = (endpoint, role, stage)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = STAGE_SECONDS.labels(endpoint, role, stage)
+    child.observe(seconds)
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "started")
+
+    def __init__(self, timer: "RequestTimer", name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self) -> "_Stage":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        observe(self.timer.endpoint, self.timer.role, self.name, time.perf_counter() - self.started)
+
+
+class RequestTimer:
+    """
+    Замеры стадий одного запроса. role уточняется после проверки JWT
+    (внутри блока stage("auth")), до этого — "unknown".
+    """
+    __slots__ = ("endpoint", "role", "started")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.role = "unknown"
+        self.started = time.perf_counter()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def finish(self) -> None:
+        observe(self.endpoint, self.role, "total", time.perf_counter() - self.started)
+
+    async def wrap_stream(self, generator: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Проксирует SSE-генератор, фиксируя время до первого чанка и длительность стрима."""
+        first: Optional[float] = None
+        try:
+            async for chunk in generator:
+                if first is None:
+                    first = time.perf_counter()
+                    observe(self.endpoint, self.role, "ttfc", first - self.started)
+                yield chunk
+        finally:
+            now = time.perf_counter()
+            if first is not None:
+                observe(self.endpoint, self.role, "stream", now - first)
+            observe(self.endpoint, self.role, "total", now - self.started)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Тело и Content-Type для /metrics (общий реестр: туда же пишет и vLLM)."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class _MergedCollector:
+    """Семейства метрик нескольких реплик с меткой replica; серии одного семейства идут подряд, как требует формат."""
+
+    def __init__(self, texts: Dict[str, bytes]):
+        self.texts = texts
+
+    def collect(self) -> Iterator[Metric]:
+        merged: Dict[str, Metric] = {}
+        for replica, text in self.texts.items():
+            for family in text_string_to_metric_families(text.decode("utf-8")):
+                target = merged.get(family.name)
+                if target is None:
+                    target = merged[family.name] = Metric(family.name, family.documentation, family.type, family.unit)
+                for sample in family.samples:
+                    target.add_sample(sample.name, {**sample.labels, "replica": replica}, sample.value, sample.timestamp)
+        yield from merged.values()
+
+
+def merge_exposition(texts: Dict[str, bytes]) -> bytes:
+    """
+    /metrics нескольких реплик одним ответом (PrefixRouter): у каждой серии — метка replica.
+    Простая склейка текстов недопустима: повторные # TYPE одного семейства Prometheus отвергает.
+    """
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(_MergedCollector(texts))
+    return generate_latest(registry)
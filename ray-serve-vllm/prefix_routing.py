@@ -0,0 +1,320 @@
+import os
+import bisect
+import hashlib
+import math
+import random
+import argparse
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+# Настройки маршрутизации по префиксу: берем из переменных окружения или используем значения по умолчанию.
+PREFIX_BLOCK_CHARS = int(os.environ.get("PREFIX_BLOCK_CHARS", "256"))  # ~64 токена, 4 KV-блока vLLM по 16
+PREFIX_ROUTING_BLOCKS = int(os.environ.get("PREFIX_ROUTING_BLOCKS", "4"))  # Предел длины окна ключа в блоках
+PREFIX_ROUTING_LOAD_FACTOR = float(os.environ.get("PREFIX_ROUTING_LOAD_FACTOR", "1.25"))  # c в bounded-load hashing
+PREFIX_ROUTING_VNODES = int(os.environ.get("PREFIX_ROUTING_VNODES", "160"))  # Виртуальных узлов на реплику
+PREFIX_ROUTING_TRACKED_KEYS = int(os.environ.get("PREFIX_ROUTING_TRACKED_KEYS", "10000"))  # Ключей в памяти на реплику
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def render_prompt_prefix(messages: Sequence[Dict[str, Any]], max_chars: int) -> str:
+    """
+    Приближение chat-шаблона для ведущей части диалога: "role\\ncontent\\n" по сообщениям.
+    Роутер не грузит токенизатор; важно лишь, чтобы одинаковые system prompt и первые реплики
+    давали одинаковую строку. Рендер останавливается, как только набрано max_chars символов.
+    """
+    parts: List[str] = []
+    size = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):  # Мультимодальный формат: берем только текстовые части
+            content = "".join(p.get("text", "") for p in content if isinstance(p, dict))
+        chunk = f"{message.get('role', '')}\n{content}\n"
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= max_chars:
+            break
+    return "".join(parts)[:max_chars]
+
+
+def _key_window(messages: Sequence[Dict[str, Any]]) -> Sequence[Dict[str, Any]]:
+    """Начало диалога до первого user-сообщения включительно: от хода к ходу оно не меняется."""
+    for i, message in enumerate(messages):
+        if message.get("role") == "user":
+            return messages[:i + 1]
+    return messages
+
+
+def prefix_key(
+        messages: Sequence[Dict[str, Any]],
+        block_chars: int = PREFIX_BLOCK_CHARS,
+        max_blocks: int = PREFIX_ROUTING_BLOCKS,
+) -> Optional[int]:
+    """
+    Ключ маршрутизации: хеш system prompt и первого user-сообщения (не больше max_blocks блоков).
+    Окно не растет вместе с историей, поэтому все ходы диалога получают один ключ и идут на реплику,
+    где уже лежат его KV-блоки. Пустое окно — None (наименее загруженная реплика).
+    """
+    text = render_prompt_prefix(_key_window(messages), block_chars * max_blocks)
+    if not text:
+        return None
+    return _hash64(text.encode("utf-8"))
+
+
+def block_hashes(text: str, block_chars: int = PREFIX_BLOCK_CHARS) -> List[int]:
+    """Цепочка хешей полных блоков, как у prefix cache vLLM: хеш блока зависит от всех предыдущих."""
+    hashes: List[int] = []
+    parent = 0
+    for start in range(0, len(text) - block_chars + 1, block_chars):
+        parent = _hash64(parent.to_bytes(8, "big") + text[start:start + block_chars].encode("utf-8"))
+        hashes.append(parent)
+    return hashes
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами."""
+    def __init__(self, nodes: Sequence[str], vnodes: int = PREFIX_ROUTING_VNODES):
+        points = []
+        for node in nodes:
+            for v in range(vnodes):
+                points.append((_hash64(f"{node}#{v}".encode("utf-8")), node))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+        self.nodes = list(nodes)
+
+    def walk(self, key: int):
+        """Обходит уникальные узлы по часовой стрелке начиная с позиции ключа."""
+        start = bisect.bisect(self._hashes, key) % len(self._hashes)
+        seen = set()
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class PrefixAffinityRouter:
+    """
+    Консистентное хеширование с ограниченной нагрузкой (bounded loads):
+    реплика принимает запрос, только если ее in-flight не превысит ceil(c * (всего + 1) / N);
+    иначе идем дальше по кольцу. Запросы без ключа уходят на наименее загруженную реплику.
+    """
+    def __init__(
+            self,
+            replicas: Sequence[str],
+            load_factor: float = PREFIX_ROUTING_LOAD_FACTOR,
+            tracked_keys: int = PREFIX_ROUTING_TRACKED_KEYS,
+    ):
+        if not replicas:
+            raise ValueError("PrefixAffinityRouter requires at least one replica")
+        self.ring = ConsistentHashRing(replicas)
+        self.load_factor = load_factor
+        self.tracked_keys = tracked_keys
+        self.inflight: Dict[str, int] = {r: 0 for r in replicas}
+        self._seen: Dict[str, "OrderedDict[int, None]"] = {r: OrderedDict() for r in replicas}
+        self.requests = 0
+        self.keyed_requests = 0
+        self.affinity_hits = 0  # Ключ уже обслуживался выбранной репликой (ее KV-блоки, вероятно, в кеше)
+        self.spills = 0  # Домашняя реплика ключа перегружена, ушли дальше по кольцу
+
+    def capacity(self) -> int:
+        total = sum(self.inflight.values()) + 1
+        return max(1, math.ceil(self.load_factor * total / len(self.inflight)))
+
+    def acquire(self, key: Optional[int], exclude: Sequence[str] = ()) -> str:
+        """
+        Выбирает реплику и учитывает запрос в ее in-flight; парный вызов — release().
+        exclude — реплики, которые нельзя выбирать (например, дренируемые); если исключены все, они допускаются.
+        """
+        self.requests += 1
+        allowed = [r for r in self.inflight if r not in exclude] or list(self.inflight)
+        if key is None:
+            replica = min(allowed, key=self.inflight.get)
+        else:
+            self.keyed_requests += 1
+            capacity = self.capacity()
+            replica = None
+            for i, node in enumerate(n for n in self.ring.walk(key) if n in allowed):
+                if self.inflight[node] + 1 <= capacity:
+                    replica = node
+                    if i > 0:
+                        self.spills += 1
+                    break
+            if replica is None:  # Недостижимо при c >= 1 без исключений, но не полагаемся на это
+                replica = min(allowed, key=self.inflight.get)
+            seen = self._seen[replica]
+            if key in seen:
+                self.affinity_hits += 1
+                seen.move_to_end(key)
+            else:
+                seen[key] = None
+                if len(seen) > self.tracked_keys:
+                    seen.popitem(last=False)
+        self.inflight[replica] += 1
+        return replica
+
+    def release(self, replica: str) -> None:
+        self.inflight[replica] = max(0, self.inflight[replica] - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "keyed_requests": self.keyed_requests,
+            "affinity_hits": self.affinity_hits,
+            "affinity_hit_rate": self.affinity_hits / self.keyed_requests if self.keyed_requests else 0.0,
+            "spills": self.spills,
+            "inflight": dict(self.inflight),
+        }
+
+
+# -------------------------
+# Локальный режим проверки на фейковых репликах
+# -------------------------
+class FakeReplica:
+    """Реплика-заглушка: LRU цепочек хешей блоков моделирует prefix cache vLLM ограниченного объема."""
+    def __init__(self, name: str, capacity_blocks: int):
+        self.name = name
+        self.capacity_blocks = capacity_blocks
+        self.blocks: "OrderedDict[int, None]" = OrderedDict()
+        self.cached_blocks = 0
+        self.total_blocks = 0
+
+    def serve(self, messages: Sequence[Dict[str, Any]]) -> None:
+        hashes = block_hashes(render_prompt_prefix(messages, 1 << 30))
+        self.total_blocks += len(hashes)
+        for h in hashes:  # Префиксный матч: считаем блоки до первого промаха
+            if h not in self.blocks:
+                break
+            self.cached_blocks += 1
+        for h in hashes:
+            self.blocks[h] = None
+            self.blocks.move_to_end(h)
+        while len(self.blocks) > self.capacity_blocks:
+            self.blocks.popitem(last=False)
+
+
+def synthetic_conversations(
+        num_conversations: int,
+        turns: int,
+        num_system_prompts: int,
+        seed: int = 0,
+        system_words: int = 200,
+) -> List[List[List[Dict[str, str]]]]:
+    """Многоходовые диалоги: каждый следующий запрос = вся предыдущая история + новая реплика."""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(5000)]
+
+    def text(n_words: int) -> str:
+        return " ".join(rng.choice(words) for _ in range(n_words))
+
+    systems = [text(system_words) for _ in range(num_system_prompts)]
+    conversations = []
+    for c in range(num_conversations):
+        history = [{"role": "system", "content": systems[c % num_system_prompts]}]
+        requests = []
+        for _ in range(turns):
+            history = history + [{"role": "user", "content": text(rng.randint(20, 120))}]
+            requests.append(list(history))
+            history = history + [{"role": "assistant", "content": text(rng.randint(50, 150))}]
+        conversations.append(requests)
+    return conversations
+
+
+def simulate(
+        strategy: str,
+        num_replicas: int = 4,
+        num_conversations: int = 200,
+        turns: int = 6,
+        num_system_prompts: int = 8,
+        concurrency: int = 16,
+        capacity_blocks: int = 4000,
+        seed: int = 0,
+        system_words: int = 200,
+) -> Dict[str, Any]:
+    """
+    Прогоняет синтетический трафик через роутер и фейковые реплики.
+    strategy: "prefix" (этот роутер), "round_robin" или "random" — для сравнения.
+    Запросы идут волнами по concurrency штук: внутри волны in-flight растет, после — сбрасывается.
+    split_conversations — диалоги, ходы которых попали больше чем на одну реплику.
+    """
+    rng = random.Random(seed)
+    replicas = {f"replica-{i}": FakeReplica(f"replica-{i}", capacity_blocks) for i in range(num_replicas)}
+    router = PrefixAffinityRouter(list(replicas))
+    conversations = synthetic_conversations(num_conversations, turns, num_system_prompts, seed, system_words)
+
+    # Перемешиваем диалоги, сохраняя порядок ходов внутри каждого
+    queue = [(c, 0) for c in range(len(conversations))]
+    ordered: List[Tuple[int, List[Dict[str, str]]]] = []
+    while queue:
+        i = rng.randrange(len(queue))
+        c, t = queue[i]
+        ordered.append((c, conversations[c][t]))
+        if t + 1 < len(conversations[c]):
+            queue[i] = (c, t + 1)
+        else:
+            queue.pop(i)
+
+    names = list(replicas)
+    served: Dict[int, Set[str]] = {}
+    for wave_start in range(0, len(ordered), concurrency):
+        acquired = []
+        for n, (c, messages) in enumerate(ordered[wave_start:wave_start + concurrency]):
+            if strategy == "prefix":
+                name = router.acquire(prefix_key(messages))
+                acquired.append(name)
+            elif strategy == "round_robin":
+                name = names[(wave_start + n) % len(names)]
+            else:
+                name = rng.choice(names)
+            replicas[name].serve(messages)
+            served.setdefault(c, set()).add(name)
+        for name in acquired:
+            router.release(name)
+
+    cached = sum(r.cached_blocks for r in replicas.values())
+    total = sum(r.total_blocks for r in replicas.values())
+    result = {"strategy": strategy, "cached_block_ratio": cached / total if total else 0.0,
+              "split_conversations": sum(1 for used in served.values() if len(used) > 1)}
+    if strategy == "prefix":
+        result.update(router.stats())
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefix-aware routing simulation on fake replicas")
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--system-prompts", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--capacity-blocks", type=int, default=4000)
+    args = parser.parse_args()
+
+    for strategy in ("random", "round_robin", "prefix"):
+        res = simulate(
+            strategy,
+            num_replicas=args.replicas,
+            num_conversations=args.conversations,
+            turns=args.turns,
+            num_system_prompts=args.system_prompts,
+            concurrency=args.concurrency,
+            capacity_blocks=args.capacity_blocks,
+        )
+        line = f"{strategy:>12}: cached prefix blocks {res['cached_block_ratio']:.1%}"
+        if strategy == "prefix":
+            line += f", affinity hit rate {res['affinity_hit_rate']:.1%}, spills {res['spills']}"
+        print(line)
+
+    # Короткий system prompt (меньше блока): ключ не должен меняться от хода к ходу.
+    # По одному запросу в работе — bounded load не уводит ходы на другую реплику
+    res = simulate("prefix", num_replicas=args.replicas, num_conversations=args.conversations, turns=args.turns,
+                   num_system_prompts=args.system_prompts, concurrency=1, system_words=5)
+    print(f"short system prompt: {res['split_conversations']} of {args.conversations} conversations "
+          f"split across replicas, cached prefix blocks {res['cached_block_ratio']:.1%}")
+    if res["split_conversations"]:
+        raise SystemExit(1)
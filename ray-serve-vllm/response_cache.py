@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from starlette.responses import Response, StreamingResponse
+
+logger = logging.getLogger("ray.serve")
+
+CACHE_REQUESTS = Counter(
+    "vllm_response_cache_requests_total",
+    "Response cache lookups by result (hit/miss/bypass) and stores",
+    ["endpoint", "result"],
+)
+CACHE_BYTES = Gauge("vllm_response_cache_bytes", "Bytes held by the in-memory response cache")
+CACHE_ENTRIES = Gauge("vllm_response_cache_entries", "Entries held by the in-memory response cache")
+
+# Поля запроса, не влияющие на содержимое ответа: по ним ключ не строим
+_NON_SEMANTIC_FIELDS = {"stream", "stream_options", "user", "request_id", "priority"}
+
+
+# -------------------------
+# Хранилища
+# -------------------------
+class CacheBackend(ABC):
+    """Хранилище готовых ответов: ключ → JSON chat.completion (bytes)."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl_s: float) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemoryBackend(CacheBackend):
+    """LRU в памяти реплики с бюджетом по байтам и TTL на запись."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl_s: float) -> None:
+        if len(value) > self.max_bytes:
+            return  # Больше всего бюджета — не кешируем
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + ttl_s, value)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        CACHE_BYTES.set(self._bytes)
+        CACHE_ENTRIES.set(len(self._entries))
+
+    def _drop(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class RedisBackend(CacheBackend):
+    """
+    Общий для всех реплик кеш во внешнем Redis (redis.asyncio). TTL — на ключе (PX),
+    бюджет памяти и LRU — на стороне Redis: maxmemory + maxmemory-policy allkeys-lru.
+    """
+
+    def __init__(self, url: str, namespace: str = "vllm:resp:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE=redis requires the 'redis' package") from e
+        self.client = redis.from_url(url)
+        self.namespace = namespace
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.namespace + key)
+
+    async def set(self, key: str, value: bytes, ttl_s: float) -> None:
+        await self.client.set(self.namespace + key, value, px=int(ttl_s * 1000))
+
+
+# -------------------------
+# Кеш ответов
+# -------------------------
+class ResponseCache:
+    """
+    Кеш точных совпадений для детерминированных chat.completions (temperature=0, n=1, без logprobs).
+    Ключ — sha256 канонического JSON запроса (модель, сообщения, параметры семплирования)
+    и шаблона чата. Храним итоговый chat.completion; stream-клиентам попадание отдается SSE-чанками.
+    Отключение: эндпоинт в RESPONSE_CACHE_DISABLED_ENDPOINTS или заголовок Cache-Control
+    (no-cache — не читать из кеша, no-store — не читать и не сохранять).
+    """
+
+    def __init__(self, backend: CacheBackend, ttl_s: float, disabled_endpoints: Optional[set] = None):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.disabled_endpoints = disabled_endpoints or set()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """RESPONSE_CACHE=memory|redis; по умолчанию кеш выключен (None)."""
+        kind = os.environ.get("RESPONSE_CACHE", "none").lower()
+        if kind in ("", "none", "off", "false"):
+            return None
+        if kind == "memory":
+            backend: CacheBackend = InMemoryBackend(int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(256 << 20))))
+        elif kind == "redis":
+            backend = RedisBackend(os.environ.get("RESPONSE_CACHE_REDIS_URL", "redis://redis:6379/0"),
+                                   os.environ.get("RESPONSE_CACHE_NAMESPACE", "vllm:resp:"))
+        else:
+            raise ValueError(f"Unknown RESPONSE_CACHE backend: {kind}")
+        disabled = {e.strip() for e in os.environ.get("RESPONSE_CACHE_DISABLED_ENDPOINTS", "").split(",") if e.strip()}
+        logger.info(f"[cache] response cache enabled: backend={kind}, disabled endpoints={sorted(disabled)}")
+        return cls(backend, float(os.environ.get("RESPONSE_CACHE_TTL_S", "3600")), disabled)
+
+    def policy(self, endpoint: str, headers: Optional[Any]) -> Tuple[bool, bool]:
+        """(читать из кеша, сохранять в кеш) с учетом эндпоинта и Cache-Control клиента."""
+        if endpoint in self.disabled_endpoints:
+            return False, False
+        directives = (headers.get("cache-control", "") if headers is not None else "").lower()
+        if "no-store" in directives:
+            return False, False
+        return "no-cache" not in directives, True
+
+    @staticmethod
+    def key(request: Any, chat_template: Optional[str]) -> Optional[str]:
+        """Ключ запроса или None, если ответ недетерминирован и кешировать его нельзя."""
+        if request.temperature is None or request.temperature != 0:
+            return None
+        if (request.n or 1) != 1 or request.logprobs:
+            return None
+        canonical = request.model_dump(mode="json", exclude=_NON_SEMANTIC_FIELDS, exclude_defaults=True)
+        canonical["__chat_template__"] = chat_template
+        raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def count(self, endpoint: str, result: str) -> None:
+        if result == "hit":
+            self.hits += 1
+        elif result == "miss":
+            self.misses += 1
+        elif result == "bypass":
+            self.bypasses += 1
+        CACHE_REQUESTS.labels(endpoint, result).inc()
+
+    async def lookup(self, key: str, request: Any, endpoint: str) -> Optional[Response]:
+        """Готовый ответ при попадании (JSON или SSE, по request.stream), иначе None."""
+        try:
+            cached = await self.backend.get(key)
+        except Exception as e:  # Недоступность внешнего хранилища не должна ронять запрос
+            logger.warning(f"[cache] lookup failed: {e}")
+            cached = None
+        if cached is None:
+            self.count(endpoint, "miss")
+            return None
+        self.count(endpoint, "hit")
+        response = json.loads(cached)
+        response["id"] = f"chatcmpl-{uuid.uuid4().hex}"  # Новый id/created: клиент видит отдельный ответ
+        response["created"] = int(time.time())
+        headers = {"X-Cache": "HIT"}
+        if request.stream:
+            include_usage = bool(request.stream_options and request.stream_options.include_usage)
+            return StreamingResponse(_replay_sse(response, include_usage), media_type="text/event-stream",
+                                     headers=headers)
+        return Response(content=json.dumps(response, ensure_ascii=False), media_type="application/json",
+                        headers=headers)
+
+    async def store(self, key: str, body: Any, endpoint: str) -> None:
+        """Сохраняет итоговый chat.completion; ответы с tool calls и reasoning не кешируем."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        response = json.loads(body)
+        for choice in response.get("choices", []):
+            message = choice.get("message") or {}
+            if message.get("tool_calls") or message.get("reasoning_content"):
+                return
+        try:
+            await self.backend.set(key, body, self.ttl_s)
+        except Exception as e:
+            logger.warning(f"[cache] store failed: {e}")
+            return
+        self.count(endpoint, "store")
+
+    async def record_stream(self, generator: AsyncIterator[str], key: str, endpoint: str) -> AsyncIterator[str]:
+        """Проксирует SSE-стрим движка и по [DONE] собирает из дельт итоговый ответ для кеша."""
+        recorder = _StreamRecorder()
+        async for frame in generator:
+            recorder.feed(frame)
+            yield frame
+        body = recorder.result()
+        if body is not None:
+            await self.store(key, body, endpoint)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+class _StreamRecorder:
+    """Склеивает chat.completion.chunk-и в chat.completion; при ошибке или tool calls — отказывается."""
+
+    def __init__(self) -> None:
+        self.head: Dict[str, Any] = {}
+        self.content: Dict[int, list] = {}
+        self.finish: Dict[int, Optional[str]] = {}
+        self.usage: Optional[Dict[str, Any]] = None
+        self.done = False
+        self.failed = False
+
+    def feed(self, frame: str) -> None:
+        if self.failed:
+            return
+        for line in frame.splitlines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                self.done = True
+                continue
+            chunk = json.loads(data)
+            if "error" in chunk:
+                self.failed = True
+                return
+            if not self.head:
+                self.head = {"model": chunk.get("model")}
+            if chunk.get("usage"):
+                self.usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("tool_calls") or delta.get("reasoning_content"):
+                    self.failed = True
+                    return
+                index = choice.get("index", 0)
+                if delta.get("content"):
+                    self.content.setdefault(index, []).append(delta["content"])
+                if choice.get("finish_reason"):
+                    self.finish[index] = choice["finish_reason"]
+
+    def result(self) -> Optional[bytes]:
+        if self.failed or not self.done:
+            return None  # Стрим оборван или с ошибкой
+        if self.usage is None:
+            # Без stream_options.include_usage: такая запись отдавалась бы и неблокирующим запросам
+            # с "usage": null (ключ не зависит от stream) — ломала бы схему и учет токенов в батчах
+            return None
+        response = {
+            "id": "", "object": "chat.completion", "created": 0, "model": self.head.get("model"),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": "".join(self.content.get(i, []))},
+                 "logprobs": None, "finish_reason": self.finish.get(i)}
+                for i in sorted(set(self.content) | set(self.finish))
+            ],
+            "usage": self.usage,
+        }
+        return json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+
+async def _replay_sse(response: Dict[str, Any], include_usage: bool) -> AsyncIterator[str]:
+    """Проигрывает сохраненный ответ как SSE: роль, текст, finish_reason, usage (по запросу), [DONE]."""
+    base = {"id": response["id"], "object": "chat.completion.chunk",
+            "created": response["created"], "model": response["model"]}
+
+    def frame(choices: list, **extra: Any) -> str:
+        return f"data: {json.dumps({**base, 'choices': choices, **extra}, ensure_ascii=False)}\n\n"
+
+    for choice in response["choices"]:
+        i = choice["index"]
+        yield frame([{"index": i, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        yield frame([{"index": i, "delta": {"content": choice["message"]["content"]}, "finish_reason": None}])
+        yield frame([{"index": i, "delta": {}, "finish_reason": choice["finish_reason"]}])
+        await asyncio.sleep(0)  # Отдаем цикл событий между choice
+    if include_usage and response.get("usage"):
+        yield frame([], usage=response["usage"])
+    yield "data: [DONE]\n\n"
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
+from fastapi.security import OAuth2PasswordRequestForm, HTTPBearer, HTTPAuthorizationCredentials
+from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse, JSONResponse
+from starlette.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from ray import serve
+from ray.serve.handle import DeploymentHandle
+
+from auth import (verify_jwt_token, check_role, issue_tokens, refresh_tokens, authenticate_user,
+                  TokenResponse, RefreshRequest)
+from drain import DRAIN_HEADER
+from metrics import merge_exposition
+from prefix_routing import PrefixAffinityRouter, prefix_key
+
+logger = logging.getLogger("ray.serve")
+
+# Заголовки, которыми клиент управляет запросом на реплике: кеш ответов, склейка SSE, prefix cache, id для abort
+FORWARDED_HEADERS = ("cache-control", "x-sse-coalesce-ms", "x-prefix-cache", "x-request-id")
+
+router_app = FastAPI()
+router_app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def forwarded_headers(raw_request: Request) -> Dict[str, str]:
+    """FORWARDED_HEADERS запроса клиента; ключи в нижнем регистре, как их читает реплика."""
+    return {name: raw_request.headers[name] for name in FORWARDED_HEADERS if name in raw_request.headers}
+
+
+@serve.deployment(name="PrefixRouter")
+@serve.ingress(router_app)
+class PrefixRouterIngress:
+    """
+    Ingress перед N независимыми VLLMDeployment (по одной реплике в каждом).
+    Запросы с общим началом диалога (system prompt + первые реплики) уходят на ту реплику,
+    у которой эти KV-блоки уже лежат в prefix cache vLLM; перегрузку ограничивает bounded-load hashing.
+    Сам роутер vLLM не импортирует и GPU не требует.
+    Пакетные задания и служебные маршруты (/ready, /startup, /metrics, /v1/engine/features) у реплик
+    без HTTP-маршрутов, поэтому их тоже отдает роутер: по одной реплике или сводно по всем.
+    """
+    def __init__(self, replicas: List[DeploymentHandle]) -> None:
+        self.replicas = {f"replica-{i}": handle for i, handle in enumerate(replicas)}
+        self.router = PrefixAffinityRouter(list(self.replicas))
+        logger.info(f"[router] PrefixRouter over {len(self.replicas)} VLLMDeployment replicas")
+
+    async def _forward(self, body: Dict[str, Any], payload: Dict[str, Any],
+                       headers: Optional[Dict[str, str]] = None) -> Response:
+        """
+        Выбирает реплику по ключу префикса и проксирует ответ (SSE или JSON) через DeploymentHandle.
+        Реплика в дренаже отвечает 503 с X-Drain, не начав генерацию, — такой запрос повторяем на другой реплике.
+        raw_request до реплики не доходит: управляющие заголовки (FORWARDED_HEADERS) передаем словарем.
+        """
+        key = prefix_key(body.get("messages") or [])
+        draining: List[str] = []
+        while True:
+            name = self.router.acquire(key, exclude=draining)
+            try:
+                handle = self.replicas[name].options(stream=True)
+                chunks = handle.routed_chat_completion.remote(body, payload, headers)  # Лимиты и приоритет считает реплика
+                head = await chunks.__anext__()  # Первый элемент — статус, media type и заголовки ответа
+            except BaseException:
+                self.router.release(name)
+                raise
+            drained = head["status_code"] == 503 and DRAIN_HEADER.lower() in {k.lower() for k in head.get("headers") or {}}
+            if not drained or len(draining) + 1 >= len(self.replicas):
+                break
+            chunks.cancel()
+            self.router.release(name)
+            draining.append(name)
+            logger.info(f"[router] {name} is draining, resubmitting to another replica")
+
+        if head["media_type"] == "text/event-stream":
+            async def stream():
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                finally:
+                    self.router.release(name)  # Слот занят до конца стрима
+            return StreamingResponse(stream(), status_code=head["status_code"], media_type=head["media_type"],
+                                     headers=head.get("headers"))
+
+        try:
+            content = b"".join([chunk async for chunk in chunks])
+        finally:
+            self.router.release(name)
+        return Response(content=content, status_code=head["status_code"], media_type=head["media_type"],
+                        headers=head.get("headers"))
+
+    @router_app.post("/token", response_model=TokenResponse)
+    async def login_for_access_token(
+            self,
+            form_data: OAuth2PasswordRequestForm = Depends()
+    ) -> TokenResponse:
+        user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password"
+            )
+        return issue_tokens(user)
+
+    @router_app.post("/token/refresh", response_model=TokenResponse)
+    async def refresh_access_token(self, body: RefreshRequest) -> TokenResponse:
+        return refresh_tokens(body.refresh_token)
+
+    @router_app.post("/v1/tasks/auto/completions")
+    async def auto_completions(
+            self,
+            raw_request: Request,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        try:
+            return await self._forward(await raw_request.json(), payload, forwarded_headers(raw_request))
+        except Exception as e:
+            logger.error(f"[router] Error in auto completions: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @router_app.post("/v1/chat/completions")
+    async def create_chat_completion(
+            self,
+            raw_request: Request,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        try:
+            return await self._forward(await raw_request.json(), payload, forwarded_headers(raw_request))
+        except Exception as e:
+            logger.error(f"[router] Error in chat completion: {e}", exc_info=True)
+            return JSONResponse(content={"error": str(e)}, status_code=500)
+
+    @router_app.get("/v1/models")
+    async def get_models(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        handle = next(iter(self.replicas.values()))  # Все реплики обслуживают одну и ту же модель
+        return JSONResponse(content=await handle.list_models.remote())
+
+    @router_app.get("/router/stats")
+    async def router_stats(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=self.router.stats())  # В т.ч. affinity_hit_rate
+
+    # -------------------------
+    # Пакетные задания: JSONL в общем BATCH_DIR, задание может вести любая реплика
+    # -------------------------
+    async def _batch(self, op: str, payload: Dict[str, Any], batch_id: Optional[str] = None,
+                     data: Optional[bytes] = None) -> Response:
+        owner = payload.get("sub", "anonymous")
+        if op == "create":  # Наименее загруженная реплика; при дренаже задание подхватит другая
+            name = min(self.router.inflight, key=self.router.inflight.get)
+            return _batch_response(batch_id, *await self.replicas[name].routed_batch.remote(op, owner, batch_id, data))
+        results = await self._fan_out(lambda handle: handle.routed_batch.remote(op, owner, batch_id, data))
+        answers = [r for r in results.values() if isinstance(r, tuple)]
+        if op == "list":
+            jobs = {job["id"]: job for _, body in answers for job in body["data"]}
+            return JSONResponse(content={"object": "list", "data": [jobs[k] for k in sorted(jobs)]})
+        # Задание (на общем томе) видит любая реплика; 404 — только если его не нашла ни одна
+        found = next((a for a in answers if a[0] != status.HTTP_404_NOT_FOUND), None) or (answers[0] if answers else None)
+        if found is None:
+            return JSONResponse(content={"detail": "Batch not found"}, status_code=status.HTTP_404_NOT_FOUND)
+        return _batch_response(batch_id, *found)
+
+    async def _fan_out(self, call: Any) -> Dict[str, Any]:
+        """Вызов на всех репликах; недоступная реплика дает исключение вместо ответа."""
+        names = list(self.replicas)
+        results = await asyncio.gather(*(call(self.replicas[name]) for name in names), return_exceptions=True)
+        return dict(zip(names, results))
+
+    @router_app.post("/v1/batches")
+    async def create_batch(
+            self,
+            file: UploadFile = File(...),
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        return await self._batch("create", payload, data=await file.read())
+
+    @router_app.get("/v1/batches")
+    async def list_batches(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        return await self._batch("list", payload)
+
+    @router_app.get("/v1/batches/{batch_id}")
+    async def get_batch(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        return await self._batch("get", payload, batch_id)
+
+    @router_app.get("/v1/batches/{batch_id}/output")
+    async def get_batch_output(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        return await self._batch("output", payload, batch_id)
+
+    @router_app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        return await self._batch("cancel", payload, batch_id)
+
+    # -------------------------
+    # Служебные маршруты реплик
+    # -------------------------
+    async def _reports(self, name: str) -> Dict[str, Any]:
+        results = await self._fan_out(lambda handle: handle.replica_report.remote(name))
+        return {replica: ({"error": str(r)} if isinstance(r, BaseException) else r) for replica, r in results.items()}
+
+    @router_app.get("/ready")  # 200, пока хотя бы одна реплика принимает запросы
+    async def ready(self) -> Any:
+        replicas = await self._reports("ready")
+        ok = any(r.get("ready") for r in replicas.values())
+        return JSONResponse(content={"ready": ok, "replicas": replicas},
+                            status_code=200 if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @router_app.get("/startup")
+    async def startup_report(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=await self._reports("startup"))
+
+    @router_app.get("/v1/engine/features")
+    async def engine_features(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=await self._reports("engine_features"))
+
+    @router_app.get("/metrics")  # Метрики всех реплик одним ответом, у каждой серии — метка replica
+    async def metrics(self) -> Response:
+        results = await self._fan_out(lambda handle: handle.replica_report.remote("metrics"))
+        texts = {name: body for name, body in results.items() if isinstance(body, bytes)}
+        return Response(content=merge_exposition(texts), media_type=CONTENT_TYPE_LATEST)
+
+
+def _batch_response(batch_id: Optional[str], status_code: int, content: Any) -> Response:
+    """Ответ реплики: JSON либо (output) байты JSONL."""
+    if isinstance(content, bytes):
+        return Response(content=content, media_type="application/jsonl",
+                        headers={"Content-Disposition": f'attachment; filename="{batch_id}_output.jsonl"'})
+    return JSONResponse(content=content, status_code=status_code)
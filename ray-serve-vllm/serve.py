@@ -1,40 +1,53 @@
+from __future__ import annotations  # Аннотации с типами vLLM не вычисляются при импорте модуля
+
 import os  # Стандартная библиотека: доступ к переменным окружения и файловой системе
+import sys  # Проверка, не импортирован ли vLLM на драйвере
+import math  # Округление Retry-After
+import asyncio  # Примитивы синхронизации для корутин (Lock)
 import logging  # Логирование событий (уровни, формат, вывод)
-from typing import Dict, Optional, List, Any  # Типизация для повышения читаемости и валидации IDE
-from datetime import datetime, timedelta  # Работа с датой/временем и временными интервалами
+from typing import TYPE_CHECKING, AsyncGenerator, Awaitable, Dict, Optional, List, Any, Tuple  # Типизация для повышения читаемости и валидации IDE
 
-from fastapi import FastAPI, Depends, HTTPException, status  # FastAPI: веб-фреймворк и вспомогательные классы
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile  # FastAPI: веб-фреймворк и вспомогательные классы
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, HTTPBearer, HTTPAuthorizationCredentials  # Безопасность и схемы авторизации
 from starlette.requests import Request  # Тип запроса Starlette (базис FastAPI)
-from starlette.responses import StreamingResponse, JSONResponse  # Типы ответов (стриминг и JSON)
+from starlette.concurrency import run_in_threadpool  # Проверка пароля вне event loop
+from starlette.responses import Response, StreamingResponse, JSONResponse, FileResponse  # Типы ответов (готовые байты, стриминг, JSON, файл)
 from starlette.middleware.cors import CORSMiddleware  # CORS-middleware для междоменного доступа
+from pydantic import ValidationError  # Ошибка валидации тела запроса (ChatCompletionRequest)
 
 from ray import serve  # Ray Serve: декларативное развертывание и оркестрация Python-сервисов
+from ray.serve.handle import DeploymentHandle  # Хендл LoadAutoscaler для отчетов о нагрузке
 
-# vLLM (проверено на 0.10.1.1)
-from vllm.engine.arg_utils import AsyncEngineArgs  # Аргументы движка, создаваемые из CLI/конфига
-from vllm.engine.async_llm_engine import AsyncLLMEngine  # Асинхронный фронт LLM для онлайн-сервинга
-from vllm.entrypoints.openai.cli_args import make_arg_parser  # Построение CLI-парсера под OpenAI-совместимый сервер
-from vllm.entrypoints.openai.protocol import (
-    ChatCompletionRequest,  # Модель входного запроса OpenAI chat.completions
-    ChatCompletionResponse,  # Модель успешного ответа OpenAI chat.completions
-    ErrorResponse,  # Модель ошибки OpenAI-совместимого ответа
-)
-from vllm.entrypoints.openai.serving_chat import OpenAIServingChat  # Обработчик /v1/chat/completions поверх AsyncLLMEngine
-from vllm.entrypoints.openai.serving_models import (
-    BaseModelPath,           # dataclass: описывает имя модели и путь
-    OpenAIServingModels,     # Менеджер базовых моделей/адаптеров; отдает /v1/models и LoRA-роуты
-)
-from vllm.utils import FlexibleArgumentParser  # Расширенный парсер аргументов (гибкая работа с CLI)
+# vLLM (проверено на 0.10.1.1) импортируется лениво — внутри функций, уже на акторе реплики:
+# драйвер, который импортирует модуль и собирает приложение (build_app), не тянет vLLM и torch.
+if TYPE_CHECKING:
+    from vllm.engine.arg_utils import AsyncEngineArgs  # Аргументы движка, создаваемые из CLI/конфига
+    from vllm.entrypoints.openai.protocol import ChatCompletionRequest  # Модель входного запроса OpenAI chat.completions
+    from vllm.entrypoints.openai.serving_chat import OpenAIServingChat  # Обработчик /v1/chat/completions поверх AsyncLLMEngine
+    from vllm.entrypoints.openai.serving_models import OpenAIServingModels  # Менеджер моделей; отдает /v1/models и LoRA-роуты
 
 # Auth
 from auth import (
     verify_jwt_token,  # Проверка и декодирование JWT
     check_role,  # Валидация роли пользователя
-    create_access_token,  # Выпуск JWT токена
+    issue_tokens,  # Выпуск пары access/refresh JWT
+    refresh_tokens,  # Обновление пары по refresh-токену
     authenticate_user,  # Проверка учетных данных пользователя
     TokenResponse,  # Pydantic-модель ответа с токеном
+    RefreshRequest,  # Тело /token/refresh
 )
+from engine_stats import EngineLoadStats, make_stat_logger_factory  # Снимок нагрузки движка для автоскейлинга
+from metrics import RequestTimer, render_latest  # Гистограммы стадий запроса и экспорт /metrics
+from admission import AdmissionController, AdmissionRejected, estimate_cost  # Лимиты и справедливая очередь по пользователям
+from response_cache import ResponseCache  # Кеш ответов для детерминированных запросов (temperature=0)
+from batch import BatchJob, BatchManager, BatchInputError  # Пакетные JSONL-задания (OpenAI Batch API)
+from streaming import StreamSettings, coalesce  # Склейка SSE-событий и обрыв медленных клиентов
+from adapters import AdapterRegistry, AdapterLoadError  # LoRA-адаптеры: загрузка по запросу и LRU
+from budget import TokenBudget  # Проверка промпта + max_tokens против max-model-len до движка
+from engine_features import engine_feature_args, apply_prefix_cache_opt_out  # Prefix caching и спекулятивное декодирование
+from single_flight import SingleFlight  # Склейка одинаковых запросов в работе в одну генерацию
+from drain import DrainController, DRAIN_HEADER  # Дренаж реплики при остановке и rolling upgrade
+from startup import StartupTimeline, engine_args_cache_key, load_engine_args, save_engine_args  # Профиль холодного старта
 
 logger = logging.getLogger("ray.serve")  # Создаем логгер в неймспейсе Ray Serve
 logger.setLevel(logging.DEBUG)  # Устанавливаем уровень логирования DEBUG для подробностей
@@ -59,6 +72,9 @@ def parse_vllm_args(cli_args: Dict[str, Any]) -> Any:
     Гибкий разбор CLI vLLM. Исключаем ключи, которые не идут в AsyncEngineArgs.
     Ключи должны быть в стиле vLLM CLI: 'tensor-parallel-size', 'max-model-len', и т.п.
     """
+    from vllm.entrypoints.openai.cli_args import make_arg_parser  # Построение CLI-парсера под OpenAI-совместимый сервер
+    from vllm.utils import FlexibleArgumentParser  # Расширенный парсер аргументов (гибкая работа с CLI)
+
     exclude_args_from_engine = ["model_name", "chat_template"]  # Эти ключи не передаем в EngineArgs напрямую
     parser = FlexibleArgumentParser(description="vLLM CLI")  # Создаем парсер аргументов
     parser = make_arg_parser(parser)  # Добавляем стандартные vLLM OpenAI-CLI аргументы к парсеру
@@ -83,6 +99,48 @@ def parse_vllm_args(cli_args: Dict[str, Any]) -> Any:
     return parsed_args  # Возвращаем разобранные аргументы
 
 
+def parse_chat_request(body: Dict[str, Any]) -> Tuple[Optional[ChatCompletionRequest], Optional[JSONResponse]]:
+    """
+    Тело → ChatCompletionRequest. Эндпоинты принимают dict, а модель vLLM импортируется здесь,
+    на реплике: иначе FastAPI-схема тянула бы vLLM в процесс, который собирает приложение.
+    Ошибка валидации — 400 в формате ErrorResponse vLLM.
+    """
+    from vllm.entrypoints.openai.protocol import ChatCompletionRequest
+
+    try:
+        return ChatCompletionRequest.model_validate(body), None
+    except ValidationError as e:
+        return None, JSONResponse(
+            content={"object": "error", "message": str(e), "type": "BadRequestError", "param": None, "code": 400},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def _engine_request_id(request: ChatCompletionRequest, raw_request: Optional[Request]) -> str:
+    """id, под которым OpenAIServingChat (vLLM 0.10.1) отправит запрос в движок: X-Request-Id или request_id."""
+    base = raw_request.headers.get("X-Request-Id") if raw_request is not None else None
+    return f"chatcmpl-{base or request.request_id}"
+
+
+def _shareable(result: Any) -> bool:
+    """429 ведущего — его лимит, а не ответ модели: подписчики проходят допуск сами."""
+    return not (isinstance(result, Response) and result.status_code == status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _replica_name() -> str:
+    """Имя реплики для файлов отчета; вне Serve (локальный запуск) — по PID."""
+    try:
+        context = serve.get_replica_context()
+        return f"{context.deployment}-{context.replica_id.unique_id}"
+    except Exception:
+        return f"replica-{os.getpid()}"
+
+
 @serve.deployment(name="VLLMDeployment")  # Декоратор Ray Serve: регистрирует деплой с указанным именем
 @serve.ingress(app)  # Декоратор: подключает FastAPI-приложение как ingress для деплоя
 class VLLMDeployment:
@@ -90,16 +148,55 @@ class VLLMDeployment:
     OpenAI-совместимый слой поверх vLLM с инициализацией на GPU-акторе.
     Поддерживает V1-engine, тензор/пайплайн параллелизм через Ray backend.
     """
-    def __init__(
+    async def __init__(
             self,
             cli_args: Dict[str, Any],  # Словарь CLI-аргументов для vLLM
             chat_template: Optional[str] = None,  # Необязательный шаблон чата
+            autoscaler: Optional[DeploymentHandle] = None,  # LoadAutoscaler (AUTOSCALING_POLICY=load)
     ) -> None:
+        # Конструктор асинхронный: Ray Serve дожидается его завершения и только потом
+        # помечает реплику готовой, поэтому вся инициализация (включая прогрев) идет здесь.
         logger.info(f"[init] VLLMDeployment on actor, cli_args={cli_args}")  # Логируем запуск конструктора на акторе
+        # Таймлайн старта: фазы реплики + (если ядро движка логирует в этом процессе) этапы vLLM
+        self.startup = StartupTimeline(context={
+            "cli_args": cli_args,
+            "enforce_eager": cli_args.get("enforce-eager"),  # Без CUDA-графов — быстрее старт, медленнее декод
+            "max_seq_len_to_capture": cli_args.get("max-seq-len-to-capture"),  # Граница захвата CUDA-графов
+        })
+        self.startup.capture_vllm_logs()
+
+        with self.startup.phase("import_vllm"):
+            import vllm  # Первый импорт vLLM/torch в процессе реплики
+            from vllm.engine.arg_utils import AsyncEngineArgs  # Аргументы движка, создаваемые из CLI/конфига
+            from vllm.engine.async_llm_engine import AsyncLLMEngine  # Асинхронный фронт LLM для онлайн-сервинга
+            from vllm.v1.metrics.loggers import LoggingStatLogger  # Периодический лог throughput/KV в консоль
+
+        # Кеш разобранных аргументов (ENGINE_CACHE_DIR, общий том): реплики автоскейлинга не строят парсер заново;
+        # там же — кеш torch.compile vLLM, чтобы следующие реплики не компилировали граф с нуля.
+        cache_dir = os.environ.get("ENGINE_CACHE_DIR")
+        cache_key = engine_args_cache_key(cli_args, vllm.__version__)
+        if cache_dir:
+            os.environ.setdefault("VLLM_CACHE_ROOT", os.path.join(cache_dir, "vllm"))
+        cached = load_engine_args(cache_dir, cache_key) if cache_dir else None
+        self.startup.context["engine_args_cache"] = "hit" if cached else ("miss" if cache_dir else "disabled")
 
         # Парсим CLI уже НА акторе (где есть CUDA/ROCm), чтобы не упасть на драйвере.
-        parsed_args = parse_vllm_args(cli_args)  # Превращаем словарь в объект аргументов
-        engine_args: AsyncEngineArgs = AsyncEngineArgs.from_cli_args(parsed_args)  # Создаем EngineArgs из CLI
+        if cached is not None:
+            engine_args: AsyncEngineArgs = cached["engine_args"]
+            response_role, parsed_chat_template = cached["response_role"], cached["chat_template"]
+        else:
+            with self.startup.phase("parse_args"):
+                parsed_args = parse_vllm_args(cli_args)  # Превращаем словарь в объект аргументов
+            with self.startup.phase("engine_args_from_cli"):
+                engine_args = AsyncEngineArgs.from_cli_args(parsed_args)  # Создаем EngineArgs из CLI
+            response_role = getattr(parsed_args, "response_role", "assistant")
+            parsed_chat_template = getattr(parsed_args, "chat_template", None)
+            if cache_dir:
+                save_engine_args(cache_dir, cache_key, {
+                    "engine_args": engine_args,
+                    "response_role": response_role,
+                    "chat_template": parsed_chat_template,
+                })
 
         # Для PP>1 обязателен Ray backend; при PP=1 тоже безопасно держать worker_use_ray=True.
         if getattr(engine_args, "pipeline_parallel_size", 1) and engine_args.pipeline_parallel_size > 1:
@@ -109,26 +206,106 @@ class VLLMDeployment:
             engine_args.worker_use_ray = True  # На единичном PP все равно используем Ray-воркеры (безопасно)
 
         self.engine_args = engine_args  # Сохраняем EngineArgs для последующего использования
-        self.response_role = getattr(parsed_args, "response_role", "assistant")  # Роль сообщения по умолчанию
-        self.chat_template = chat_template or getattr(parsed_args, "chat_template", None) or os.environ.get("CHAT_TEMPLATE")  # Определяем шаблон чата
+        self.response_role = response_role  # Роль сообщения по умолчанию
+        self.chat_template = chat_template or parsed_chat_template or os.environ.get("CHAT_TEMPLATE")  # Определяем шаблон чата
         self.model_name = cli_args.get("model_name")  # Имя модели, под которым публикуем в /v1/models (если задано)
 
-        # vLLM движок (асинхронный фронт)
-        self.engine = AsyncLLMEngine.from_engine_args(engine_args)  # Инициализируем асинхронный LLM-движок
+        # vLLM движок (асинхронный фронт): загрузка весов, профилирование KV-кеша, torch.compile, захват CUDA-графов
+        self.load_stats = EngineLoadStats()  # running/waiting, KV-кеш и токены/с из stat logger движка
+        with self.startup.phase("engine_init"):
+            self.engine = AsyncLLMEngine.from_engine_args(  # Инициализируем асинхронный LLM-движок
+                engine_args,
+                # Свой список заменяет консольный логгер vLLM (Prometheus остается), поэтому возвращаем его явно
+                stat_loggers=[LoggingStatLogger, make_stat_logger_factory(self.load_stats)],
+            )
 
-        # OpenAI-совместимые обёртки (лениво)
-        self.openai_serving_models: Optional[OpenAIServingModels] = None  # Поздняя инициализация менеджера моделей
-        self.openai_serving_chat: Optional[OpenAIServingChat] = None  # Поздняя инициализация чат-обработчика
+        # OpenAI-совместимые обёртки: строятся ниже в _startup(), до готовности реплики
+        self.openai_serving_models: Optional[OpenAIServingModels] = None  # Менеджер моделей
+        self.openai_serving_chat: Optional[OpenAIServingChat] = None  # Чат-обработчик
+        self._serving_lock = asyncio.Lock()  # Защищает от двойного построения обёрток конкурентными корутинами
+
+        # Допуск запросов: token bucket на пользователя/роль, WFQ-очередь, приоритеты vLLM по ролям
+        max_num_seqs = int(cli_args.get("max-num-seqs", 128))
+        self.admission = AdmissionController.from_env(default_max_inflight=max_num_seqs)
+        self.admission_default_max_tokens = int(os.environ.get("ADMISSION_DEFAULT_MAX_TOKENS", "512"))  # Если max_tokens не задан
+        # Бюджет токенов: токенизатор и max_model_len движка привязываются в _initialize_serving_chat
+        self.budget = TokenBudget.from_env()  # TOKEN_BUDGET_STRATEGY=reject|drop_oldest|keep_system_last_n|off
+        # Приоритет запроса vLLM принимает только при --scheduling-policy priority (иначе — ошибка валидации)
+        self.priority_scheduling = cli_args.get("scheduling-policy") == "priority"
+        # LoRA-адаптеры из LORA_ADAPTERS/LORA_ADAPTERS_FILE; одновременно в движке — столько, сколько держит его CPU-кеш
+        self.adapters = AdapterRegistry.from_env(
+            default_max_resident=int(cli_args.get("max-cpu-loras") or cli_args.get("max-loras") or 1)
+        )
+        self.response_cache = ResponseCache.from_env()  # None, если RESPONSE_CACHE не задан
+        self.single_flight = SingleFlight.from_env()  # None при SINGLE_FLIGHT=0
+        self.stream_settings = StreamSettings.from_env()  # SSE_COALESCE_MS / SSE_SLOW_CLIENT_TIMEOUT_S; по умолчанию выкл.
+        # Пакетные задания: в движке одновременно до max-num-seqs запросов, результаты — на диск в BATCH_DIR
+        self.batches = BatchManager.from_env(self._batch_request, default_max_inflight=max_num_seqs)
+        # Дренаж: генерации в работе, срок DRAIN_DEADLINE_S, затем abort оставшихся в движке
+        self.drain = DrainController.from_env(abort=self.engine.abort)
+        self.drain.on_begin(self.batches.stop)  # Пакетные задания продолжит другая реплика
+        self.autoscaler = autoscaler  # Получает снимки load_stats; число реплик меняет он
 
         logger.info("[init] vLLM AsyncLLMEngine initialized")  # Подтверждаем успешную инициализацию движка
+        await self._startup()  # Строим обёртки и прогреваем шаблон/токенизатор
+
+    async def _startup(self) -> None:
+        """
+        Стадия старта реплики: один раз строит OpenAIServingModels/OpenAIServingChat
+        и, если задан WARMUP_REQUESTS, прогоняет синтетические запросы, чтобы шаблон чата
+        скомпилировался, а токенизатор загрузился до первого пользовательского запроса.
+        """
+        with self.startup.phase("serving_objects"):
+            await self._initialize_serving_chat()  # Строим обёртки под блокировкой
+
+        warmup_requests = int(os.environ.get("WARMUP_REQUESTS", "0"))  # Число синтетических запросов прогрева
+        if warmup_requests > 0:
+            with self.startup.phase("warmup"):
+                await self._warmup(warmup_requests)
+
+        self.batches.resume()  # Незавершенные пакетные задания (после рестарта реплики)
+        self._batch_watch = asyncio.get_running_loop().create_task(
+            self.batches.watch(float(os.environ.get("BATCH_RESUME_INTERVAL_S", "30")))
+        )  # Подхват заданий упавших реплик (при общем BATCH_DIR)
+
+        self.drain.install_signal_handler()  # SIGTERM → дренаж (если процесс позволяет)
+        self._drain_watch = asyncio.get_running_loop().create_task(self.drain.watch_trigger())  # DRAIN_TRIGGER_FILE
+        if self.autoscaler is not None:
+            self._load_reports = asyncio.get_running_loop().create_task(self._report_load())
+
+        self.startup.stop_capture()
+        report_path = self.startup.write(_replica_name())  # JSON-отчет по фазам (STARTUP_REPORT_DIR)
+        logger.info(f"[startup] replica ready, timings: {self.startup.summary()} (report: {report_path})")  # Отчет по этапам старта
+
+    async def _warmup(self, num_requests: int) -> None:
+        """Прогоняет короткие чат-запросы через OpenAIServingChat; ошибки прогрева не валят реплику."""
+        from vllm.entrypoints.openai.protocol import ChatCompletionRequest, ErrorResponse
+
+        prompt = os.environ.get("WARMUP_PROMPT", "Hello")  # Текст синтетического запроса
+        max_tokens = int(os.environ.get("WARMUP_MAX_TOKENS", "1"))  # Достаточно одного токена
+        for i in range(num_requests):
+            request = ChatCompletionRequest(
+                model=self.model_name or self.engine_args.model,  # Публикуемое имя модели
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=False,
+            )
+            try:
+                result = await self.openai_serving_chat.create_chat_completion(request, None)  # raw_request не нужен
+                if isinstance(result, ErrorResponse):
+                    logger.warning(f"[startup] warm-up request {i} returned error: {result.message}")
+            except Exception as e:
+                logger.warning(f"[startup] warm-up request {i} failed: {e}")  # Логируем и продолжаем
 
     async def _build_openai_models(self) -> OpenAIServingModels:
         """
         Создаёт OpenAIServingModels с базовыми моделями.
         В vLLM 0.10.1.* сигнатура: (engine_client, model_config, base_model_paths)
+        Вызывается под self._serving_lock (из _initialize_serving_chat).
         """
         if self.openai_serving_models:
             return self.openai_serving_models  # Если уже создан — возвращаем кеш
+        from vllm.entrypoints.openai.serving_models import BaseModelPath, OpenAIServingModels
 
         model_config = await self.engine.get_model_config()  # Получаем конфигурацию модели с воркеров
 
@@ -153,6 +330,7 @@ class VLLMDeployment:
             model_config=model_config,  # Конфиг модели (dtype, контекст, т.д.)
             base_model_paths=base_model_paths,  # Набор опубликованных имен и путей
         )
+        self.adapters.bind(self.openai_serving_models, self.engine)  # Адаптеры грузятся через менеджер моделей
 
         # Если у OpenAIServingModels есть готовый FastAPI-router,
         # то добавим его — это даст /v1/models и (при VLLM_ALLOW_RUNTIME_LORA_UPDATING=1)
@@ -167,22 +345,42 @@ class VLLMDeployment:
         return self.openai_serving_models  # Возвращаем инициализированный менеджер
 
     async def _initialize_serving_chat(self) -> None:
-        """Лениво создаём OpenAIServingChat поверх Engine + Models."""
+        """
+        Создаём OpenAIServingChat поверх Engine + Models.
+        Штатно вызывается из _startup(); в обработчиках остается страховкой и ничего не делает.
+        """
         if self.openai_serving_chat is not None:
-            return  # Если уже инициализировали — выходим
-        model_config = await self.engine.get_model_config()  # Конфиг модели (для совместимости и валидации)
-        models = await self._build_openai_models()  # Убеждаемся, что менеджер моделей существует
-
-        self.openai_serving_chat = OpenAIServingChat(
-            engine_client=self.engine,  # Асинхронный клиент движка
-            model_config=model_config,  # Конфигурация модели
-            models=models,  # Менеджер моделей (псевдонимы, LoRA и т.д.)
-            response_role=self.response_role,  # Роль сообщений по умолчанию ("assistant")
-            request_logger=None,  # Логгер запросов не используем (можно внедрить при необходимости)
-            chat_template=self.chat_template,  # Пользовательский шаблон форматирования чата (если задан)
-            chat_template_content_format="auto",  # Авто-детект формата шаблона
-        )
-        logger.info("OpenAIServingChat initialized")  # Подтверждаем готовность чат-обработчика
+            return  # Быстрый путь без блокировки
+        async with self._serving_lock:
+            if self.openai_serving_chat is not None:
+                return  # Пока ждали блокировку, обёртку уже построили
+            from vllm.entrypoints.openai.serving_chat import OpenAIServingChat
+            model_config = await self.engine.get_model_config()  # Конфиг модели (для совместимости и валидации)
+            models = await self._build_openai_models()  # Убеждаемся, что менеджер моделей существует
+            # Тот же токенизатор, что у движка: подсчет токенов бюджета совпадает с его проверкой длины
+            self.budget.bind(await self.engine.get_tokenizer(), model_config.max_model_len)
+
+            self.openai_serving_chat = OpenAIServingChat(
+                engine_client=self.engine,  # Асинхронный клиент движка
+                model_config=model_config,  # Конфигурация модели
+                models=models,  # Менеджер моделей (псевдонимы, LoRA и т.д.)
+                response_role=self.response_role,  # Роль сообщений по умолчанию ("assistant")
+                request_logger=None,  # Логгер запросов не используем (можно внедрить при необходимости)
+                chat_template=self.chat_template,  # Пользовательский шаблон форматирования чата (если задан)
+                chat_template_content_format="auto",  # Авто-детект формата шаблона
+            )
+            logger.info("OpenAIServingChat initialized")  # Подтверждаем готовность чат-обработчика
+
+    async def _report_load(self) -> None:
+        """Снимок нагрузки движка → LoadAutoscaler раз в AUTOSCALE_INTERVAL_S; реплика в дренаже отчеты прекращает."""
+        name = _replica_name()
+        interval_s = float(os.environ.get("AUTOSCALE_INTERVAL_S", "10"))
+        while not self.drain.draining:
+            try:
+                await self.autoscaler.report.remote(name, self.load_stats.snapshot())
+            except Exception as e:
+                logger.warning(f"[autoscale] load report failed: {e}")
+            await asyncio.sleep(interval_s)
 
     # -------------------------
     # Аутентификация
@@ -192,60 +390,219 @@ class VLLMDeployment:
             self,
             form_data: OAuth2PasswordRequestForm = Depends()  # Зависимость: форма OAuth2 (username/password)
     ) -> TokenResponse:
-        user = authenticate_user(form_data.username, form_data.password)  # Проверяем учетные данные
+        user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password)  # Хэш считаем в пуле потоков
         if not user:
             raise HTTPException(  # Если аутентификация неуспешна — 401
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password"
             )
-        expire_minutes = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))  # TTL токена из ENV
-        expire = timedelta(minutes=expire_minutes)  # Длительность жизни токена
-        token_data = {"sub": user["username"], "role": user["role"]}  # Полезная нагрузка для JWT
-        access_token = create_access_token(token_data, expire)  # Подписываем JWT
-        return {"access_token": access_token, "token_type": "bearer"}  # Возвращаем стандартную форму ответа
+        return issue_tokens(user)  # access (TTL из ACCESS_TOKEN_EXPIRE_MINUTES) + refresh
+
+    @app.post("/token/refresh", response_model=TokenResponse)  # Новая пара токенов без повторного ввода пароля
+    async def refresh_access_token(self, body: RefreshRequest) -> TokenResponse:
+        return refresh_tokens(body.refresh_token)  # 401, если пользователь удален или сменил пароль
 
     # -------------------------
     # OpenAI совместимые endpoint
     # -------------------------
+    async def _serve_chat_completion(
+            self,
+            request: ChatCompletionRequest,
+            raw_request: Optional[Request],
+            timer: Optional[RequestTimer] = None,  # Замеры стадий; для вызовов через хендл создаем свой
+            payload: Optional[Dict[str, Any]] = None,  # Проверенный JWT (sub/role) — для лимитов и приоритета
+            headers: Optional[Dict[str, str]] = None,  # Заголовки клиента от PrefixRouter, когда raw_request нет
+    ) -> Response:
+        """
+        Общий путь обоих chat-эндпоинтов.
+        Неблокирующий ответ движка сериализуется один раз через model_dump_json (pydantic-core),
+        без промежуточных dict и повторного json.dumps; id/created берутся из ответа движка.
+        Перед генерацией запрос проходит допуск (AdmissionController): слот держится до конца ответа/стрима.
+        Попадание в кеш ответов отдается до допуска — в движок такой запрос не идет.
+        Самым первым запрос проходит бюджет токенов (TokenBudget): слишком длинный отклоняется с 400 до токенизации в движке.
+        Детерминированный запрос, такой же как уже генерируемый, в движок не идет: SingleFlight отдает ему ответ той генерации.
+        """
+        timer = timer or RequestTimer("routed")
+        if timer.role == "unknown" and payload:  # PrefixRouter и пакетные задания: роль из проверенного JWT
+            timer.role = payload.get("role", "unknown")
+        streaming = False
+        try:
+            if raw_request is not None:
+                headers = raw_request.headers
+            elif headers and headers.get("x-request-id"):
+                # Без raw_request vLLM берет id из тела: тот же chatcmpl-<X-Request-Id> для дренажа и abort
+                request.request_id = headers["x-request-id"]
+            with timer.stage("budget"):
+                budget = await self.budget.apply(request)  # Может усечь messages и урезать max_tokens на месте
+            if budget.error is not None:  # Не поместится в контекст даже после усечения — 400 до движка
+                return JSONResponse(
+                    content={"object": "error", "message": budget.error, "type": "BadRequestError", "param": None,
+                             "code": status.HTTP_400_BAD_REQUEST},
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                )
+
+            cache_key: Optional[str] = None  # Ключ для сохранения ответа; None — не кешируем
+            if self.response_cache is not None:
+                with timer.stage("cache"):
+                    read, write = self.response_cache.policy(timer.endpoint, headers)
+                    key = self.response_cache.key(request, self.chat_template) if write else None
+                    if key is None:
+                        self.response_cache.count(timer.endpoint, "bypass")
+                    cached = await self.response_cache.lookup(key, request, timer.endpoint) if key and read else None
+                if cached is not None:
+                    return cached
+                cache_key = key
+
+            apply_prefix_cache_opt_out(request, headers)  # X-Prefix-Cache: off → свой cache_salt
+
+            def generate() -> Awaitable[Any]:
+                return self._generate_chat_completion(request, raw_request, timer, payload, budget.prompt_tokens, cache_key)
+
+            flight_key = self.single_flight.key(request, self.chat_template) if self.single_flight is not None else None
+            if flight_key is not None:  # Одна генерация на все одинаковые запросы в работе
+                result = await self.single_flight.run(flight_key, generate, _shareable)
+            else:
+                result = await generate()
+            if isinstance(result, Response):  # Ошибка или готовый неблокирующий ответ
+                return result
+            settings = self.stream_settings.for_request(headers)
+            stream = coalesce(result, settings)  # Без настроек — прозрачный проход
+            streaming = True  # Дальше total фиксирует wrap_stream по окончании стрима
+            return StreamingResponse(timer.wrap_stream(stream), media_type="text/event-stream")  # SSE + замеры ttfc/stream
+        finally:
+            if not streaming:  # Готовый ответ, ошибка или исключение — total тоже учитываем
+                timer.finish()
+
+    async def _generate_chat_completion(
+            self,
+            request: ChatCompletionRequest,
+            raw_request: Optional[Request],
+            timer: RequestTimer,
+            payload: Optional[Dict[str, Any]],
+            prompt_tokens: Optional[int],  # Оценка промпта из TokenBudget
+            cache_key: Optional[str],  # Ключ для сохранения ответа в кеш; None — не кешируем
+    ) -> Any:
+        """
+        Допуск, адаптер и генерация одного запроса в движке.
+        Возвращает Response (ошибка или готовый неблокирующий ответ) либо SSE-поток до склейки и замеров:
+        при SingleFlight поток читают все подписчики, а склейку и ttfc каждый клиент получает свои.
+        """
+        from vllm.entrypoints.openai.protocol import ChatCompletionResponse, ErrorResponse
+
+        user = (payload or {}).get("sub", "anonymous")  # Ключ справедливой очереди
+        role = (payload or {}).get("role", "unknown")
+        cost = estimate_cost(request.messages, request.max_completion_tokens or request.max_tokens,
+                             self.admission_default_max_tokens, prompt_tokens)  # Промпт + max_tokens
+        try:
+            with timer.stage("admission"):
+                ticket = await self.admission.acquire(user, role, cost)  # Ждем слот в WFQ-очереди
+        except AdmissionRejected as e:
+            logger.info(f"Admission rejected user={user} role={role}: {e.reason}")
+            return JSONResponse(
+                content={"error": e.reason},
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},  # Целые секунды, не меньше 1
+            )
+
+        priority = self.admission.priority_for(role)
+        if self.priority_scheduling and priority is not None and not request.priority:
+            request.priority = priority  # Явно заданный клиентом приоритет не переопределяем
+
+        try:
+            with timer.stage("adapter"):
+                adapter = await self.adapters.acquire(request.model)  # LoRA по имени модели; None — базовая модель
+        except AdapterLoadError as e:
+            self.admission.release(ticket)
+            return JSONResponse(
+                content={"object": "error", "message": e.message, "type": "BadRequestError", "param": None, "code": e.code},
+                status_code=e.code,
+            )
+        except BaseException:
+            self.admission.release(ticket)
+            raise
+
+        request_id = _engine_request_id(request, raw_request)
+        self.drain.track(request_id, bool(request.stream))  # Учет для дренажа; при abort — по этому id
+
+        def release() -> None:
+            self.admission.release(ticket)
+            self.adapters.release(adapter)  # Адаптер снова можно вытеснить
+            self.drain.finish(request_id)
+
+        try:
+            with timer.stage("init"):
+                await self._initialize_serving_chat()  # Обёртки уже построены на старте; здесь — no-op
+            with timer.stage("create"):
+                generator = await self.openai_serving_chat.create_chat_completion(request, raw_request)  # Запускаем генерацию
+        except BaseException:
+            release()  # Исключение или отмена — слот возвращаем сразу
+            raise
+
+        if isinstance(generator, ErrorResponse):  # Ошибка vLLM OpenAI-совместимого формата
+            release()
+            if self.drain.was_aborted(request_id):
+                return self._drain_response()
+            return JSONResponse(content=generator.model_dump(), status_code=generator.code)  # Отдаем как есть
+
+        if request.stream:  # Если клиент запросил stream-ответ (SSE)
+            stream = self.admission.guard_stream(generator, ticket)  # Слот освобождается по окончании стрима
+            stream = self.adapters.guard_stream(stream, adapter)  # Адаптер закреплен до конца стрима
+            stream = self.drain.guard_stream(stream, request_id)  # Запрос активен до конца стрима
+            if cache_key is not None:
+                stream = self.response_cache.record_stream(stream, cache_key, timer.endpoint)  # Собираем ответ для кеша
+            return stream
+
+        release()  # Неблокирующая генерация уже завершена
+        if self.drain.was_aborted(request_id):  # Снят по сроку дренажа — не отдаем обрезанный ответ
+            return self._drain_response()
+        assert isinstance(generator, ChatCompletionResponse)  # В неблокирующем режиме — это финальный объект ответа
+        body = generator.model_dump_json()  # Готовые байты JSON
+        if cache_key is not None:
+            await self.response_cache.store(cache_key, body, timer.endpoint)
+        return Response(content=body, media_type="application/json")
+
+    @staticmethod
+    def _drain_response() -> JSONResponse:
+        """
+        503 от дренируемой реплики: PrefixRouter по X-Drain повторяет запрос на другой реплике,
+        прямой клиент (без роутера) — по Retry-After.
+        """
+        return JSONResponse(
+            content={"error": "Replica is draining"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1", DRAIN_HEADER: "1"},
+        )
+
+    async def __del__(self) -> None:
+        """
+        Хук остановки Serve: вызывается после ожидания запросов в работе (graceful_shutdown_timeout_s).
+        Дренаж доводит оставшиеся до срока и снимает их с движка, а не обрывает вместе с процессом.
+        """
+        drain = getattr(self, "drain", None)  # __init__ мог упасть раньше
+        if drain is not None:
+            await drain.wait("serve shutdown")
+
     @app.post("/v1/tasks/auto/completions")
     async def auto_completions(
             self,
-            request_body: ChatCompletionRequest,  # Запрос в формате OpenAI Chat Completions
+            request_body: Dict[str, Any],  # Запрос в формате OpenAI Chat Completions (валидируется в parse_chat_request)
             raw_request: Request,  # Оригинальный Request (может использоваться для логирования/метрик)
             credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())  # Извлекаем Bearer токен из заголовка
     ) -> Any:
-        payload = verify_jwt_token(credentials)  # Декодируем/проверяем JWT
+        timer = RequestTimer("/v1/tasks/auto/completions")  # Отсчет времени запроса
+        with timer.stage("auth"):
+            payload = verify_jwt_token(credentials)  # Декодируем/проверяем JWT
+            timer.role = payload.get("role", "unknown")  # Метка роли для гистограмм
         check_role(payload, "admin")  # Ограничиваем доступ по роли ("admin")
         logger.info(f"/v1/tasks/auto/completions by user={payload.get('sub')}")  # Логируем инициатора
+        if self.drain.draining:  # Новые запросы дренируемая реплика не берет и без PrefixRouter
+            self.drain.reject()
+            return self._drain_response()  # 503 + Retry-After: клиент повторит, Serve-прокси выберет другую реплику
+        request, error = parse_chat_request(request_body)
+        if error is not None:
+            return error  # 400: тело не проходит схему ChatCompletionRequest
         try:
-            await self._initialize_serving_chat()  # Лениво инициализируем OpenAIServingChat
-            generator = await self.openai_serving_chat.create_chat_completion(request_body, raw_request)  # Создаем комплишн
-
-            if isinstance(generator, ErrorResponse):  # Если вернулась ошибка vLLM OpenAI-совместимого формата
-                return JSONResponse(content=generator.model_dump(), status_code=generator.code)  # Отдаем как есть
-
-            if request_body.stream:  # Если клиент запросил stream-ответ (SSE)
-                return StreamingResponse(generator, media_type="text/event-stream")  # Проксируем генератор в SSE
-
-            assert isinstance(generator, ChatCompletionResponse)  # В неблокирующем режиме — это финальный объект ответа
-            choices = [{  # Приводим к упрощенному формату (совместимо с OpenAI объектом choices)
-                "index": c.index,
-                "message": {"role": c.message.role, "content": c.message.content},
-                "finish_reason": c.finish_reason,
-            } for c in generator.choices]
-
-            return JSONResponse(content={  # Собираем финальный JSON-ответ
-                "id": f"chatcmpl-{datetime.now().timestamp()}",  # Генерируем уникальный id ответа
-                "object": "chat.completion",  # Тип объекта OpenAI
-                "created": int(datetime.now().timestamp()),  # Временная метка создания
-                "model": (self.model_name or self.engine_args.model),  # Имя опубликованной модели
-                "choices": choices,  # Список вариантов ответа
-                "usage": {  # Метрики токенов
-                    "prompt_tokens": generator.usage.prompt_tokens,
-                    "completion_tokens": generator.usage.completion_tokens,
-                    "total_tokens": generator.usage.total_tokens,
-                },
-            })
+            return await self._serve_chat_completion(request, raw_request, timer, payload)  # Общий путь генерации
         except Exception as e:
             logger.error(f"Error in auto completions: {e}", exc_info=True)  # Логируем стек при ошибке
             raise HTTPException(status_code=500, detail=str(e))  # Возвращаем 500 в случае исключения
@@ -253,46 +610,156 @@ class VLLMDeployment:
     @app.post("/v1/chat/completions")  # Классический OpenAI-совместимый маршрут chat.completions
     async def create_chat_completion(
             self,
-            request: ChatCompletionRequest,  # Входной запрос OpenAI формата
+            request_body: Dict[str, Any],  # Входной запрос OpenAI формата (валидируется в parse_chat_request)
             raw_request: Request,  # Низкоуровневый Request (для логирования и пр.)
             credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())  # Авторизация Bearer-токеном
     ) -> Any:
-        payload = verify_jwt_token(credentials)  # Проверяем и декодируем JWT
+        timer = RequestTimer("/v1/chat/completions")  # Отсчет времени запроса
+        with timer.stage("auth"):
+            payload = verify_jwt_token(credentials)  # Проверяем и декодируем JWT
+            timer.role = payload.get("role", "unknown")  # Метка роли для гистограмм
         check_role(payload, "admin")  # Проверяем, что роль имеет доступ
         logger.info(f"/v1/chat/completions by user={payload.get('sub')} role={payload.get('role')}")  # Логируем контекст
+        if self.drain.draining:  # Новые запросы дренируемая реплика не берет и без PrefixRouter
+            self.drain.reject()
+            return self._drain_response()  # 503 + Retry-After: клиент повторит, Serve-прокси выберет другую реплику
+        request, error = parse_chat_request(request_body)
+        if error is not None:
+            return error  # 400: тело не проходит схему ChatCompletionRequest
         try:
-            await self._initialize_serving_chat()  # Инициализация OpenAIServingChat по требованию
-            generator = await self.openai_serving_chat.create_chat_completion(request, raw_request)  # Запускаем генерацию
-
-            if isinstance(generator, ErrorResponse):  # Обработка ошибок OpenAI-совместимого уровня
-                return JSONResponse(content=generator.model_dump(), status_code=generator.code)  # Возвращаем ошибку как есть
-
-            if request.stream:  # Если запрошен потоковый ответ
-                return StreamingResponse(generator, media_type="text/event-stream")  # SSE-стрим без буферизации
-
-            assert isinstance(generator, ChatCompletionResponse)  # В неблокирующем режиме ожидаем финальный объект
-            choices = [{  # Преобразуем choices к простому словарю
-                "index": c.index,
-                "message": {"role": c.message.role, "content": c.message.content},
-                "finish_reason": c.finish_reason,
-            } for c in generator.choices]
-
-            return JSONResponse(content={  # Возвращаем OpenAI-совместимое тело ответа
-                "id": f"chatcmpl-{datetime.now().timestamp()}",
-                "object": "chat.completion",
-                "created": int(datetime.now().timestamp()),
-                "model": (self.model_name or self.engine_args.model),
-                "choices": choices,
-                "usage": {
-                    "prompt_tokens": generator.usage.prompt_tokens,
-                    "completion_tokens": generator.usage.completion_tokens,
-                    "total_tokens": generator.usage.total_tokens,
-                },
-            })
+            return await self._serve_chat_completion(request, raw_request, timer, payload)  # Общий путь генерации
         except Exception as e:
             logger.error(f"Error in chat completion: {str(e)}", exc_info=True)  # Логируем исключение с трассировкой
             return JSONResponse(content={"error": str(e)}, status_code=500)  # Возвращаем 500-ошибку в JSON
 
+    # -------------------------
+    # Пакетные задания (OpenAI Batch API): без HTTP/JWT/SSE на каждый запрос
+    # -------------------------
+    async def _batch_request(self, body: Dict[str, Any], owner: str) -> Tuple[int, bytes, Dict[str, str]]:
+        """Одна строка задания: тот же путь, что у HTTP-запроса (кеш, допуск с ролью batch), но без стрима."""
+        request, error = parse_chat_request({**body, "stream": False})
+        if error is not None:
+            return error.status_code, error.body, {}
+        response = await self._serve_chat_completion(
+            request, None, RequestTimer("/v1/batches"), {"sub": owner, "role": "batch"}
+        )
+        return response.status_code, response.body, dict(response.headers)
+
+    def _owned_batch(self, batch_id: str, owner: Optional[str]) -> Optional[BatchJob]:
+        """Задание владельца; чужое — как несуществующее (404), как и в списке list_batches."""
+        job = self.batches.get(batch_id)
+        return job if job is not None and job.owner == owner else None
+
+    @app.post("/v1/batches")  # Загрузка JSONL: {"custom_id", "body": ChatCompletionRequest} на строку
+    async def create_batch(
+            self,
+            file: UploadFile = File(...),
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        try:
+            job = self.batches.create(await file.read(), owner=payload.get("sub", "anonymous"))
+        except BatchInputError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return JSONResponse(content=job.to_dict())
+
+    @app.get("/v1/batches")
+    async def list_batches(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        jobs = self.batches.list_jobs(owner=payload.get("sub"))
+        return JSONResponse(content={"object": "list", "data": [j.to_dict() for j in jobs]})
+
+    @app.get("/v1/batches/{batch_id}")  # Статус, счетчики и токены/с
+    async def get_batch(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        job = self._owned_batch(batch_id, payload.get("sub"))
+        if job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+        return JSONResponse(content=job.to_dict())
+
+    @app.get("/v1/batches/{batch_id}/output")  # Результаты (готовые на момент запроса) в JSONL
+    async def get_batch_output(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        path = self.batches.output_path(batch_id) if self._owned_batch(batch_id, payload.get("sub")) else None
+        if path is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch output not found")
+        return FileResponse(path, media_type="application/jsonl", filename=f"{batch_id}_output.jsonl")
+
+    @app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(
+            self,
+            batch_id: str,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        payload = verify_jwt_token(credentials)
+        check_role(payload, "admin")
+        if self._owned_batch(batch_id, payload.get("sub")) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+        return JSONResponse(content=self.batches.cancel(batch_id).to_dict())
+
+    @app.get("/v1/cache/stats")  # Статистика кеша ответов реплики (hit rate, объем)
+    async def cache_stats(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=self.response_cache.stats() if self.response_cache else {"enabled": False})
+
+    @app.get("/v1/admission/stats")  # Допуск реплики: слоты в работе, очередь, отказы по лимиту скорости и очереди
+    async def admission_stats(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=self.admission.stats())
+
+    @app.get("/startup")  # Таймлайн холодного старта реплики (фазы, vLLM-этапы, попадание в кеш аргументов)
+    async def startup_report(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=self.replica_report("startup"))
+
+    @app.get("/v1/engine/features")  # Prefix caching / спекулятивное декодирование: настройки и их эффект
+    async def engine_features(
+            self,
+            credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+    ) -> Any:
+        verify_jwt_token(credentials)
+        return JSONResponse(content=self.replica_report("engine_features"))
+
+    @app.get("/ready")  # Готовность реплики: 503 во время дренажа (для проверок и preStop-скриптов)
+    async def ready(self) -> Any:
+        stats = self.replica_report("ready")
+        return JSONResponse(content=stats, status_code=200 if stats["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @app.get("/metrics")  # Prometheus: гистограммы стадий + метрики vLLM из общего реестра
+    async def metrics(self) -> Response:
+        """
+        Реестр этой реплики. Serve-прокси отдает /metrics случайной реплики: при num_replicas > 1 (автоскейлинг)
+        один scrape видит только ее серии, а счетчики соседних скачут. Сводные метрики всех реплик с меткой
+        replica отдает PrefixRouter (NUM_ROUTED_REPLICAS > 1). Встроенные метрики Serve (ray_serve_*, с метками
+        deployment/replica) Ray экспортирует с каждого узла на metrics-export-port — их скрейпят по подам.
+        """
+        body, content_type = render_latest()
+        return Response(content=body, media_type=content_type)
+
     @app.get("/v1/models")  # OpenAI-совместимый список моделей (дополняет/дублирует router от OpenAIServingModels)
     async def get_models(
             self,
@@ -300,16 +767,88 @@ class VLLMDeployment:
     ) -> Any:
         payload = verify_jwt_token(credentials)  # Верификация JWT
         logger.info(f"/v1/models by user={payload.get('sub')} role={payload.get('role')}")  # Логируем запрос
-        # /v1/models уже отдаёт OpenAIServingModels.router, но оставим простой ответ совместимый с твоей логикой
-        active_name = self.model_name or self.engine_args.model  # Определяем активное имя модели
-        if not active_name:
-            return JSONResponse(content={"object": "list", "data": []})  # Если имя не задано — пустой список
-        return JSONResponse(content={  # Возвращаем список из одной модели
-            "object": "list",
-            "data": [
-                {"id": active_name, "object": "model", "owned_by": "owner", "permission": []}
-            ]
-        })
+        return JSONResponse(content=await self.list_models())  # Тело общее с PrefixRouter
+
+    # -------------------------
+    # Вызовы через DeploymentHandle (PrefixRouter), минуя HTTP и JWT — их проверяет роутер
+    # -------------------------
+    async def list_models(self) -> Dict[str, Any]:
+        """
+        Живой набор: базовые модели и адаптеры, загруженные в OpenAIServingModels (в т.ч. через
+        /v1/load_lora_adapter), плюс адаптеры реестра со статусом loaded/available.
+        """
+        await self._initialize_serving_chat()
+        cards = (await self.openai_serving_models.show_available_models()).model_dump()["data"]
+        base = next((c["id"] for c in cards if c.get("parent") is None), None)
+        data = [c for c in cards if c["id"] not in self.adapters] + self.adapters.model_cards(parent=base)
+        return {"object": "list", "data": data}
+
+    async def routed_chat_completion(
+            self,
+            body: Dict[str, Any],
+            payload: Optional[Dict[str, Any]] = None,  # JWT, проверенный роутером (для лимитов и приоритета)
+            headers: Optional[Dict[str, str]] = None,  # Управляющие заголовки клиента (router.FORWARDED_HEADERS)
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Стриминговый метод для PrefixRouter: первым элементом отдаёт статус, media type и заголовки,
+        дальше — SSE-чанки либо готовое JSON-тело неблокирующего ответа.
+        """
+        request, response = parse_chat_request(body)
+        if self.drain.draining:
+            self.drain.reject()
+            request, response = None, self._drain_response()  # Роутер отправит запрос на другую реплику
+        if request is not None:
+            response = await self._serve_chat_completion(request, None, None, payload, headers)  # raw_request отсутствует
+        yield {  # Заголовок ответа
+            "status_code": response.status_code,
+            "media_type": response.media_type,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() in ("retry-after", "x-cache", DRAIN_HEADER.lower())},
+        }
+        if isinstance(response, StreamingResponse):
+            async for chunk in response.body_iterator:  # Проксируем SSE-чанки движка
+                yield chunk
+        else:
+            yield response.body  # Готовые байты JSON
+
+    async def routed_batch(self, op: str, owner: str, batch_id: Optional[str] = None,
+                           data: Optional[bytes] = None) -> Tuple[int, Any]:
+        """
+        Пакетные задания для PrefixRouter: (статус, JSON-ответ), для output — (200, байты JSONL).
+        JWT и роль проверяет роутер; owner — sub из токена, чужие задания не видны.
+        """
+        if op == "create":
+            try:
+                return 200, self.batches.create(data or b"", owner=owner).to_dict()
+            except BatchInputError as e:
+                return status.HTTP_400_BAD_REQUEST, {"detail": str(e)}
+        if op == "list":
+            return 200, {"object": "list", "data": [j.to_dict() for j in self.batches.list_jobs(owner=owner)]}
+        if self._owned_batch(batch_id, owner) is None:
+            return status.HTTP_404_NOT_FOUND, {"detail": "Batch not found"}
+        if op == "cancel":
+            return 200, self.batches.cancel(batch_id).to_dict()
+        if op == "output":
+            path = self.batches.output_path(batch_id)
+            if path is None:
+                return status.HTTP_404_NOT_FOUND, {"detail": "Batch output not found"}
+            return 200, await asyncio.to_thread(_read_bytes, path)
+        return 200, self.batches.get(batch_id).to_dict()
+
+    def replica_report(self, name: str) -> Any:
+        """Служебные отчеты реплики (и для своих HTTP-маршрутов, и для PrefixRouter): ready, startup, engine_features, metrics."""
+        if name == "ready":
+            return self.drain.stats()
+        if name == "startup":
+            return self.startup.report()
+        if name == "engine_features":
+            return {
+                "enable_prefix_caching": self.engine_args.enable_prefix_caching,
+                "speculative_config": self.engine_args.speculative_config,
+                **self.load_stats.features(),  # Сглаженные доли попаданий и принятых draft-токенов
+            }
+        if name == "metrics":
+            return render_latest()[0]
+        raise ValueError(f"Unknown replica report: {name}")
 
 
 # -------------------------
@@ -318,9 +857,54 @@ class VLLMDeployment:
 def build_app(cli_args: Dict[str, Any]) -> serve.Application:
     os.environ.setdefault("VLLM_ATTENTION_BACKEND", "FLASH_ATTN_VLLM_V1")  # Значение по умолчанию для бекенда внимания
     logger.info("Building Serve application (driver-side), vLLM init will happen on actor")  # Сообщаем, что инициализация vLLM будет на акторе
-    return VLLMDeployment.bind(  # Формируем граф Ray Serve без немедленной инициализации движка
+    logger.info(f"vLLM imported on driver: {'vllm' in sys.modules}")  # Должно быть False: vLLM/torch грузят только реплики
+    chat_template = os.environ.get("CHAT_TEMPLATE")  # Пробрасываем шаблон чата из ENV (если задан)
+    # Лимит одновременных запросов на реплику; по умолчанию — сколько последовательностей держит движок
+    # (дефолт Serve = 5 ставил бы запросы в очередь раньше планировщика vLLM)
+    deployment_options: Dict[str, Any] = {
+        "max_ongoing_requests": int(os.environ.get("MAX_ONGOING_REQUESTS", cli_args.get("max-num-seqs", 128))),
+        # Serve ждет запросы в работе до этого таймаута, затем убивает реплику (дефолт 20 с обрывал длинные стримы);
+        # запас над сроком дренажа — на abort оставшихся и закрытие их ответов
+        "graceful_shutdown_timeout_s": float(os.environ.get("DRAIN_DEADLINE_S", "300"))
+                                       + float(os.environ.get("DRAIN_ABORT_GRACE_S", "5")) + 10,
+    }
+
+    num_routed = int(os.environ.get("NUM_ROUTED_REPLICAS", "1"))  # >1 — ставим PrefixRouter перед N репликами
+    # none | load — LoadAutoscaler по очереди и KV-кешу движка (см. load_autoscaler.py)
+    autoscaling_policy = os.environ.get("AUTOSCALING_POLICY", "none").lower()
+    if autoscaling_policy not in ("none", "load"):
+        raise ValueError(f"AUTOSCALING_POLICY must be none or load, got {autoscaling_policy!r}")
+    if num_routed > 1 and autoscaling_policy != "none":  # У роутера ровно по одной реплике на деплой
+        raise ValueError("AUTOSCALING_POLICY cannot be combined with NUM_ROUTED_REPLICAS>1: "
+                         "the router addresses a fixed set of single-replica deployments")
+    if num_routed > 1:
+        from router import PrefixRouterIngress  # Импорт только в режиме роутера
+        replicas = [
+            VLLMDeployment.options(  # Отдельный деплой на реплику: роутер адресует ее явно
+                name=f"VLLMDeployment-{i}",
+                num_replicas=1,
+                **deployment_options,
+            ).bind(
+                cli_args=cli_args,
+                chat_template=chat_template,
+            )
+            for i in range(num_routed)
+        ]
+        logger.info(f"Prefix-aware routing over {num_routed} VLLMDeployment replicas")
+        return PrefixRouterIngress.bind(replicas)  # Ingress-роутер получает хендлы всех реплик
+
+    autoscaler = None
+    if autoscaling_policy == "load":
+        from autoscaling import AutoscalingSettings
+        from load_autoscaler import LoadAutoscaler  # Импорт только при автоскейлинге
+        deployment_options["num_replicas"] = AutoscalingSettings.from_env().min_replicas  # Дальше — LoadAutoscaler
+        autoscaler = LoadAutoscaler.bind("VLLMDeployment")
+        logger.info(f"Load-aware autoscaling enabled from {deployment_options['num_replicas']} replicas")
+
+    return VLLMDeployment.options(**deployment_options).bind(  # Формируем граф Ray Serve без немедленной инициализации движка
         cli_args=cli_args,  # Передаем конфигурацию CLI для vLLM
-        chat_template=os.environ.get("CHAT_TEMPLATE"),  # Пробрасываем шаблон чата из ENV (если задан)
+        chat_template=chat_template,
+        autoscaler=autoscaler,  # Хендл LoadAutoscaler или None
     )
 
 
@@ -338,37 +922,61 @@ def _required_env(name: str) -> str:
         raise RuntimeError(f"Environment variable {name} is required")  # Бросаем исключение, если переменная обязательна
     return os.environ[name]  # Возвращаем значение переменной окружения
 
-config: Dict[str, Any] = {
-    # Базовые
-    "model": _required_env("MODEL_ID"),  # Идентификатор/путь модели (обязателен)
-    "model_name": os.environ.get("MODEL_NAME"),  # Публикуемое имя модели в /v1/models (опционально)
-    "served-model-name": os.environ.get("SERVED_MODEL_NAME", os.environ.get("MODEL_NAME")),  # Альтернативное(ые) имя(мена) сервинга
-    # device можно не указывать — vLLM сам определит; если надо, добавь VLLM_DEVICE
-    "device": os.environ.get("VLLM_DEVICE", None),  # Принудительный выбор устройства ("cuda", "cpu", "rocm") при необходимости
-
-    # Параллелизм
-    "tensor-parallel-size": int(os.environ.get("TENSOR_PARALLELISM", "1")),  # Тензорный параллелизм (TP)
-    "pipeline-parallel-size": int(os.environ.get("PIPELINE_PARALLELISM", "1")),  # Параллелизм по конвейеру (PP)
-
-    # Память/DTYPE/KV-cache
-    "gpu-memory-utilization": os.environ.get("GPU_MEMORY_UTIL", "0.97"),  # Доля GPU-памяти, доступной движку
-    "dtype": os.environ.get("DTYPE", "auto"),  # Тип тензоров (auto/bfloat16/float16/float32 и т.д.)
-    "kv-cache-dtype": os.environ.get("KV_CACHE_DTYPE", "auto"),  # Тип KV-кеша (влияет на память/скорость)
-
-    # Размерности и батчинг
-    "max-model-len": int(os.environ.get("MAX_MODEL_LEN", "4096")),  # Максимальная длина контекста модели
-    "max-num-seqs": int(os.environ.get("MAX_NUM_SEQS", "128")),  # Верхняя граница одновременных последовательностей
-    "max-num-batched-tokens": int(os.environ.get("MAX_NUM_BATCHED_TOKENS", "4096")),  # Лимит токенов в батче
-    "max-seq-len-to-capture": int(os.environ.get("MAX_SEQ_LEN_TO_CAPTURE", "8192")),  # Порог для CUDA графов/захвата
-
-    # Поведение
-    "enable-chunked-prefill": _get_bool_env("ENABLE_CHUNKED_PREFILL", False),  # Разрешить чанковый префилл
-    "enforce-eager": _get_bool_env("ENABLE_ENFORCE_EAGER", False),  # Включить eager-режим (для отладки/совместимости)
-
-    # Swap/Offload
-    "swap-space": int(os.environ.get("SWAP_SPACE", "4")),  # Размер swap-пространства (ГБ) для offload
-    "cpu-offload-gb": os.environ.get("CPU_OFFLOAD_GB", None),  # Принудительный offload на CPU (ГБ), если задан
-}
-
-# Создаём Serve граф
-model = build_app(config)  # Биндим деплой и возвращаем Application — точка входа Ray Serve (serve run python_file:model)
\ No newline at end of file
+def build_config() -> Dict[str, Any]:
+    return {
+        # Базовые
+        "model": _required_env("MODEL_ID"),  # Идентификатор/путь модели (обязателен)
+        "model_name": os.environ.get("MODEL_NAME"),  # Публикуемое имя модели в /v1/models (опционально)
+        "served-model-name": os.environ.get("SERVED_MODEL_NAME", os.environ.get("MODEL_NAME")),  # Альтернативное(ые) имя(мена) сервинга
+        # device можно не указывать — vLLM сам определит; если надо, добавь VLLM_DEVICE
+        "device": os.environ.get("VLLM_DEVICE", None),  # Принудительный выбор устройства ("cuda", "cpu", "rocm") при необходимости
+
+        # Параллелизм
+        "tensor-parallel-size": int(os.environ.get("TENSOR_PARALLELISM", "1")),  # Тензорный параллелизм (TP)
+        "pipeline-parallel-size": int(os.environ.get("PIPELINE_PARALLELISM", "1")),  # Параллелизм по конвейеру (PP)
+
+        # Память/DTYPE/KV-cache
+        "gpu-memory-utilization": os.environ.get("GPU_MEMORY_UTIL", "0.97"),  # Доля GPU-памяти, доступной движку
+        "dtype": os.environ.get("DTYPE", "auto"),  # Тип тензоров (auto/bfloat16/float16/float32 и т.д.)
+        "kv-cache-dtype": os.environ.get("KV_CACHE_DTYPE", "auto"),  # Тип KV-кеша (влияет на память/скорость)
+
+        # Размерности и батчинг
+        "max-model-len": int(os.environ.get("MAX_MODEL_LEN", "4096")),  # Максимальная длина контекста модели
+        "max-num-seqs": int(os.environ.get("MAX_NUM_SEQS", "128")),  # Верхняя граница одновременных последовательностей
+        "max-num-batched-tokens": int(os.environ.get("MAX_NUM_BATCHED_TOKENS", "4096")),  # Лимит токенов в батче
+        "max-seq-len-to-capture": int(os.environ.get("MAX_SEQ_LEN_TO_CAPTURE", "8192")),  # Порог для CUDA графов/захвата
+
+        # Поведение
+        "enable-chunked-prefill": _get_bool_env("ENABLE_CHUNKED_PREFILL", False),  # Разрешить чанковый префилл
+        "enforce-eager": _get_bool_env("ENABLE_ENFORCE_EAGER", False),  # Включить eager-режим (для отладки/совместимости)
+        "scheduling-policy": os.environ.get("SCHEDULING_POLICY", "fcfs"),  # fcfs | priority (приоритеты по ролям, см. admission.py)
+
+        # LoRA (адаптеры — LORA_ADAPTERS / LORA_ADAPTERS_FILE, см. adapters.py)
+        "enable-lora": _get_bool_env("ENABLE_LORA", bool(os.environ.get("LORA_ADAPTERS") or os.environ.get("LORA_ADAPTERS_FILE"))),
+        "max-loras": os.environ.get("MAX_LORAS", None),  # Адаптеров в одном батче (слоты на GPU)
+        "max-lora-rank": os.environ.get("MAX_LORA_RANK", None),  # Максимальный ранг адаптеров
+        "max-cpu-loras": os.environ.get("MAX_CPU_LORAS", None),  # Кеш адаптеров в памяти воркера (>= max-loras)
+
+        # Swap/Offload
+        "swap-space": int(os.environ.get("SWAP_SPACE", "4")),  # Размер swap-пространства (ГБ) для offload
+        "cpu-offload-gb": os.environ.get("CPU_OFFLOAD_GB", None),  # Принудительный offload на CPU (ГБ), если задан
+
+        # Prefix caching (ENABLE_PREFIX_CACHING, PREFIX_CACHING_HASH_ALGO) и спекулятивное декодирование
+        # (SPECULATIVE_METHOD=ngram|eagle|eagle3|draft, SPECULATIVE_MODEL, NUM_SPECULATIVE_TOKENS, ...), см. engine_features.py
+        **engine_feature_args(),
+    }
+
+
+def __getattr__(name: str) -> Any:
+    """
+    config и model собираются при первом обращении (serve run serve:model), а не при импорте модуля:
+    реплики импортируют serve.py ради класса деплоя и не должны заново собирать граф приложения.
+    """
+    if name == "config":
+        globals()["config"] = build_config()
+    elif name == "model":
+        # Создаём Serve граф: биндим деплой и возвращаем Application — точка входа Ray Serve (serve run python_file:model)
+        globals()["model"] = build_app(__getattr__("config"))
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return globals()[name]
\ No newline at end of file
@@ -0,0 +1,200 @@
+import os
+import copy
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from response_cache import ResponseCache
+
+logger = logging.getLogger("ray.serve")
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "vllm_single_flight_requests_total",
+    "Coalescable requests by role: leader (started a generation), follower (attached to one), fallback",
+    ["role"],
+)
+SINGLE_FLIGHT_RATIO = Gauge(
+    "vllm_single_flight_coalescing_ratio", "Share of coalescable requests served by another request's generation"
+)
+SINGLE_FLIGHT_INFLIGHT = Gauge("vllm_single_flight_inflight", "Generations with attached subscribers")
+
+_STREAM = object()  # Итог start() — поток: подписчики читают общий буфер чанков
+
+
+class _Flight:
+    """Одна генерация движка и ее подписчики: итог start() и буфер уже отданных чанков потока."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.subscribers = 0
+        self.outcome: "asyncio.Future[Tuple[Any, bool]]" = asyncio.get_running_loop().create_future()
+        self.chunks: List[Any] = []  # Все чанки с начала: опоздавший подписчик получает их повтором
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых запросов в работе: пока генерация идет, такие же запросы не попадают в движок,
+    а подписываются на нее. Для потока каждый подписчик читает свой SSE из общего буфера (опоздавшие —
+    с начала), для неблокирующего ответа получает копию готового Response.
+
+    Клеим только детерминированные запросы (ключ — ResponseCache.key: temperature=0, n=1, без logprobs)
+    с одинаковыми stream/stream_options; cache_salt входит в ключ, поэтому X-Prefix-Cache: off не клеится.
+    Генерация идет в отдельной задаче и отменяется (abort в движке), только когда уйдут все подписчики.
+    Подписчики получают ответ ведущего целиком, включая id; слот допуска и адаптер держит только ведущий.
+    Через PrefixRouter одинаковые промпты и так попадают на одну реплику — склейка работает и там.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SingleFlight"]:
+        """SINGLE_FLIGHT=0 выключает склейку (None); по умолчанию включена."""
+        if os.environ.get("SINGLE_FLIGHT", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls()
+
+    @staticmethod
+    def key(request: Any, chat_template: Optional[str]) -> Optional[str]:
+        """Ключ склейки или None, если ответ недетерминирован."""
+        base = ResponseCache.key(request, chat_template)
+        if base is None:
+            return None
+        options = request.stream_options.model_dump_json() if request.stream and request.stream_options else ""
+        return f"{base}:{'sse' if request.stream else 'json'}:{options}"
+
+    def _count(self, role: str) -> None:
+        if role == "leader":
+            self.leaders += 1
+        elif role == "follower":
+            self.followers += 1
+        else:
+            self.fallbacks += 1
+        SINGLE_FLIGHT_REQUESTS.labels(role).inc()
+        SINGLE_FLIGHT_RATIO.set(self.followers / (self.leaders + self.followers + self.fallbacks))
+
+    async def run(self, key: str, start: Callable[[], Awaitable[Any]],
+                  shareable: Callable[[Any], bool] = lambda result: True) -> Any:
+        """
+        Итог start() ведущего запроса по ключу: поток (свой итератор на каждого подписчика) или значение.
+        Значение, для которого shareable() ложно (например, 429 ведущего), подписчикам не отдаем:
+        каждый из них выполняет свой start() без склейки.
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _Flight(key)
+            flight.task = asyncio.create_task(self._produce(flight, start, shareable))
+            SINGLE_FLIGHT_INFLIGHT.inc()
+        flight.subscribers += 1
+        try:
+            result, shared = await asyncio.shield(flight.outcome)
+        except BaseException:
+            self._leave(flight)  # Отмена клиента или ошибка start() — генерацию держат остальные
+            raise
+        if result is _STREAM:
+            self._count("leader" if leader else "follower")
+            return self._subscribe(flight)
+        self._leave(flight)
+        if leader:
+            self._count("leader")
+            return result
+        if not shared:
+            self._count("fallback")
+            return await start()
+        self._count("follower")
+        return _clone(result)
+
+    async def _produce(self, flight: _Flight, start: Callable[[], Awaitable[Any]],
+                       shareable: Callable[[Any], bool]) -> None:
+        try:
+            result = await start()
+        except asyncio.CancelledError:
+            self._finish(flight)
+            flight.outcome.cancel()
+            return
+        except BaseException as e:
+            self._finish(flight)
+            flight.outcome.set_exception(e)
+            return
+        if not hasattr(result, "__aiter__"):
+            self._finish(flight)  # Готовый ответ: новые запросы с тем же ключом уже идут в движок
+            flight.outcome.set_result((result, shareable(result)))
+            return
+        flight.outcome.set_result((_STREAM, True))
+        try:
+            async with aclosing(result):  # Закрытие освобождает слот допуска и снимает запрос с движка
+                async for chunk in result:
+                    flight.chunks.append(chunk)
+                    flight.notify()
+        except asyncio.CancelledError:
+            pass  # Ушли все подписчики
+        except BaseException as e:
+            flight.error = e
+            logger.warning(f"[single-flight] shared stream failed: {e}")
+        finally:
+            self._finish(flight)
+
+    async def _subscribe(self, flight: _Flight) -> AsyncIterator[Any]:
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    yield chunk
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            self._leave(flight)
+
+    def _leave(self, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done and flight.task is not None:
+            self._finish(flight)  # Новые запросы не должны подписываться на отменяемую генерацию
+            flight.task.cancel()
+
+    def _finish(self, flight: _Flight) -> None:
+        if flight.done:
+            return
+        flight.done = True
+        flight.notify()
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        SINGLE_FLIGHT_INFLIGHT.dec()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.followers + self.fallbacks
+        return {
+            "inflight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "fallbacks": self.fallbacks,
+            "coalescing_ratio": self.followers / total if total else 0.0,
+        }
+
+
+def _clone(response: Any) -> Any:
+    """Своя копия Response для подписчика: заголовки ответа middleware может дописывать на месте."""
+    clone = copy.copy(response)
+    if hasattr(response, "raw_headers"):
+        clone.raw_headers = list(response.raw_headers)
+    return clone
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("ray.serve")
+
+# Сообщения vLLM о длительности внутренних этапов движка → имя фазы.
+# Видны, только если ядро движка логирует в нашем процессе (VLLM_ENABLE_V1_MULTIPROCESSING=0);
+# при отдельном процессе EngineCore эти этапы остаются внутри фазы engine_init.
+_VLLM_TIMING_PATTERNS = [
+    (re.compile(r"Loading weights took ([\d.]+) seconds"), "engine_init/load_weights"),
+    (re.compile(r"Model loading took [\d.]+ GiB and ([\d.]+) seconds"), "engine_init/model_loading"),
+    (re.compile(r"torch\.compile takes ([\d.]+) s in total"), "engine_init/torch_compile"),
+    (re.compile(r"Graph capturing finished in ([\d.]+) secs"), "engine_init/cuda_graph_capture"),
+    (re.compile(r"init engine \(profile, create kv cache, warmup model\) took ([\d.]+) seconds"),
+     "engine_init/profile_kv_cache_warmup"),
+]
+
+
+def process_age_s() -> Optional[float]:
+    """Секунды с запуска процесса (Linux /proc): время Ray на старт актора и импорт модулей."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _VllmTimingHandler(logging.Handler):
+    """Забирает длительности внутренних этапов из логов vLLM в таймлайн."""
+
+    def __init__(self, timeline: "StartupTimeline"):
+        super().__init__(level=logging.INFO)
+        self.timeline = timeline
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            message = record.getMessage()
+        except Exception:
+            return
+        for pattern, phase in _VLLM_TIMING_PATTERNS:
+            match = pattern.search(message)
+            if match:
+                self.timeline.add(phase, float(match.group(1)), source="vllm-log")
+
+
+class StartupTimeline:
+    """
+    Таймлайн старта реплики: фазы по порядку с началом (от создания таймлайна) и длительностью.
+    report() — JSON-отчет с контекстом (возраст процесса до старта таймлайна, параметры,
+    влияющие на холодный старт); write() сохраняет его в STARTUP_REPORT_DIR.
+    """
+
+    def __init__(self, context: Optional[Dict[str, Any]] = None):
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.process_age_at_start_s = process_age_s()
+        self.context = dict(context or {})
+        self.phases: List[Dict[str, Any]] = []
+        self._handler: Optional[_VllmTimingHandler] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                "name": name,
+                "start_s": round(started - self.started, 4),
+                "duration_s": round(time.perf_counter() - started, 4),
+            })
+
+    def add(self, name: str, duration_s: float, **extra: Any) -> None:
+        """Фаза, измеренная не нами (например, из логов vLLM)."""
+        self.phases.append({"name": name, "start_s": None, "duration_s": round(duration_s, 4), **extra})
+
+    def durations(self) -> Dict[str, float]:
+        return {p["name"]: p["duration_s"] for p in self.phases}
+
+    def capture_vllm_logs(self) -> None:
+        self._handler = _VllmTimingHandler(self)
+        logging.getLogger("vllm").addHandler(self._handler)
+
+    def stop_capture(self) -> None:
+        if self._handler is not None:
+            logging.getLogger("vllm").removeHandler(self._handler)
+            self._handler = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "process_age_at_start_s": self.process_age_at_start_s,  # Старт актора Ray + импорты до __init__
+            "total_s": round(time.perf_counter() - self.started, 4),
+            "phases": self.phases,
+            "context": self.context,
+        }
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.durations().items())
+
+    def write(self, name: str) -> Optional[str]:
+        """Пишет отчет в STARTUP_REPORT_DIR/<name>-<время>.json; ошибки записи не мешают старту."""
+        directory = os.environ.get("STARTUP_REPORT_DIR", os.path.expanduser("~/startup_reports"))
+        path = os.path.join(directory, f"{name}-{int(self.started_at)}.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"[startup] failed to write report {path}: {e}")
+            return None
+        return path
+
+
+# -------------------------
+# Кеш разобранных аргументов движка (AsyncEngineArgs + поля OpenAI-фронта)
+# -------------------------
+def engine_args_cache_key(cli_args: Dict[str, Any], vllm_version: str) -> str:
+    """Ключ — конфиг реплики и версия vLLM (разбор CLI меняется между версиями)."""
+    raw = json.dumps({"cli_args": cli_args, "vllm": vllm_version}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def load_engine_args(cache_dir: str, key: str) -> Optional[Any]:
+    """
+    Результат разбора CLI, сохраненный предыдущей репликой с тем же конфигом: без сборки
+    парсера make_arg_parser и AsyncEngineArgs.from_cli_args.
+    Каталог должен быть доверенным (pickle): это том кластера, а не пользовательские данные.
+    """
+    path = os.path.join(cache_dir, f"engine-args-{key}.pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:  # Битый или несовместимый файл — просто разбираем CLI заново
+        logger.warning(f"[startup] ignoring engine args cache {path}: {e}")
+        return None
+
+
+def save_engine_args(cache_dir: str, key: str, payload: Any) -> None:
+    path = os.path.join(cache_dir, f"engine-args-{key}.pkl")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp, "wb") as f:
+            pickle.dump(payload, f)
+        os.replace(tmp, path)  # Атомарно: параллельные реплики не увидят недописанный файл
+    except Exception as e:
+        logger.warning(f"[startup] failed to save engine args cache {path}: {e}")
@@ -0,0 +1,109 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger("ray.serve")
+
+SLOW_CLIENT_ABORTS = Counter(
+    "vllm_sse_slow_client_aborts_total",
+    "SSE streams aborted because the client did not read fast enough",
+)
+
+
+@dataclass(frozen=True)
+class StreamSettings:
+    """
+    coalesce_ms           — следующее событие забираем у движка не раньше, чем через окно после прошлой записи;
+    slow_client_timeout_s — если запись клиенту (send) висит дольше, стрим обрывается (0 — не обрывать);
+    max_coalesce_ms       — потолок окна из заголовка X-SSE-Coalesce-Ms: большое окно держало бы слот допуска бесконечно.
+    """
+    coalesce_ms: float = 0.0
+    slow_client_timeout_s: float = 0.0
+    max_coalesce_ms: float = 100.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.coalesce_ms > 0 or self.slow_client_timeout_s > 0
+
+    @classmethod
+    def from_env(cls) -> "StreamSettings":
+        return cls(
+            coalesce_ms=float(os.environ.get("SSE_COALESCE_MS", "0")),
+            slow_client_timeout_s=float(os.environ.get("SSE_SLOW_CLIENT_TIMEOUT_S", "0")),
+            max_coalesce_ms=float(os.environ.get("SSE_COALESCE_MAX_MS", "100")),
+        )
+
+    def for_request(self, headers: Optional[Any]) -> "StreamSettings":
+        """
+        Заголовок X-SSE-Coalesce-Ms переопределяет окно для одного запроса (0 — выключить склейку).
+        Нечисловые и бесконечные значения игнорируются, остальные ограничиваются max_coalesce_ms.
+        """
+        value = headers.get("x-sse-coalesce-ms") if headers is not None else None
+        if value is None:
+            return self
+        try:
+            window = float(value)
+        except ValueError:
+            return self
+        if not math.isfinite(window):
+            return self
+        return replace(self, coalesce_ms=min(max(0.0, window), self.max_coalesce_ms))
+
+
+def coalesce(generator: AsyncIterator[str], settings: StreamSettings) -> AsyncIterator[str]:
+    """Стрим со склейкой/обрывом медленных клиентов; при выключенных настройках — исходный генератор."""
+    return _coalesced(generator, settings) if settings.enabled else generator
+
+
+async def _coalesced(generator: AsyncIterator[str], settings: StreamSettings) -> AsyncIterator[str]:
+    """
+    Склейка темпом чтения: пока мы не забираем следующий выход, vLLM (RequestOutputCollector, DELTA)
+    сливает новые токены в один RequestOutput, и OpenAIServingChat строит один chunk на всё окно —
+    меньше сериализации JSON, событий и записей в сокет. Первое событие отдается сразу (TTFT не растет),
+    хвост (finish/usage/[DONE]) может прийти позже на окно-два.
+    Паузу делаем, только если прошлое чтение не ждало движок: при ITL больше окна склеивать нечего,
+    и лишний таймер на каждый токен только добавил бы CPU.
+
+    Медленный клиент: send блокируется, когда буфер транспорта полон. Если запись висит дольше
+    slow_client_timeout_s, закрываем цепочку генераторов под нами — vLLM снимает запрос,
+    admission.guard_stream освобождает слот; следующая итерация здесь завершает стрим.
+    """
+    loop = asyncio.get_running_loop()
+    window = settings.coalesce_ms / 1000.0
+    timeout = settings.slow_client_timeout_s
+    aborted = False
+
+    def abort() -> None:
+        nonlocal aborted
+        aborted = True
+        SLOW_CLIENT_ABORTS.inc()
+        logger.warning(f"[sse] slow client: write blocked for {timeout}s, aborting stream")
+        loop.create_task(generator.aclose())  # Генератор движка сейчас не выполняется — закрыть можно
+
+    last_write = float("-inf")
+    backlog = False  # Прошлое чтение вернулось сразу — у движка есть поток токенов
+    try:
+        while not aborted:
+            wait = last_write + window - time.monotonic()
+            if backlog and wait > 0:
+                await asyncio.sleep(wait)  # Токены копятся в коллекторе vLLM
+            started = time.monotonic()
+            try:
+                event = await generator.__anext__()
+            except StopAsyncIteration:
+                break
+            backlog = time.monotonic() - started < window / 2
+            watchdog = loop.call_later(timeout, abort) if timeout > 0 else None
+            yield event  # Здесь ждем send клиенту
+            if watchdog is not None:
+                watchdog.cancel()
+            last_write = time.monotonic()
+    finally:
+        if not aborted:
+            await generator.aclose()  # Клиент отключился — снимаем генерацию
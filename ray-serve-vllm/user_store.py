@@ -0,0 +1,174 @@
+import os
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger("ray.serve")
+
+
+def hash_password(plain_password: str, salt: str) -> str:
+    """Схема gen_pwd.py: SHA-256 от соли, склеенной с паролем."""
+    return hashlib.sha256((salt + plain_password).encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    username: str
+    hashed_password: str
+    salt: str
+    role: str
+
+    @property
+    def credentials_version(self) -> str:
+        """Короткий отпечаток пароля: refresh-токены, выданные до смены пароля, перестают работать."""
+        return hashlib.sha256((self.salt + self.hashed_password).encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"username": self.username, "hashed_password": self.hashed_password, "role": self.role}
+
+
+def parse_users(source: Mapping[str, str], default_salt: str) -> Dict[str, UserRecord]:
+    """
+    Пользователи в схеме auth.load_users: для каждого псевдонима из USER_LIST
+        ALICE_USERNAME, ALICE_HASHED_PASSWORD, ALICE_ROLE и ALICE_SALT (соль из gen_pwd.py).
+    Без ALICE_SALT солью остается default_salt (JWT_KEY) — хэши, выпущенные раньше, продолжают работать.
+    """
+    users: Dict[str, UserRecord] = {}
+    for alias in [u.strip().upper() for u in source.get("USER_LIST", "").split(",") if u.strip()]:
+        username = source.get(f"{alias}_USERNAME")
+        hashed_password = source.get(f"{alias}_HASHED_PASSWORD")
+        role = source.get(f"{alias}_ROLE")
+        if username and hashed_password and role:
+            users[username] = UserRecord(
+                username=username,
+                hashed_password=hashed_password.lower(),
+                salt=source.get(f"{alias}_SALT") or default_salt,
+                role=role,
+            )
+    return users
+
+
+def read_source(path: str) -> Dict[str, str]:
+    """
+    Каталог смонтированного Kubernetes Secret (файл на ключ) или один файл KEY=VALUE.
+    Значения обрезаются по краям: в файлах секрета часто остается перевод строки.
+    """
+    if os.path.isdir(path):
+        values = {}
+        for entry in os.scandir(path):
+            if entry.name.startswith(".") or not entry.is_file():  # ..data и служебные ссылки kubelet
+                continue
+            with open(entry.path, encoding="utf-8") as f:
+                values[entry.name] = f.read().strip()
+        return values
+    values = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                values[key.strip()] = value.strip().strip("\"'")
+    return values
+
+
+def _fingerprint(path: str) -> Tuple[Any, ...]:
+    """Имена, mtime и размеры файлов: kubelet обновляет секрет атомарной заменой ..data, и цели ссылок меняются."""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return ((path, st.st_mtime_ns, st.st_size),)
+    return tuple(sorted(
+        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in os.scandir(path) if not entry.name.startswith(".")
+    ))
+
+
+class UserStore:
+    """
+    Индекс пользователей в памяти: поиск — один dict.get, без обращения к окружению на запросе.
+    Перезагрузка строит новый индекс целиком и подменяет ссылку, так что читатели никогда не ждут.
+    """
+
+    def __init__(self, users: Dict[str, UserRecord], default_salt: str, source: str = "env"):
+        self.default_salt = default_salt
+        self.source = source
+        self._users = users
+        self.loaded_at = time.time()
+        self.reloads = 0
+
+    def get(self, username: str) -> Optional[UserRecord]:
+        return self._users.get(username)
+
+    def replace(self, users: Dict[str, UserRecord]) -> None:
+        self._users = users  # Присваивание атомарно: запросы видят либо старый, либо новый индекс
+        self.loaded_at = time.time()
+        self.reloads += 1
+
+    def authenticate(self, username: str, plain_password: str) -> Optional[UserRecord]:
+        """Сравнение хэшей за постоянное время; для неизвестного логина хэш тоже считается."""
+        user = self.get(username)
+        salt = user.salt if user else self.default_salt
+        hashed_input = hash_password(plain_password, salt)
+        # Байты, а не str: compare_digest на str с не-ASCII символами (битый файл пользователей) бросает TypeError
+        if user is not None and hmac.compare_digest(hashed_input.encode("utf-8"), user.hashed_password.encode("utf-8")):
+            return user
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.source, "users": len(self._users), "loaded_at": self.loaded_at, "reloads": self.reloads}
+
+    @classmethod
+    def from_env(cls, default_salt: str) -> "UserStore":
+        """
+        USER_STORE_PATH не задан — пользователи из переменных окружения, как раньше (без перезагрузки).
+        Задан — из смонтированного секрета с фоновой перезагрузкой раз в USER_STORE_RELOAD_S секунд.
+        """
+        path = os.environ.get("USER_STORE_PATH")
+        if not path:
+            return cls(parse_users(os.environ, default_salt), default_salt)
+        store = ReloadingUserStore(path, default_salt, float(os.environ.get("USER_STORE_RELOAD_S", "10")))
+        store.start()
+        return store
+
+
+class ReloadingUserStore(UserStore):
+    """UserStore из файла/каталога секрета; фоновый поток перечитывает его при изменении."""
+
+    def __init__(self, path: str, default_salt: str, interval_s: float = 10.0):
+        super().__init__({}, default_salt, source=path)
+        self.path = path
+        self.interval_s = interval_s
+        self._fingerprint: Optional[Tuple[Any, ...]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reload_if_changed()  # Первая загрузка — синхронно, до первого запроса
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает источник, если он изменился; при ошибке оставляет прежний индекс."""
+        try:
+            fingerprint = _fingerprint(self.path)
+            if fingerprint == self._fingerprint:
+                return False
+            users = parse_users(read_source(self.path), self.default_salt)
+        except OSError as e:
+            logger.warning(f"[users] failed to read {self.path}: {e}; keeping {len(self._users)} users")
+            return False
+        self._fingerprint = fingerprint
+        self.replace(users)
+        logger.info(f"[users] loaded {len(users)} users from {self.path}")
+        return True
+
+    def start(self) -> None:
+        if self._thread is None and self.interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="user-store-reload", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.reload_if_changed()